@@ -0,0 +1,174 @@
+"""
+AutosaveJournal class keeps a crash recovery copy of the canvas in a memory-mapped file.
+Every tile has a fixed slot in the file, so a checkpoint only copies the tiles changed since the previous checkpoint.
+The file is sparse: slots of tiles which were never painted take no disk space.
+The application journals the flattened composite of the painting, so a recovered painting has a single layer in the
+RGB32 (or premultiplied ARGB32) format of the composite: the layers and the working pixel format are not recovered.
+
+File layout (little endian):
+    header      HEADER_FORMAT, see below
+    tile table  one byte per tile, 1 if the tile slot holds pixels, 0 if the tile is blank
+    tile slots  the raw pixels of each tile, every slot starts at a multiple of SLOT_ALIGNMENT
+"""
+from PyQt5.QtGui import QColor, QImage
+from PyQt5.QtCore import QLockFile
+
+import mmap
+import os
+import struct
+
+from TiledCanvas import TiledCanvas
+
+MAGIC = b"PQPJRNL1"
+# magic, state, width, height, tile size, image format, background rgba, bytes per line of a tile
+HEADER_FORMAT = "<8sIIIIIII"
+HEADER_SIZE = 64
+SLOT_ALIGNMENT = 4096  # slots are page aligned so that flushing only writes the pages of changed tiles
+
+# header states, a journal left in STATE_WRITING was interrupted in the middle of a checkpoint
+STATE_WRITING = 1
+STATE_CONSISTENT = 2
+
+
+class AutosaveJournal:
+    def __init__(self, path):
+        self.path = path
+        self.lock = QLockFile(path + ".lock")  # one application instance per journal, documentation: https://doc.qt.io/qt-5/qlockfile.html
+        self.locked = False
+
+        self.canvas = None  # the canvas the journal was last written from
+        self.revision = 0  # canvas revision of the last checkpoint
+        self.file = None
+        self.map = None
+        self.columns = self.rows = 0
+        self.slotSize = 0
+        self.dataOffset = 0
+
+    def acquire(self):
+        """Takes the journal lock, returns False if another running instance owns the journal"""
+        if not self.locked:
+            self.locked = self.lock.tryLock(0)
+        return self.locked
+
+    def exists(self):
+        """Returns True if a journal left behind by a previous run can be recovered"""
+        return os.path.exists(self.path) and os.path.getsize(self.path) >= HEADER_SIZE
+
+    def interrupted(self):
+        """Returns True if the journal was left in the middle of a checkpoint, so its tiles may be from two
+        different checkpoints"""
+        with open(self.path, "rb") as f:
+            magic, state = struct.unpack_from("<8sI", f.read(12))
+        return magic == MAGIC and state != STATE_CONSISTENT
+
+    def recover(self, allowInterrupted=False):
+        """Rebuilds the canvas stored in the journal, returns None if the journal cannot be read or, unless
+        allowInterrupted, was interrupted in the middle of a checkpoint"""
+        with open(self.path, "rb") as f:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)  # documentation: https://docs.python.org/3/library/mmap.html
+            try:
+                magic, state, width, height, tileSize, imageFormat, background, bytesPerLine = \
+                    struct.unpack_from(HEADER_FORMAT, data, 0)
+                if magic != MAGIC or (state != STATE_CONSISTENT and not allowInterrupted):
+                    return None
+
+                canvas = TiledCanvas(width, height, QImage.Format(imageFormat), QColor.fromRgba(background), tileSize)
+                columns, rows, slotSize, dataOffset = self.layout(canvas)
+                for index in range(columns * rows):
+                    if data[HEADER_SIZE + index]:
+                        offset = dataOffset + index * slotSize
+                        pixels = data[offset:offset + bytesPerLine * tileSize]
+                        # documentation: https://doc.qt.io/qt-5/qimage.html#QImage-5
+                        tile = QImage(pixels, tileSize, tileSize, bytesPerLine, canvas.format).copy()
+                        canvas.tiles[(index % columns, index // columns)] = tile
+                return canvas
+            finally:
+                data.close()
+
+    def layout(self, canvas):
+        """Returns (columns, rows, slot size, offset of the first slot) of the journal of a canvas"""
+        columns = -(-canvas.width // canvas.tileSize)
+        rows = -(-canvas.height // canvas.tileSize)
+        tileBytes = canvas.blankTile.bytesPerLine() * canvas.tileSize
+        slotSize = -(-tileBytes // SLOT_ALIGNMENT) * SLOT_ALIGNMENT
+        dataOffset = -(-(HEADER_SIZE + columns * rows) // SLOT_ALIGNMENT) * SLOT_ALIGNMENT
+        return columns, rows, slotSize, dataOffset
+
+    def reset(self, canvas):
+        """Recreates the journal for a new or resized canvas and writes all of its painted tiles"""
+        self.close()
+        self.canvas = canvas
+        self.columns, self.rows, self.slotSize, self.dataOffset = self.layout(canvas)
+
+        self.file = open(self.path, "w+b")
+        self.file.truncate(self.dataOffset + self.columns * self.rows * self.slotSize)  # sparse, no blocks are written
+        self.map = mmap.mmap(self.file.fileno(), 0)
+
+        self.setState(STATE_WRITING)
+        for key, tile in canvas.tiles.items():  # a project canvas reads its tiles one at a time without keeping them
+            self.writeTile(key, tile)
+        self.revision = canvas.revision
+        self.setState(STATE_CONSISTENT)
+        self.map.flush()
+
+    def checkpoint(self, canvas):
+        """Writes the tiles changed since the last checkpoint, returns the number of tiles written"""
+        if not self.acquire():
+            return 0
+        if canvas is not self.canvas or (canvas.width, canvas.height) != (self.canvas.width, self.canvas.height) \
+                or self.map is None:
+            self.reset(canvas)
+            return len(canvas.tiles)
+
+        keys = canvas.changedSince(self.revision)
+        if not keys:
+            return 0
+        self.setState(STATE_WRITING)
+        for key in keys:
+            self.writeTile(key)
+        self.revision = canvas.revision
+        self.setState(STATE_CONSISTENT)
+        self.map.flush()  # only the dirty pages are written back
+        return len(keys)
+
+    def writeTile(self, key, tile=None):
+        """Copies one tile, by default the current one, into its slot"""
+        column, row = key
+        if column >= self.columns or row >= self.rows:
+            return
+        index = row * self.columns + column
+        if tile is None:
+            tile = self.canvas.tiles.get(key)
+        if tile is None:
+            self.map[HEADER_SIZE + index] = 0
+        else:
+            offset = self.dataOffset + index * self.slotSize
+            pixels = tile.constBits().asstring(tile.sizeInBytes())
+            self.map[offset:offset + len(pixels)] = pixels
+            self.map[HEADER_SIZE + index] = 1
+
+    def setState(self, state):
+        """Writes the header with the given state"""
+        c = self.canvas
+        header = struct.pack(HEADER_FORMAT, MAGIC, state, c.width, c.height, c.tileSize, int(c.format),
+                             c.background.rgba(), c.blankTile.bytesPerLine())
+        self.map[0:len(header)] = header
+
+    def close(self):
+        """Unmaps and closes the journal file"""
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def discard(self):
+        """Deletes the journal, called when the application exits normally"""
+        self.close()
+        self.canvas = None
+        if self.locked:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            self.lock.unlock()
+            self.locked = False
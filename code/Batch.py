@@ -0,0 +1,229 @@
+"""
+Headless batch mode: applies an operation script to many images on a process pool, one worker per core.
+No window and no display server are needed, the operations use the same drawing code as the Painter.
+
+Usage (from the code directory):
+    python PaintingApplication.py --batch script.json --output out/ image1.png image2.jpg ...
+The results keep the file names of the inputs, so two inputs with the same name are refused.
+
+The script is a JSON list of operations (or {"operations": [...]}) applied in order to every image:
+    {"op": "stroke", "points": [[x, y], ...], "color": "#ff0000", "width": 3, "cap": "round", "join": "round",
+     "style": "solid", "smooth": false}
+    {"op": "recording", "path": "strokes.strokes"}     strokes exported with File > Export Stroke Recording
+    {"op": "fill", "point": [x, y], "color": "#00ff00", "tolerance": 0}
+    {"op": "filter", "name": "Blur", "values": [3]}    a filter of the Filter menu, values default to its defaults
+    {"op": "resize", "width": 800, "height": 600}      either side can be left out to keep the aspect ratio
+    {"op": "scale", "factor": 0.5}
+Coordinates and widths are pixels; with "relative": true they are fractions of the image width and height,
+so one script can annotate images of different sizes.
+"""
+from PyQt5.QtGui import QColor, QImage, QImageReader, QImageWriter
+from PyQt5.QtCore import QPoint, Qt
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import argparse
+import json
+import os
+import sys
+import time
+
+from StrokeRecording import StrokeRecord, StrokeRecording
+from StrokeFilter import StrokeFilter
+import FloodFill
+import Filters
+
+CAPS = {"flat": Qt.FlatCap, "square": Qt.SquareCap, "round": Qt.RoundCap}
+JOINS = {"miter": Qt.MiterJoin, "bevel": Qt.BevelJoin, "round": Qt.RoundJoin}
+STYLES = {"solid": Qt.SolidLine, "dash": Qt.DashLine, "dot": Qt.DotLine}
+
+operations = None  # the operations of the script, loaded once per worker process
+
+
+class BatchError(Exception):
+    """Raised for an invalid operation script"""
+
+
+def loadScript(path):
+    """Reads and checks an operation script, returns its list of operations"""
+    with open(path) as f:
+        script = json.load(f)
+    if isinstance(script, dict):
+        script = script.get("operations", [])
+    if not isinstance(script, list):
+        raise BatchError("{} is not a list of operations".format(path))
+    for index, operation in enumerate(script):
+        if not isinstance(operation, dict):
+            raise BatchError("operation {} in {} is not an object: {!r}".format(index + 1, path, operation))
+        if operation.get("op") not in OPERATIONS:
+            raise BatchError("unknown operation {!r} in {}".format(operation.get("op"), path))
+        if operation["op"] == "filter" and operation.get("name") not in Filters.FILTERS:
+            raise BatchError("unknown filter {!r} in {}".format(operation.get("name"), path))
+    return script
+
+
+def toPoint(image, operation, x, y):
+    """Converts script coordinates into image pixels"""
+    if operation.get("relative"):
+        return QPoint(round(x * image.width()), round(y * image.height()))
+    return QPoint(round(x), round(y))
+
+
+def stroke(image, operation):
+    width = operation.get("width", 2)
+    if operation.get("relative"):
+        width *= image.width()
+    record = StrokeRecord(QColor(operation.get("color", "black")), width,
+                          STYLES[operation.get("style", "solid")], CAPS[operation.get("cap", "round")],
+                          JOINS[operation.get("join", "round")])
+    points = [toPoint(image, operation, x, y) for x, y in operation["points"]]
+    if not points:
+        return image
+    if operation.get("smooth"):
+        points = points[:1] + StrokeFilter(smooth=True).process(None, points[0], points[1:], final=True)
+    record.addPoints(points[:1])  # drawn like a live stroke: the first point, then one polyline
+    if len(points) > 1:
+        record.addPoints(points[1:])
+    recording = StrokeRecording(image.width(), image.height())
+    recording.strokes.append(record)
+    recording.replay(image)
+    return image
+
+
+def replayRecording(image, operation):
+    StrokeRecording.load(operation["path"]).replay(image)
+    return image
+
+
+def fill(image, operation):
+    if not FloodFill.available():
+        raise BatchError("the fill operation requires numpy")
+    FloodFill.fillImage(image, toPoint(image, operation, *operation["point"]), QColor(operation.get("color", "black")),
+                        operation.get("tolerance", 0))
+    return image
+
+
+def applyFilter(image, operation):
+    if not Filters.available():
+        raise BatchError("the filter operation requires numpy")
+    filter = Filters.FILTERS[operation["name"]]
+    values = operation.get("values", filter.defaults())
+    return Filters.filterImage(image, filter, values, parallel=False)  # the pool already uses every core
+
+
+def resize(image, operation):
+    width, height = operation.get("width"), operation.get("height")
+    if width is None and height is None:
+        return image
+    if width is None:
+        width = round(image.width() * height / image.height())
+    if height is None:
+        height = round(image.height() * width / image.width())
+    return image.scaled(width, height, Qt.IgnoreAspectRatio, Qt.SmoothTransformation)
+
+
+def scale(image, operation):
+    factor = operation["factor"]
+    return image.scaled(round(image.width() * factor), round(image.height() * factor), Qt.IgnoreAspectRatio,
+                        Qt.SmoothTransformation)
+
+
+OPERATIONS = {
+    "stroke": stroke,
+    "recording": replayRecording,
+    "fill": fill,
+    "filter": applyFilter,
+    "resize": resize,
+    "scale": scale,
+}
+
+
+def initWorker(scriptPath):
+    """Loads the script once in every worker process"""
+    global operations
+    operations = loadScript(scriptPath)
+
+
+def processImage(inputPath, outputPath):
+    """Applies the script to one image, returns (input path, megapixels, error message or None)"""
+    reader = QImageReader(inputPath)  # documentation: https://doc.qt.io/qt-5/qimagereader.html
+    image = reader.read()
+    if image.isNull():
+        return inputPath, 0, "could not open: {}".format(reader.errorString())
+    megapixels = image.width() * image.height() / 1e6
+
+    # the same pixel format as a painting, an alpha channel is kept
+    image = image.convertToFormat(QImage.Format_ARGB32 if image.hasAlphaChannel() else QImage.Format_RGB32)
+    try:
+        for operation in operations:
+            image = OPERATIONS[operation["op"]](image, operation)
+    except (BatchError, KeyError, TypeError, ValueError, OSError) as error:
+        return inputPath, megapixels, "{}: {}".format(type(error).__name__, error)
+
+    writer = QImageWriter(outputPath)  # documentation: https://doc.qt.io/qt-5/qimagewriter.html
+    if not writer.write(image):
+        return inputPath, megapixels, "could not save {}: {}".format(outputPath, writer.errorString())
+    return inputPath, megapixels, None
+
+
+def outputPath(inputPath, directory, imageFormat=None):
+    name, extension = os.path.splitext(os.path.basename(inputPath))
+    return os.path.join(directory, name + ("." + imageFormat if imageFormat else extension))
+
+
+def outputPaths(inputPaths, directory, imageFormat=None):
+    """Returns the output path of every input, raises BatchError if two inputs would be written to the same file"""
+    outputs = {}
+    for inputPath in inputPaths:
+        path = outputPath(inputPath, directory, imageFormat)
+        key = os.path.normcase(os.path.abspath(path))
+        if key in outputs:
+            raise BatchError("{} and {} would both be written to {}".format(outputs[key][0], inputPath, path))
+        outputs[key] = inputPath, path
+    return [path for _, path in outputs.values()]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="PaintingApplication.py --batch",
+                                     description="Applies an operation script to images without opening a window")
+    parser.add_argument("script", help="JSON operation script")
+    parser.add_argument("images", nargs="+", help="input images")
+    parser.add_argument("--output", "-o", required=True, help="directory the results are written into")
+    parser.add_argument("--format", help="file format of the results, e.g. png, by default the input format")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="worker processes, one per core by default")
+    args = parser.parse_args(argv)
+
+    try:
+        loadScript(args.script)  # reports a broken script before any worker starts
+    except (OSError, ValueError, BatchError) as error:
+        print("Invalid script: {}".format(error), file=sys.stderr)
+        return 2
+    try:
+        outputs = outputPaths(args.images, args.output, args.format)
+    except BatchError as error:
+        print("Conflicting outputs: {}".format(error), file=sys.stderr)
+        return 2
+    os.makedirs(args.output, exist_ok=True)
+
+    start = time.perf_counter()
+    done, failed, megapixels = 0, 0, 0.0
+    # documentation: https://docs.python.org/3/library/concurrent.futures.html#processpoolexecutor
+    with ProcessPoolExecutor(max_workers=args.workers, initializer=initWorker, initargs=(args.script,)) as pool:
+        futures = [pool.submit(processImage, path, output) for path, output in zip(args.images, outputs)]
+        for future in as_completed(futures):  # results are reported as soon as each image is written
+            path, pixels, error = future.result()
+            megapixels += pixels
+            if error is None:
+                done += 1
+                print("ok     {}".format(path), flush=True)
+            else:
+                failed += 1
+                print("failed {}: {}".format(path, error), flush=True)
+
+    seconds = time.perf_counter() - start
+    print("{} images ({} failed) in {:.2f} s: {:.1f} images/s, {:.1f} megapixels/s with {} workers".format(
+        done + failed, failed, seconds, (done + failed) / seconds, megapixels / seconds, args.workers))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
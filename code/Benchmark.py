@@ -0,0 +1,467 @@
+"""
+Benchmark suite for the hot paths of the Painter: mouseMoveEvent, paintEvent, resizeEvent, open and save.
+Runs without a display on the offscreen Qt platform and prints the results as JSON.
+
+Usage (from the code directory):
+    python Benchmark.py [--quick] [--output results.json] [--baseline old.json [--tolerance 0.25]]
+
+Every case runs in its own process so the reported peak memory belongs to that case only. The session cases start a
+SessionServer and one process per client, which paint at the same time and have to end up with the same canvas.
+With --baseline the run fails (exit code 1) if a latency percentile got slower than the tolerance allows.
+"""
+import os
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")  # must be set before Qt creates the application
+
+import argparse
+import hashlib
+import json
+import math
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+try:
+    import resource  # not available on Windows
+except ImportError:
+    resource = None
+
+# synthetic mouse streams, canvas sizes and brushes the cases are built from
+STREAMS = ["randomWalk", "straightLine", "scribble"]
+CANVAS_SIZES = [(800, 600), (1920, 1080), (4096, 4096)]
+BRUSHES = {
+    "thin": {"width": 2, "cap": "FlatCap", "join": "MiterJoin", "style": "SolidLine"},
+    "wide": {"width": 25, "cap": "RoundCap", "join": "RoundJoin", "style": "SolidLine"},
+    "dashed": {"width": 9, "cap": "SquareCap", "join": "BevelJoin", "style": "DashLine"},
+}
+# working pixel formats compared on one brush and stream, the other cases use RGB32
+PIXEL_FORMATS = ["ARGB32_Premultiplied", "Grayscale8", "Indexed8"]
+SESSION_CLIENTS = [4, 24]  # client processes of the shared session cases
+VIEWPORT = (1280, 800)  # size of the Painter widget
+EVENTS_PER_FRAME = 2  # a 120 Hz pointer on a 60 Hz display
+
+
+def percentiles(samples):
+    """Returns the usual latency percentiles of a list of seconds, in microseconds"""
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+
+    def at(fraction):
+        return round(ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] * 1e6, 1)
+
+    return {"p50": at(0.5), "p90": at(0.9), "p99": at(0.99), "max": round(ordered[-1] * 1e6, 1),
+            "mean": round(sum(ordered) / len(ordered) * 1e6, 1), "count": len(ordered)}
+
+
+def peakMemory():
+    """Returns the peak resident memory of this process in bytes, None if unknown"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if platform.system() == "Darwin" else peak * 1024  # Linux reports kilobytes
+
+
+def mouseStream(kind, count, width, height, seed=0):
+    """Returns a list of (x, y) widget positions of a synthetic stroke"""
+    rng = random.Random(seed)
+    if kind == "randomWalk":
+        x, y, points = width / 2, height / 2, []
+        for _ in range(count):
+            x = min(max(x + rng.uniform(-8, 8), 0), width - 1)
+            y = min(max(y + rng.uniform(-8, 8), 0), height - 1)
+            points.append((int(x), int(y)))
+        return points
+    if kind == "straightLine":
+        return [(int(10 + (width - 20) * i / count), int(height / 2)) for i in range(count)]
+    if kind == "scribble":
+        # dense back and forth strokes inside a small area
+        return [(int(width / 2 + 60 * math.sin(i * 0.9)), int(height / 2 + 40 * math.sin(i * 0.13))) for i in range(count)]
+    raise ValueError("unknown stream {}".format(kind))
+
+
+def strokeCase(case):
+    """Draws one synthetic stroke and measures mouseMoveEvent and paintEvent"""
+    from PyQt5.QtWidgets import QApplication
+    from PyQt5.QtGui import QImage, QMouseEvent
+    from PyQt5.QtCore import QEvent, QPoint, Qt
+    from Painter import Painter
+    from TiledCanvas import TiledCanvas
+
+    app = QApplication.instance() or QApplication(sys.argv)
+    paintTimes = []
+
+    class TimedPainter(Painter):
+        def paintEvent(self, event):
+            start = time.perf_counter()
+            super().paintEvent(event)
+            paintTimes.append(time.perf_counter() - start)
+
+    painter = TimedPainter()
+    painter.resize(*VIEWPORT)
+    painter.show()
+    app.processEvents()
+
+    width, height = case["canvas"]
+    imageFormat = getattr(QImage, "Format_" + case.get("pixelFormat", "RGB32"))
+    painter.setCanvas(TiledCanvas(width, height, imageFormat, Qt.white))
+    brush = BRUSHES[case["brush"]]
+    painter.brushWidth = brush["width"]
+    painter.brushCap = getattr(Qt, brush["cap"])
+    painter.brushJoin = getattr(Qt, brush["join"])
+    painter.brushStyle = getattr(Qt, brush["style"])
+    app.processEvents()
+    paintTimes.clear()
+
+    points = mouseStream(case["stream"], case["events"], min(width, VIEWPORT[0]), min(height, VIEWPORT[1]))
+    moveTimes = []
+    start = time.perf_counter()
+    QApplication.sendEvent(painter, QMouseEvent(QEvent.MouseButtonPress, QPoint(*points[0]), Qt.LeftButton,
+                                                Qt.LeftButton, Qt.NoModifier))
+    for index, point in enumerate(points[1:], 1):
+        event = QMouseEvent(QEvent.MouseMove, QPoint(*point), Qt.NoButton, Qt.LeftButton, Qt.NoModifier)
+        eventStart = time.perf_counter()
+        QApplication.sendEvent(painter, event)
+        moveTimes.append(time.perf_counter() - eventStart)
+        if index % EVENTS_PER_FRAME == 0:
+            app.processEvents()  # lets Qt deliver the paint event of this frame
+    QApplication.sendEvent(painter, QMouseEvent(QEvent.MouseButtonRelease, QPoint(*points[-1]), Qt.LeftButton,
+                                                Qt.NoButton, Qt.NoModifier))
+    app.processEvents()
+    total = time.perf_counter() - start
+
+    return {"mouseMoveEventUs": percentiles(moveTimes), "paintEventUs": percentiles(paintTimes),
+            "strokeSeconds": round(total, 4), "eventsPerSecond": round(len(points) / total, 1),
+            "tiles": len(painter.canvas.tiles), "canvasBytes": painter.canvas.memoryUsage()}
+
+
+def resizeCase(case):
+    """Resizes the Painter widget back and forth and measures resizeEvent"""
+    from PyQt5.QtWidgets import QApplication
+    from Painter import Painter
+
+    app = QApplication.instance() or QApplication(sys.argv)
+    resizeTimes = []
+
+    class TimedPainter(Painter):
+        def resizeEvent(self, event):
+            start = time.perf_counter()
+            super().resizeEvent(event)
+            resizeTimes.append(time.perf_counter() - start)
+
+    painter = TimedPainter()
+    painter.show()
+    painter.openImage(syntheticImage(*case["canvas"]))
+    app.processEvents()
+    resizeTimes.clear()
+
+    for index in range(case["events"]):
+        painter.resize(640 + (index * 37) % 640, 480 + (index * 23) % 400)
+        app.processEvents()
+    return {"resizeEventUs": percentiles(resizeTimes)}
+
+
+def fileCase(case):
+    """Opens and saves an image through PaintingApplication and measures both"""
+    from PyQt5.QtWidgets import QApplication, QFileDialog
+    from PyQt5.QtGui import QImage
+    from PaintingApplication import PaintingApplication
+
+    app = QApplication.instance() or QApplication(sys.argv)
+    window = PaintingApplication()
+    window.show()
+    app.processEvents()
+
+    directory = tempfile.mkdtemp()
+    source = os.path.join(directory, "source." + case["format"])
+    target = os.path.join(directory, "target." + case["format"])
+    image = syntheticImage(*case["canvas"])
+    if "pixelFormat" in case:
+        image = image.convertToFormat(getattr(QImage, "Format_" + case["pixelFormat"]))
+    image.save(source)
+
+    QFileDialog.getOpenFileName = staticmethod(lambda *args, **kwargs: (source, ""))
+    QFileDialog.getSaveFileName = staticmethod(lambda *args, **kwargs: (target, ""))
+    window.saveOptions = lambda filePath: (-1, -1)  # encoder defaults, no dialog
+
+    start = time.perf_counter()
+    window.open()
+    while window.openTask is not None:
+        app.processEvents()
+        time.sleep(0.001)
+    openSeconds = time.perf_counter() - start
+    canvasBytes = window.painter.layers.background().canvas.memoryUsage()  # in the working format picked from the file
+
+    start = time.perf_counter()
+    window.save()
+    saveBlocking = time.perf_counter() - start  # time the GUI thread was busy
+    while window.saveTasks:
+        app.processEvents()
+        time.sleep(0.001)
+    saveSeconds = time.perf_counter() - start
+
+    for path in (source, target):
+        if os.path.exists(path):
+            os.remove(path)
+    os.rmdir(directory)
+    return {"openSeconds": round(openSeconds, 4), "saveSeconds": round(saveSeconds, 4),
+            "saveBlockingMs": round(saveBlocking * 1e3, 3), "canvasBytes": canvasBytes}
+
+
+def syntheticImage(width, height):
+    """Returns a QImage with some structure so that encoders do real work"""
+    from PyQt5.QtGui import QColor, QImage, QPainter
+
+    image = QImage(width, height, QImage.Format_RGB32)
+    image.fill(QColor(255, 255, 255))
+    imagePainter = QPainter(image)
+    rng = random.Random(1)
+    for _ in range(200):
+        imagePainter.fillRect(rng.randrange(width), rng.randrange(height), rng.randrange(1, 200), rng.randrange(1, 200),
+                              QColor(rng.randrange(256), rng.randrange(256), rng.randrange(256)))
+    imagePainter.end()
+    return image
+
+
+def readLine(process, expected):
+    """Waits for a line of a child process and fails if it is not the expected one"""
+    line = process.stdout.readline().strip()
+    if line != expected:
+        raise RuntimeError("expected {!r} from a session client, got {!r}".format(expected, line))
+
+
+def sessionCase(case):
+    """Lets several client processes paint on one shared session at the same time, then joins one more late.
+    Measures how long the server takes to acknowledge an op and checks that every client ends with the same canvas"""
+    here = os.path.dirname(os.path.abspath(__file__))
+    width, height = case["canvas"]
+    server = subprocess.Popen([sys.executable, os.path.join(here, "SessionServer.py"), "--port", "0",
+                               "--size", "{}x{}".format(width, height)], stdout=subprocess.PIPE, text=True, cwd=here)
+    try:
+        port = int(server.stdout.readline().rsplit(":", 1)[1])
+
+        def startClient(index, events):
+            options = {"port": port, "index": index, "events": events, "canvas": case["canvas"]}
+            return subprocess.Popen([sys.executable, os.path.abspath(__file__), "--session-client", json.dumps(options)],
+                                    stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True, cwd=here)
+
+        clients = [startClient(index, case["events"]) for index in range(case["clients"])]
+        for client in clients:
+            readLine(client, "joined")
+        start = time.perf_counter()
+        for command, reply in (("draw", "drawn"), ("finish", None)):
+            for client in clients:
+                client.stdin.write(command + "\n")
+                client.stdin.flush()
+            if reply is not None:
+                for client in clients:
+                    readLine(client, reply)
+        results = [json.loads(client.stdout.readline()) for client in clients]
+        seconds = time.perf_counter() - start
+
+        late = startClient(len(clients), 0)
+        readLine(late, "joined")
+        late.stdin.write("draw\nfinish\n")
+        late.stdin.flush()
+        readLine(late, "drawn")
+        lateResult = json.loads(late.stdout.readline())
+        for client in clients + [late]:
+            client.wait()
+    finally:
+        server.terminate()
+        server.wait()
+
+    acknowledged = [seconds for result in results for seconds in result["ackSeconds"]]
+    return {"ackUs": percentiles(acknowledged), "sessionSeconds": round(seconds, 4),
+            "converged": len({result["digest"] for result in results + [lateResult]}) == 1,
+            "joinSeconds": round(max(result["joinSeconds"] for result in results), 4),
+            "lateJoinSeconds": round(lateResult["joinSeconds"], 4), "snapshotBytes": lateResult["bytesReceived"],
+            "bytesSentPerClient": round(sum(result["bytesSent"] for result in results) / len(results)),
+            "bytesReceivedPerClient": round(sum(result["bytesReceived"] for result in results) / len(results))}
+
+
+def sessionClient(options):
+    """A client process of sessionCase, it paints when told to on stdin and prints its results as JSON"""
+    from PyQt5.QtWidgets import QApplication
+    from PyQt5.QtGui import QMouseEvent
+    from PyQt5.QtCore import QEvent, QPoint, Qt
+    from Painter import Painter
+    from SessionClient import SessionClient
+
+    app = QApplication.instance() or QApplication(sys.argv)
+    ackTimes = []
+
+    class TimedClient(SessionClient):
+        def addUnacknowledged(self, kind, payload):
+            super().addUnacknowledged(kind, payload)
+            sent.append(time.perf_counter())
+
+        def acknowledge(self, kind, payload):
+            if sent:
+                ackTimes.append(time.perf_counter() - sent.pop(0))
+            super().acknowledge(kind, payload)
+
+    sent = []
+    painter = Painter()
+    painter.resize(*VIEWPORT)
+    painter.show()
+    client = TimedClient(painter, "benchmark {}".format(options["index"]))
+    start = time.perf_counter()
+    client.join("127.0.0.1", options["port"])
+    while not client.isJoined():
+        app.processEvents()
+        time.sleep(0.001)
+        if not client.active or time.perf_counter() - start > 30:
+            raise RuntimeError("could not join the session")
+    joinSeconds = time.perf_counter() - start
+    print("joined", flush=True)
+
+    sys.stdin.readline()
+    if options["events"]:
+        painter.brushWidth = 5 + options["index"] % 20
+        painter.brushColor = [Qt.blue, Qt.red, Qt.darkGreen, Qt.black][options["index"] % 4]
+        # every client walks over the same area, so the strokes of the clients cross each other
+        width, height = options["canvas"]
+        points = mouseStream("randomWalk", options["events"], min(width, VIEWPORT[0]), min(height, VIEWPORT[1]),
+                             options["index"])
+        QApplication.sendEvent(painter, QMouseEvent(QEvent.MouseButtonPress, QPoint(*points[0]), Qt.LeftButton,
+                                                    Qt.LeftButton, Qt.NoModifier))
+        for index, point in enumerate(points[1:], 1):
+            QApplication.sendEvent(painter, QMouseEvent(QEvent.MouseMove, QPoint(*point), Qt.NoButton, Qt.LeftButton,
+                                                        Qt.NoModifier))
+            if index % EVENTS_PER_FRAME == 0:
+                app.processEvents()
+                time.sleep(0.004)  # a 120 Hz pointer
+        QApplication.sendEvent(painter, QMouseEvent(QEvent.MouseButtonRelease, QPoint(*points[-1]), Qt.LeftButton,
+                                                    Qt.NoButton, Qt.NoModifier))
+    client.sendFrame()
+    while client.socket.bytesToWrite():  # the ops have to leave before the process waits on stdin
+        client.socket.waitForBytesWritten(1000)
+    print("drawn", flush=True)
+
+    sys.stdin.readline()
+    # the batches of the others keep arriving until every client is done, wait until the session went quiet
+    received, quiet = client.bytesReceived, time.perf_counter()
+    while client.unacknowledged or time.perf_counter() - quiet < 1:
+        app.processEvents()
+        time.sleep(0.002)
+        if client.bytesReceived != received:
+            received, quiet = client.bytesReceived, time.perf_counter()
+    image = painter.layers.background().canvas.toImage()
+    print(json.dumps({"joinSeconds": joinSeconds, "ackSeconds": ackTimes, "bytesSent": client.bytesSent,
+                      "bytesReceived": client.bytesReceived,
+                      "digest": hashlib.sha1(image.constBits().asstring(image.sizeInBytes())).hexdigest()}), flush=True)
+
+
+RUNNERS = {"stroke": strokeCase, "resize": resizeCase, "file": fileCase, "session": sessionCase}
+
+
+def runCase(case):
+    """Runs one case in this process and returns its result"""
+    result = dict(case)
+    start = time.perf_counter()
+    result.update(RUNNERS[case["kind"]](case))
+    result["wallSeconds"] = round(time.perf_counter() - start, 4)
+    result["peakMemoryBytes"] = peakMemory()
+    return result
+
+
+def buildCases(quick):
+    """Returns the list of cases of a full or a quick run"""
+    sizes = CANVAS_SIZES[:2] if quick else CANVAS_SIZES
+    events = 300 if quick else 2000
+    cases = []
+    for size in sizes:
+        for brush in BRUSHES:
+            for stream in STREAMS:
+                cases.append({"kind": "stroke", "canvas": size, "brush": brush, "stream": stream, "events": events})
+        for pixelFormat in PIXEL_FORMATS:
+            cases.append({"kind": "stroke", "canvas": size, "brush": "wide", "stream": "scribble", "events": events,
+                          "pixelFormat": pixelFormat})
+        cases.append({"kind": "resize", "canvas": size, "events": 20 if quick else 100})
+        for imageFormat in ("png", "jpg"):
+            cases.append({"kind": "file", "canvas": size, "format": imageFormat})
+        cases.append({"kind": "file", "canvas": size, "format": "png", "pixelFormat": "Grayscale8"})
+    for clients in SESSION_CLIENTS[:1] if quick else SESSION_CLIENTS:
+        cases.append({"kind": "session", "canvas": CANVAS_SIZES[1], "clients": clients, "events": events})
+    return cases
+
+
+def caseName(case):
+    parts = [case["kind"], "x".join(str(value) for value in case["canvas"])]
+    parts += [str(case[key]) for key in ("brush", "stream", "format", "pixelFormat", "clients") if key in case]
+    return "/".join(parts)
+
+
+def compare(results, baseline, tolerance):
+    """Returns the descriptions of the percentiles which got slower than the baseline allows"""
+    old = {caseName(result): result for result in baseline["results"]}
+    regressions = []
+    for result in results:
+        previous = old.get(caseName(result))
+        if previous is None:
+            continue
+        for metric in ("mouseMoveEventUs", "paintEventUs", "resizeEventUs", "ackUs"):
+            for percentile in ("p50", "p90"):
+                now = result.get(metric, {}).get(percentile)
+                before = previous.get(metric, {}).get(percentile)
+                if now is not None and before and now > before * (1 + tolerance):
+                    regressions.append("{} {} {}: {} -> {}".format(caseName(result), metric, percentile, before, now))
+        for metric in ("openSeconds", "saveSeconds"):
+            now, before = result.get(metric), previous.get(metric)
+            if now is not None and before and now > before * (1 + tolerance):
+                regressions.append("{} {}: {} -> {}".format(caseName(result), metric, before, now))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks the Painter hot paths on the offscreen platform")
+    parser.add_argument("--quick", action="store_true", help="fewer events and only the smaller canvases")
+    parser.add_argument("--output", help="write the JSON results into this file instead of stdout")
+    parser.add_argument("--baseline", help="JSON results of an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown against the baseline")
+    parser.add_argument("--case", help=argparse.SUPPRESS)  # internal: run one JSON encoded case in this process
+    parser.add_argument("--session-client", help=argparse.SUPPRESS)  # internal: a client process of a session case
+    args = parser.parse_args()
+
+    if args.session_client:
+        sessionClient(json.loads(args.session_client))
+        return 0
+    if args.case:
+        print(json.dumps(runCase(json.loads(args.case))))
+        return 0
+
+    results = []
+    for case in buildCases(args.quick):
+        output = subprocess.run([sys.executable, os.path.abspath(__file__), "--case", json.dumps(case)],
+                                cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True)
+        if output.returncode != 0:
+            results.append(dict(case, error=output.stderr.strip().splitlines()[-1:]))
+        else:
+            results.append(json.loads(output.stdout.strip().splitlines()[-1]))
+        print(caseName(case), file=sys.stderr)
+
+    report = {"environment": {"python": platform.python_version(), "platform": platform.platform(),
+                              "qpa": os.environ.get("QT_QPA_PLATFORM")},
+              "results": results}
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+    else:
+        print(text)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print("regression:", regression, file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
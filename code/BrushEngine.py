@@ -0,0 +1,220 @@
+"""
+Stamp based brush engine for soft brushes. A stroke is drawn as a row of dabs spaced along the pointer path;
+every dab is a small premultiplied image of a soft ellipse. Dab images are rasterized once and kept in an LRU cache
+keyed on the quantized brush parameters, so stamping only blits a cached image even at high pointer rates.
+Tablet pressure changes the size and/or opacity of the dabs, tilt flattens and rotates them.
+"""
+from PyQt5.QtGui import QColor, QImage, QPainter, QPen, QRadialGradient
+from PyQt5.QtCore import QPointF, QRect, QRectF, Qt
+
+from collections import OrderedDict
+import math
+
+from StrokeSession import StrokeSession
+from Profiler import profiler
+
+DAB_CACHE_SIZE = 512  # dab images kept, a dab of a 100 px brush takes about 40 KB
+
+# quantization steps of the cache key, finer steps than these are not visible but would defeat the cache
+SIZE_STEP = 0.5  # pixels
+HARDNESS_STEP = 0.05
+OPACITY_STEP = 1 / 64
+ROTATION_STEP = 5  # degrees
+ROUNDNESS_STEP = 0.05
+
+MAX_TILT = 60  # degrees of tilt at which a dab is as flat as it gets
+MAX_BRUSH_WIDTH = 25  # pixels, the widest brush the brush width slider offers
+
+
+class DabBrush:
+    """Settings of the soft brush, the diameter comes from the brush width of the painter"""
+
+    def __init__(self, hardness=0.5, spacing=0.15, opacity=1.0, rotation=0.0, roundness=1.0,
+                 pressureSize=True, pressureOpacity=False, minimumSize=0.2):
+        self.hardness = hardness  # 0 fades from the centre, 1 is a hard edged disc
+        self.spacing = spacing  # distance between two dabs as a fraction of the diameter
+        self.opacity = opacity  # opacity of a single dab, overlapping dabs build up
+        self.rotation = rotation  # degrees
+        self.roundness = roundness  # height / width of the dab ellipse
+        self.pressureSize = pressureSize
+        self.pressureOpacity = pressureOpacity
+        self.minimumSize = minimumSize  # fraction of the diameter at the lightest pressure
+
+    def dabParameters(self, width, pressure=1.0, xTilt=0, yTilt=0):
+        """Returns (diameter, opacity, rotation, roundness) of a dab for the pointer state"""
+        diameter = width
+        if self.pressureSize:
+            diameter *= self.minimumSize + (1 - self.minimumSize) * pressure
+        opacity = self.opacity * pressure if self.pressureOpacity else self.opacity
+
+        rotation, roundness = self.rotation, self.roundness
+        tilt = min(math.hypot(xTilt, yTilt), MAX_TILT)
+        if tilt > 0:
+            # a tilted pen touches the paper with an ellipse stretched along the direction it leans to
+            rotation += math.degrees(math.atan2(yTilt, xTilt))
+            roundness *= 1 - 0.7 * tilt / MAX_TILT
+        return diameter, opacity, rotation, roundness
+
+
+class DabCache:
+    def __init__(self, capacity=DAB_CACHE_SIZE):
+        self.capacity = capacity
+        self.dabs = OrderedDict()  # key -> QImage, least recently used first
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, color, diameter, hardness, opacity, rotation, roundness):
+        """Returns the quantized parameters a dab is cached under"""
+        return (QColor(color).rgba(), max(1, round(diameter / SIZE_STEP)), round(hardness / HARDNESS_STEP),
+                round(opacity / OPACITY_STEP), round((rotation % 180) / ROTATION_STEP) % round(180 / ROTATION_STEP),
+                max(1, round(roundness / ROUNDNESS_STEP)))
+
+    @staticmethod
+    def validKey(key):
+        """Returns whether a cache key, e.g. one received from another painter, is one key() can return for a brush
+        no wider than MAX_BRUSH_WIDTH"""
+        if len(key) != 6 or not all(isinstance(value, int) for value in key):
+            return False
+        rgba, size, hardness, opacity, rotation, roundness = key
+        return 0 <= rgba <= 0xffffffff and 1 <= size <= round(MAX_BRUSH_WIDTH / SIZE_STEP) and \
+            0 <= hardness <= round(1 / HARDNESS_STEP) and 0 <= opacity <= round(1 / OPACITY_STEP) and \
+            0 <= rotation < round(180 / ROTATION_STEP) and 1 <= roundness <= round(1 / ROUNDNESS_STEP)
+
+    def dab(self, color, diameter, hardness, opacity, rotation, roundness):
+        """Returns the dab image of the parameters, rasterizing it only when it is not cached"""
+        return self.dabForKey(self.key(color, diameter, hardness, opacity, rotation, roundness))
+
+    def dabForKey(self, key):
+        """Returns the dab image of a cache key, e.g. of a dab stamped by another painter"""
+        image = self.dabs.get(key)
+        if image is not None:
+            self.dabs.move_to_end(key)
+            self.hits += 1
+            return image
+
+        self.misses += 1
+        image = self.dabs[key] = self.render(key)
+        if len(self.dabs) > self.capacity:
+            self.dabs.popitem(last=False)
+        return image
+
+    @staticmethod
+    def render(key):
+        """Rasterizes the dab of a cache key, so every dab with the same key looks exactly the same"""
+        rgba, size, hardness, opacity, rotation, roundness = key
+        radius = size * SIZE_STEP / 2
+        hardness = min(hardness * HARDNESS_STEP, 1)
+        color = QColor.fromRgba(rgba)
+        color.setAlphaF(color.alphaF() * min(opacity * OPACITY_STEP, 1))
+
+        side = math.ceil(radius * 2) + 2  # one pixel of antialiasing on every side
+        image = QImage(side, side, QImage.Format_ARGB32_Premultiplied)
+        image.fill(Qt.transparent)
+        dabPainter = QPainter(image)
+        dabPainter.setRenderHint(QPainter.Antialiasing)
+        dabPainter.translate(side / 2, side / 2)
+        dabPainter.rotate(rotation * ROTATION_STEP)
+        dabPainter.scale(1, roundness * ROUNDNESS_STEP)
+
+        gradient = QRadialGradient(QPointF(0, 0), radius)  # documentation: https://doc.qt.io/qt-5/qradialgradient.html
+        transparent = QColor(color)
+        transparent.setAlpha(0)
+        gradient.setColorAt(0, color)
+        gradient.setColorAt(min(hardness, 0.999), color)
+        gradient.setColorAt(1, transparent)
+        dabPainter.setPen(Qt.NoPen)
+        dabPainter.setBrush(gradient)
+        dabPainter.drawEllipse(QPointF(0, 0), radius, radius)
+        dabPainter.end()
+        return image
+
+    def clear(self):
+        self.dabs.clear()
+
+
+dabCache = DabCache()  # shared by all soft brush strokes
+
+
+class DabSample:
+    """A pointer position of a soft brush stroke with the tablet state at that position"""
+
+    def __init__(self, point, pressure=1.0, xTilt=0, yTilt=0):
+        self.point = QPointF(point)
+        self.pressure = pressure
+        self.xTilt = xTilt
+        self.yTilt = yTilt
+
+    def interpolated(self, other, t):
+        return DabSample(self.point + (other.point - self.point) * t, self.pressure + (other.pressure - self.pressure) * t,
+                         self.xTilt + (other.xTilt - self.xTilt) * t, self.yTilt + (other.yTilt - self.yTilt) * t)
+
+
+class DabStrokeSession(StrokeSession):
+    """A StrokeSession stamping cached dabs instead of drawing polylines with a QPen"""
+
+    def __init__(self, painter, canvas, brush, cache=None):
+        super().__init__(painter, canvas)  # dab strokes are not recorded, a StrokeRecording only replays pen strokes
+        self.brush = brush
+        self.cache = cache if cache is not None else dabCache
+        self.pen = QPen(Qt.NoPen)
+        self.untilNextDab = 0.0  # distance along the path to the next dab
+
+    def updatePen(self):
+        """Dab strokes do not use a pen"""
+
+    def stamp(self, sample):
+        """Blits the dab of a sample onto the tiles under it and returns the canvas rectangle it covers"""
+        p = self.painter
+        diameter, opacity, rotation, roundness = self.brush.dabParameters(p.brushWidth, sample.pressure, sample.xTilt,
+                                                                          sample.yTilt)
+        dab = self.cache.dab(p.brushColor, diameter, self.brush.hardness, opacity, rotation, roundness)
+        topLeft = sample.point - QPointF(dab.width() / 2, dab.height() / 2)
+        rect = QRectF(topLeft, QRectF(dab.rect()).size()).toAlignedRect()
+        for tilePainter in self.paintersFor(rect):
+            tilePainter.drawImage(topLeft, dab)
+        if p.dabListeners:
+            key = self.cache.key(p.brushColor, diameter, self.brush.hardness, opacity, rotation, roundness)
+            for listener in p.dabListeners:
+                listener(self.canvas, key, topLeft)
+        return rect, diameter
+
+    def begin(self, point, pressure=1.0, xTilt=0, yTilt=0):
+        """Stamps the first dab of the stroke and returns the dirty rectangle"""
+        sample = DabSample(point, pressure, xTilt, yTilt)
+        dirtyRect, diameter = self.stamp(sample)
+        self.canvas.touch(list(self.canvas.tileKeys(dirtyRect)), dirtyRect)
+        self.untilNextDab = max(diameter * self.brush.spacing, 1)
+        self.lastPoint = sample
+        return dirtyRect
+
+    def addPoint(self, point, pressure=1.0, xTilt=0, yTilt=0):
+        """Buffers a sample until the next flush and returns the rectangle which will become dirty"""
+        previous = self.pendingPoints[-1] if self.pendingPoints else self.lastPoint
+        sample = DabSample(point, pressure, xTilt, yTilt)
+        self.pendingPoints.append(sample)
+        return self.painter.segmentRect(previous.point.toPoint(), sample.point.toPoint())
+
+    @profiler.timed("DabStrokeSession.flush")
+    def flush(self, final=False):
+        """Stamps dabs along the buffered samples and returns the dirty rectangle"""
+        if not self.pendingPoints:
+            return QRect()
+
+        dirtyRect = QRect()
+        start = self.lastPoint
+        for end in self.pendingPoints:
+            delta = end.point - start.point
+            length = math.hypot(delta.x(), delta.y())
+            travelled = self.untilNextDab
+            while travelled <= length:
+                rect, diameter = self.stamp(start.interpolated(end, travelled / length))
+                dirtyRect = dirtyRect.united(rect)
+                travelled += max(diameter * self.brush.spacing, 1)  # at least a pixel, tiny dabs would never end
+            self.untilNextDab = travelled - length
+            start = end
+        self.lastPoint = start
+        self.pendingPoints = []
+
+        if not dirtyRect.isEmpty():
+            self.canvas.touch(list(self.canvas.tileKeys(dirtyRect)), dirtyRect)
+        return dirtyRect
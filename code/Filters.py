@@ -0,0 +1,243 @@
+"""
+Image filters of the Filter menu. The filters are vectorized with NumPy on a view of the QImage buffer and the image
+is split into bands of rows which are filtered in parallel on a thread pool (NumPy releases the GIL while it works).
+Filters reading neighbouring pixels get a halo of extra rows around every band so the bands join without seams.
+FilterTask runs the full resolution filter off the GUI thread, previews are filtered on a small proxy image instead.
+numpy is optional, without it the Filter menu is not available. It is imported by the first filter, not at startup.
+"""
+from PyQt5.QtGui import QImage
+from PyQt5.QtCore import QObject, QRect, QRunnable, QThreadPool, Qt, pyqtSignal
+
+from concurrent.futures import ThreadPoolExecutor
+import os
+import sys
+import time
+
+from FloodFill import imageArray
+from Profiler import profiler
+from LazyImport import lazyImport
+
+numpy = lazyImport("numpy")
+
+BAND_HEIGHT = 256  # rows filtered by one job of the pool
+PREVIEW_SIZE = 320  # longest side of the preview proxy in pixels
+
+# weights of the (blue, green, red) bytes of a 32-bit pixel, same weights as qGray
+GRAY_WEIGHTS = (5, 16, 11) if sys.byteorder == "little" else (11, 16, 5)
+
+executor = None  # created by the first filter
+
+
+def available():
+    """Returns True if the filters can be used"""
+    return numpy.available()
+
+
+def bandExecutor():
+    """Returns the thread pool the bands are filtered on"""
+    global executor
+    if executor is None:
+        executor = ThreadPoolExecutor(max_workers=os.cpu_count() or 1)  # documentation: https://docs.python.org/3/library/concurrent.futures.html
+    return executor
+
+
+def colorChannels(image):
+    """Returns a writable (height, width, channels) uint8 view of the colour bytes of a QImage, alpha is left out"""
+    pixels = imageArray(image)
+    if image.format() == QImage.Format_Grayscale8:
+        return pixels[:, :, None]
+    if image.depth() != 32:
+        raise ValueError("unsupported image format {}".format(image.format()))
+    channels = pixels.view(numpy.uint8).reshape(pixels.shape[0], pixels.shape[1], 4)
+    return channels[:, :, :3] if sys.byteorder == "little" else channels[:, :, 1:]
+
+
+def gray(pixels):
+    """Returns the (height, width, 1) luminance of colour bytes"""
+    if pixels.shape[2] == 1:
+        return pixels
+    weights = numpy.array(GRAY_WEIGHTS, dtype=numpy.uint16)
+    return ((pixels * weights).sum(axis=2, dtype=numpy.uint16) // 32).astype(numpy.uint8)[:, :, None]
+
+
+def boxBlur(pixels, radius):
+    """Returns the mean of the (2 radius + 1)^2 neighbourhood of every pixel, computed with running sums"""
+    if radius < 1:
+        return pixels.copy()
+    size = 2 * radius + 1
+    padded = numpy.pad(pixels, ((radius, radius), (radius, radius), (0, 0)), mode="edge")
+    sums = numpy.cumsum(padded, axis=1, dtype=numpy.uint32)
+    rows = sums[:, size - 1:].copy()
+    rows[:, 1:] -= sums[:, :-size]
+    sums = numpy.cumsum(rows, axis=0, dtype=numpy.uint32)
+    result = sums[size - 1:].copy()
+    result[1:] -= sums[:-size]
+    return ((result + size * size // 2) // (size * size)).astype(numpy.uint8)
+
+
+def invert(pixels):
+    return 255 - pixels
+
+
+def grayscale(pixels):
+    return numpy.broadcast_to(gray(pixels), pixels.shape)
+
+
+def threshold(pixels, level):
+    return numpy.broadcast_to(numpy.where(gray(pixels) >= level, 255, 0).astype(numpy.uint8), pixels.shape)
+
+
+def brightnessContrast(pixels, brightness, contrast):
+    """Maps every byte through a 256 entry lookup table, brightness and contrast go from -100 to 100"""
+    contrast = contrast * 2.55
+    factor = 259 * (contrast + 255) / (255 * (259 - contrast))
+    lut = numpy.clip(factor * (numpy.arange(256) - 128) + 128 + brightness * 2.55, 0, 255)
+    return numpy.round(lut).astype(numpy.uint8)[pixels]
+
+
+def blur(pixels, radius):
+    return boxBlur(pixels, int(round(radius)))
+
+
+def sharpen(pixels, amount):
+    """Unsharp mask: adds the difference to a slightly blurred copy, amount in percent"""
+    blurred = boxBlur(pixels, 1)
+    result = pixels + (pixels.astype(numpy.float32) - blurred) * (amount / 100)
+    return numpy.clip(result, 0, 255).astype(numpy.uint8)
+
+
+class FilterParameter:
+    def __init__(self, name, minimum, maximum, default, spatial=False):
+        self.name = name
+        self.minimum = minimum
+        self.maximum = maximum
+        self.default = default
+        self.spatial = spatial  # the value is a distance in pixels and is scaled for the preview proxy
+
+
+class Filter:
+    def __init__(self, name, function, parameters=(), halo=None):
+        self.name = name
+        self.function = function  # function(colour bytes, *values) -> filtered colour bytes of the same shape
+        self.parameters = list(parameters)
+        self.halo = halo  # function(*values) -> rows of neighbours needed above and below a band, None for 0
+
+    def defaults(self):
+        return [parameter.default for parameter in self.parameters]
+
+    def scaled(self, values, scale):
+        """Returns the values to use on an image scaled by the given factor"""
+        return [value * scale if parameter.spatial else value for parameter, value in zip(self.parameters, values)]
+
+    def haloRows(self, values):
+        return int(self.halo(*values)) if self.halo is not None else 0
+
+
+FILTERS = {filter.name: filter for filter in [
+    Filter("Blur", blur, [FilterParameter("Radius", 1, 50, 3, spatial=True)], halo=lambda radius: round(radius)),
+    Filter("Sharpen", sharpen, [FilterParameter("Amount", 0, 300, 100)], halo=lambda amount: 1),
+    Filter("Brightness/Contrast", brightnessContrast,
+           [FilterParameter("Brightness", -100, 100, 0), FilterParameter("Contrast", -100, 100, 0)]),
+    Filter("Invert", invert),
+    Filter("Grayscale", grayscale),
+    Filter("Threshold", threshold, [FilterParameter("Level", 0, 255, 128)]),
+]}
+
+
+def filterPixels(pixels, filter, values, parallel=True):
+    """Filters (height, width, channels) colour bytes in place, band by band"""
+    halo = filter.haloRows(values)
+    source = pixels.copy() if halo > 0 else pixels  # bands read the unfiltered rows of their neighbours
+    height = pixels.shape[0]
+
+    def filterBand(top):
+        bottom = min(top + BAND_HEIGHT, height)
+        start, end = max(top - halo, 0), min(bottom + halo, height)
+        result = filter.function(source[start:end], *values)
+        pixels[top:bottom] = result[top - start:bottom - start]
+
+    bands = range(0, height, BAND_HEIGHT)
+    if parallel and len(bands) > 1:
+        list(bandExecutor().map(filterBand, bands))  # list() waits for the bands and raises their errors
+    else:
+        for top in bands:
+            filterBand(top)
+
+
+@profiler.timed("Filters.filterImage")
+def filterImage(image, filter, values, parallel=True):
+    """Returns a filtered copy of a QImage, premultiplied pixels are filtered as straight colours"""
+    imageFormat = image.format()
+    if imageFormat == QImage.Format_ARGB32_Premultiplied:
+        result = image.convertToFormat(QImage.Format_ARGB32)
+    else:
+        result = image.copy()
+    filterPixels(colorChannels(result), filter, values, parallel)
+    if result.format() != imageFormat:
+        result = result.convertToFormat(imageFormat)
+    return result
+
+
+def previewProxy(image, size=PREVIEW_SIZE):
+    """Returns (proxy, scale): a downscaled copy of an image which is small enough to filter on every slider move"""
+    if max(image.width(), image.height()) <= size:
+        return image, 1.0
+    proxy = image.scaled(size, size, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+    return proxy, proxy.width() / image.width()
+
+
+def preview(proxy, scale, filter, values):
+    """Filters a preview proxy, distances are scaled down together with the image"""
+    return filterImage(proxy, filter, filter.scaled(values, scale), parallel=False)
+
+
+def applyImage(canvas, image):
+    """Writes a filtered image back into a canvas, only the tiles whose pixels changed are written.
+    Returns the changed canvas rectangle"""
+    pixels = imageArray(image)
+    keys = []
+    changed = QRect()
+    for key in list(canvas.tileKeys(canvas.rect())):
+        area = canvas.tileRect(key).intersected(canvas.rect())
+        filtered = pixels[area.top():area.bottom() + 1, area.left():area.right() + 1]
+        tile = canvas.tile(key)
+        if tile.format() != image.format():
+            tile = tile.convertToFormat(image.format())  # a packed Indexed8 tile, the image is in the paint format
+        if numpy.array_equal(imageArray(tile)[:area.height(), :area.width()], filtered):
+            continue  # e.g. a blank transparent tile stays blank and unallocated
+        imageArray(canvas.tileForWrite(key))[:area.height(), :area.width()] = filtered
+        keys.append(key)
+        changed = changed.united(area)
+    if keys:
+        canvas.touch(keys)
+    return changed
+
+
+class FilterSignals(QObject):
+    """Signals emitted by a FilterTask, they are delivered in the GUI thread"""
+    finished = pyqtSignal(object, float)  # filtered QImage, seconds spent
+    failed = pyqtSignal(str)  # error message
+
+
+class FilterTask(QRunnable):  # documentation: https://doc.qt.io/qt-5/qrunnable.html
+    def __init__(self, image, filter, values):
+        super().__init__()
+        self.image = image
+        self.filter = filter
+        self.values = values
+        self.signals = FilterSignals()
+
+    def run(self):
+        start = time.perf_counter()
+        try:
+            image = filterImage(self.image, self.filter, self.values)
+        except Exception as error:  # any failure has to reach the application, it keeps the Painter disabled until then
+            self.signals.failed.emit(str(error) or type(error).__name__)
+            return
+        self.signals.finished.emit(image, time.perf_counter() - start)
+
+
+def runFilter(task):
+    """Starts a FilterTask on the global thread pool"""
+    QThreadPool.globalInstance().start(task)  # documentation: https://doc.qt.io/qt-5/qthreadpool.html#start
+    return task
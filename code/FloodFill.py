@@ -0,0 +1,190 @@
+"""
+Bucket fill of the canvas. The pixels are processed through a NumPy view of the QImage buffer (no copy):
+the pixels matching the seed colour are found with vectorized comparisons and the connected region is then
+collected as horizontal runs, so Python only loops over runs and never over single pixels.
+numpy is optional, without it the fill tool is not available. It is imported by the first fill, not at startup.
+"""
+from PyQt5.QtGui import QColor, QImage
+from PyQt5.QtCore import QRect
+
+from Profiler import profiler
+from LazyImport import lazyImport
+
+numpy = lazyImport("numpy")  # the slowest import of the application, only the fill and the filters need it
+
+BAND_HEIGHT = 512  # rows compared at once, keeps the temporary arrays small
+
+
+def available():
+    """Returns True if the bucket fill can be used"""
+    return numpy.available()
+
+
+def imageArray(image):
+    """Returns a writable (height, width) NumPy view of the pixels of a 32-bit or 8-bit QImage without copying them"""
+    pointer = image.bits()  # documentation: https://doc.qt.io/qt-5/qimage.html#bits
+    pointer.setsize(image.sizeInBytes())
+    if image.depth() == 32:
+        rows = numpy.frombuffer(pointer, numpy.uint32).reshape(image.height(), image.bytesPerLine() // 4)
+    elif image.depth() == 8:
+        rows = numpy.frombuffer(pointer, numpy.uint8).reshape(image.height(), image.bytesPerLine())
+    else:
+        raise ValueError("unsupported image depth {}".format(image.depth()))
+    return rows[:, :image.width()]  # drops the padding at the end of every line
+
+
+def pixelValue(image, color):
+    """Returns the raw pixel value of a colour in the format of the image"""
+    color = QColor(color)
+    if image.format() == QImage.Format_Grayscale8:
+        return (11 * color.red() + 16 * color.green() + 5 * color.blue()) // 32  # same weights as qGray
+    if image.format() == QImage.Format_ARGB32_Premultiplied:
+        alpha = color.alpha()
+        return (alpha << 24) | ((color.red() * alpha // 255) << 16) | ((color.green() * alpha // 255) << 8) | \
+               (color.blue() * alpha // 255)
+    value = color.rgba()
+    if image.format() == QImage.Format_RGB32:
+        value |= 0xff000000
+    return value
+
+
+def matchMask(pixels, seed, tolerance):
+    """Returns a boolean array of the pixels whose channels all differ from the seed by at most tolerance"""
+    if tolerance <= 0:
+        return pixels == seed
+
+    mask = numpy.empty(pixels.shape, dtype=bool)
+    channels = 4 if pixels.dtype == numpy.uint32 else 1
+    seedChannels = numpy.array([seed], dtype=pixels.dtype).view(numpy.uint8)
+    # |channel - seed| <= tolerance as a range check, so the comparisons stay on uint8 and need no widening
+    lows = [max(int(value) - tolerance, 0) for value in seedChannels]
+    highs = [min(int(value) + tolerance, 255) for value in seedChannels]
+    for top in range(0, pixels.shape[0], BAND_HEIGHT):
+        band = numpy.ascontiguousarray(pixels[top:top + BAND_HEIGHT])
+        bytesView = band.view(numpy.uint8).reshape(band.shape[0], band.shape[1], channels)
+        bandMask = mask[top:top + BAND_HEIGHT]
+        bandMask[...] = True
+        for channel in range(channels):
+            values = bytesView[:, :, channel]
+            bandMask &= (values >= lows[channel]) & (values <= highs[channel])
+    return mask
+
+
+def connectedRuns(mask, x, y):
+    """Returns the (row, start, end) runs of the 4-connected region of the mask containing (x, y)"""
+    height = mask.shape[0]
+    rowRuns = {}
+
+    def runs(row):
+        """Returns (starts, ends, visited) of the runs of True values in a mask row, computed once per row"""
+        found = rowRuns.get(row)
+        if found is None:
+            edges = numpy.diff(numpy.concatenate(([0], mask[row].view(numpy.int8), [0])))
+            starts = numpy.flatnonzero(edges == 1)
+            ends = numpy.flatnonzero(edges == -1)
+            found = rowRuns[row] = starts, ends, numpy.zeros(len(starts), dtype=bool)
+        return found
+
+    starts, ends, visited = runs(y)
+    first = int(numpy.searchsorted(starts, x, "right")) - 1
+    visited[first] = True
+    stack = [(y, first)]
+    result = []
+    while stack:
+        row, index = stack.pop()
+        starts, ends, _ = rowRuns[row]
+        start, end = int(starts[index]), int(ends[index])
+        result.append((row, start, end))
+        for neighbour in (row - 1, row + 1):
+            if 0 <= neighbour < height:
+                neighbourStarts, neighbourEnds, neighbourVisited = runs(neighbour)
+                # the runs of the neighbour row which overlap [start, end)
+                low = numpy.searchsorted(neighbourEnds, start, "right")
+                high = numpy.searchsorted(neighbourStarts, end, "left")
+                for other in range(low, high):
+                    if not neighbourVisited[other]:
+                        neighbourVisited[other] = True
+                        stack.append((neighbour, other))
+    return result
+
+
+def findRegion(image, x, y, color, tolerance):
+    """Returns the (row, start, end) runs of the region around (x, y) a fill changes and the pixel value to fill with"""
+    pixels = imageArray(image)
+    value = pixelValue(image, color)
+    seed = pixels[y, x]
+    if seed == value and tolerance == 0:
+        return [], value  # the region already has the fill colour, with a tolerance similar neighbours still change
+    return connectedRuns(matchMask(pixels, seed, tolerance), x, y), value
+
+
+def fillImage(image, point, color, tolerance=0):
+    """Fills the region of similar colour around point in place, returns the (row, start, end) runs filled"""
+    x, y = point.x(), point.y()
+    if not image.rect().contains(x, y):
+        return []
+    runs, value = findRegion(image, x, y, color, tolerance)
+    pixels = imageArray(image)
+    for row, start, end in runs:
+        pixels[row, start:end] = value
+    return runs
+
+
+def grownArea(canvas, area, runs):
+    """Returns the canvas area to search again when the region reaches a side of the area which is not a side of the
+    canvas, the area grows by its own size in whole tiles towards every side reached. Returns area if it holds the
+    whole region"""
+    width, height = area.width(), area.height()
+    columns = -(-width // canvas.tileSize) * canvas.tileSize
+    rows = -(-height // canvas.tileSize) * canvas.tileSize
+    left = area.left() > 0 and any(start == 0 for _, start, _ in runs)
+    right = area.right() < canvas.width - 1 and any(end == width for _, _, end in runs)
+    top = area.top() > 0 and any(row == 0 for row, _, _ in runs)
+    bottom = area.bottom() < canvas.height - 1 and any(row == height - 1 for row, _, _ in runs)
+    return area.adjusted(-columns if left else 0, -rows if top else 0, columns if right else 0,
+                         rows if bottom else 0).intersected(canvas.rect())
+
+
+@profiler.timed("FloodFill.floodFill")
+def floodFill(canvas, point, color, tolerance=0):
+    """Bucket fills a TiledCanvas, only the tiles touched by the fill are written back. Returns the changed rectangle.
+    The search starts on the tile of the point and only grows over more tiles while the region reaches the side of
+    the searched area, so a small fill on a big canvas never flattens the whole canvas"""
+    x, y = point.x(), point.y()
+    if not canvas.rect().contains(x, y):
+        return QRect()
+    area = canvas.tileRect((x // canvas.tileSize, y // canvas.tileSize)).intersected(canvas.rect())
+    while True:
+        image = canvas.toImage(area)
+        runs, value = findRegion(image, x - area.left(), y - area.top(), color, tolerance)
+        grown = grownArea(canvas, area, runs)
+        if grown == area:
+            break
+        area = grown
+    if not runs:
+        return QRect()
+
+    pixels = imageArray(image)
+    for row, start, end in runs:
+        pixels[row, start:end] = value
+
+    tileSize = canvas.tileSize
+    keys = set()
+    for row, start, end in runs:
+        row, start, end = row + area.top(), start + area.left(), end + area.left()
+        for column in range(start // tileSize, (end - 1) // tileSize + 1):
+            keys.add((column, row // tileSize))
+
+    for key in keys:
+        tileArea = canvas.tileRect(key).intersected(area)
+        tilePixels = imageArray(canvas.tileForWrite(key))
+        tilePixels[:tileArea.height(), :tileArea.width()] = \
+            pixels[tileArea.top() - area.top():tileArea.bottom() - area.top() + 1,
+                   tileArea.left() - area.left():tileArea.right() - area.left() + 1]
+    canvas.touch(list(keys))
+
+    top = min(row for row, _, _ in runs)
+    bottom = max(row for row, _, _ in runs)
+    left = min(start for _, start, _ in runs)
+    right = max(end for _, _, end in runs)
+    return QRect(left + area.left(), top + area.top(), right - left, bottom - top + 1)
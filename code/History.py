@@ -0,0 +1,153 @@
+"""
+History class implements undo and redo on top of the tiles of a TiledCanvas.
+A step only remembers the tiles it changed, as they were before and after the step, so undoing or redoing a stroke
+costs time and memory proportional to the area of the stroke instead of the size of the canvas.
+"""
+from PyQt5.QtGui import QImage
+
+import zlib
+
+DEFAULT_MEMORY_BUDGET = 256 * 1024 * 1024  # bytes of tile data kept for undo and redo
+
+
+class TileState:
+    """The content of one tile at one point in time, optionally zlib compressed"""
+
+    def __init__(self, tile, compress):
+        self.tile = None  # None means the tile was blank
+        self.data = None
+        if tile is None:
+            return
+        if compress:
+            self.width, self.height = tile.width(), tile.height()
+            self.bytesPerLine, self.format = tile.bytesPerLine(), tile.format()
+            self.colorTable = tile.colorTable()
+            self.data = zlib.compress(tile.constBits().asstring(tile.sizeInBytes()), 1)
+        else:
+            self.tile = QImage(tile)  # shares the pixels until the canvas paints on the tile again
+
+    @classmethod
+    def fromData(cls, data, width, height, bytesPerLine, imageFormat, colorTable=None):
+        """Returns a state holding zlib compressed pixels, e.g. read from a project file"""
+        state = cls(None, True)
+        state.data = data
+        state.width, state.height = width, height
+        state.bytesPerLine, state.format = bytesPerLine, imageFormat
+        state.colorTable = colorTable or []
+        return state
+
+    def compressed(self, level=1):
+        """Returns (zlib compressed pixels, width, height, bytes per line, format, colour table), None if blank"""
+        if self.data is not None:
+            return self.data, self.width, self.height, self.bytesPerLine, self.format, self.colorTable
+        if self.tile is None:
+            return None
+        tile = self.tile
+        return (zlib.compress(tile.constBits().asstring(tile.sizeInBytes()), level), tile.width(), tile.height(),
+                tile.bytesPerLine(), tile.format(), tile.colorTable())
+
+    def size(self):
+        """Returns the number of bytes held by this state"""
+        if self.data is not None:
+            return len(self.data)
+        return self.tile.sizeInBytes() if self.tile is not None else 0
+
+    def image(self):
+        """Returns the tile as a QImage, or None if it was blank"""
+        if self.data is None:
+            return QImage(self.tile) if self.tile is not None else None
+        # documentation: https://doc.qt.io/qt-5/qimage.html#QImage-5
+        tile = QImage(zlib.decompress(self.data), self.width, self.height, self.bytesPerLine, self.format).copy()
+        if self.colorTable:
+            tile.setColorTable(self.colorTable)
+        return tile
+
+
+class HistoryStep:
+    """The tiles changed by one undoable operation"""
+
+    def __init__(self):
+        self.before = {}  # (canvas, key) -> TileState before the step
+        self.after = {}  # (canvas, key) -> TileState after the step
+
+    def size(self):
+        """Returns the number of bytes held by this step"""
+        return sum(state.size() for state in self.before.values()) + sum(state.size() for state in self.after.values())
+
+
+class History:
+    def __init__(self, memoryBudget=DEFAULT_MEMORY_BUDGET, compress=True):
+        self.memoryBudget = memoryBudget
+        self.compress = compress
+
+        self.undoStack = []  # oldest step first
+        self.redoStack = []
+        self.memoryUsed = 0
+        self.step = None  # the step being recorded, None outside of beginStep/endStep
+
+    def clear(self):
+        """Forgets all steps"""
+        self.undoStack = []
+        self.redoStack = []
+        self.memoryUsed = 0
+        self.step = None
+
+    def beginStep(self):
+        """Starts recording the tiles changed by an operation"""
+        self.step = HistoryStep()
+
+    def tileWillChange(self, canvas, key):
+        """Canvas write listener, remembers a tile before the current step changes it for the first time"""
+        if self.step is not None and (canvas, key) not in self.step.before:
+            self.step.before[(canvas, key)] = TileState(canvas.tiles.get(key), self.compress)
+
+    def endStep(self):
+        """Finishes the current step and pushes it onto the undo stack"""
+        step, self.step = self.step, None
+        if step is None or not step.before:
+            return
+
+        for canvas in {canvas for canvas, _ in step.before}:
+            canvas.pack()  # the after states keep the compact format of the canvas
+        for canvas, key in step.before:
+            step.after[(canvas, key)] = TileState(canvas.tiles.get(key), self.compress)
+
+        self.undoStack.append(step)
+        self.memoryUsed += step.size()
+        for redoStep in self.redoStack:
+            self.memoryUsed -= redoStep.size()
+        self.redoStack = []
+        self.evict()
+
+    def evict(self):
+        """Drops the oldest steps until the history fits into its memory budget, the newest step is always kept"""
+        while self.memoryUsed > self.memoryBudget and len(self.undoStack) > 1:
+            self.memoryUsed -= self.undoStack.pop(0).size()
+
+    def canUndo(self):
+        return bool(self.undoStack)
+
+    def canRedo(self):
+        return bool(self.redoStack)
+
+    def undo(self):
+        """Restores the tiles of the last step, returns the restored (canvas, key) pairs"""
+        if not self.undoStack:
+            return []
+        step = self.undoStack.pop()
+        self.redoStack.append(step)
+        return self.restore(step.before)
+
+    def redo(self):
+        """Re-applies the last undone step, returns the restored (canvas, key) pairs"""
+        if not self.redoStack:
+            return []
+        step = self.redoStack.pop()
+        self.undoStack.append(step)
+        return self.restore(step.after)
+
+    def restore(self, states):
+        """Puts the given tile states back into their canvases"""
+        for (canvas, key), state in states.items():
+            canvas.setTile(key, state.image())
+        return list(states)
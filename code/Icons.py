@@ -0,0 +1,32 @@
+"""
+Icons of the application, looked up by name in the icons directory next to this module.
+The directory is listed once, so icons which do not exist are never searched for on the filesystem, and every
+QIcon is created once and shared by all the widgets using it.
+"""
+from PyQt5.QtGui import QIcon
+
+import os
+
+ICON_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "icons")
+
+files = None  # icon name -> file path, read from ICON_DIRECTORY by the first lookup
+cache = {}  # icon name -> QIcon
+
+
+def iconFiles():
+    global files
+    if files is None:
+        try:
+            files = {os.path.splitext(entry.name)[0]: entry.path for entry in os.scandir(ICON_DIRECTORY) if entry.is_file()}
+        except OSError:
+            files = {}
+    return files
+
+
+def icon(name):
+    """Returns the QIcon of icons/<name>.png, an empty QIcon when there is no such icon"""
+    found = cache.get(name)
+    if found is None:
+        path = iconFiles().get(name)
+        found = cache[name] = QIcon(path) if path is not None else QIcon()  # documentation: https://doc.qt.io/qt-5/qicon.html
+    return found
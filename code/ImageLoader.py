@@ -0,0 +1,98 @@
+"""
+ImageLoader runs the decoding of an image file on a QThreadPool so the window stays responsive while big files open.
+A small preview is decoded first at a reduced size when the decoder can decode scaled (e.g. JPEG), then the full image
+is decoded and split into canvas tiles. Other decoders (e.g. PNG) would decode the whole file twice, so their preview is
+a downscaled copy of the full decode, shown while the tiles are built.
+The pixels are converted into the working format of the document once here, so painting never converts them again.
+"""
+from PyQt5.QtGui import QImage, QImageIOHandler, QImageReader
+from PyQt5.QtCore import QObject, QRunnable, QThreadPool, Qt, pyqtSignal
+
+from TiledCanvas import TiledCanvas, workingFormat
+
+# decoders which produce only the pixels of a scaled read, the PNG decoder supports the option too but scales after
+# decoding the whole file
+SCALED_DECODE_FORMATS = {b"jpeg", b"jpg", b"svg", b"svgz"}
+
+
+class LoadCancelled(Exception):
+    """Raised inside the worker when the user cancelled the loading"""
+
+
+class ImageLoadSignals(QObject):
+    """Signals emitted by an ImageLoadTask, they are delivered in the GUI thread"""
+    progress = pyqtSignal(int)  # percentage
+    preview = pyqtSignal(object)  # reduced size QImage
+    finished = pyqtSignal(object)  # the TiledCanvas holding the full resolution image
+    failed = pyqtSignal(str)  # error message
+
+
+class ImageLoadTask(QRunnable):  # documentation: https://doc.qt.io/qt-5/qrunnable.html
+    def __init__(self, filePath, imageFormat, background, previewSize=None):
+        super().__init__()
+        self.filePath = filePath
+        self.format = imageFormat  # None picks the working format from the file, see workingFormat
+        self.background = background  # None uses transparent for documents with an alpha channel, otherwise white
+        self.previewSize = previewSize  # QSize to decode a preview into, None to skip the preview
+        self.cancelled = False
+        self.signals = ImageLoadSignals()
+
+    def cancel(self):
+        """Asks the worker to stop at the next checkpoint"""
+        self.cancelled = True
+
+    def checkCancelled(self):
+        if self.cancelled:
+            raise LoadCancelled()
+
+    def tilesDone(self, done, total):
+        """Progress callback of TiledCanvas.fromImage, tiling is the last 40% of the work"""
+        self.checkCancelled()
+        self.signals.progress.emit(60 + 40 * done // max(total, 1))
+
+    def run(self):
+        try:
+            self.signals.progress.emit(0)
+            reader = QImageReader(self.filePath)  # documentation: https://doc.qt.io/qt-5/qimagereader.html
+            # documentation: https://doc.qt.io/qt-5/qimageiohandler.html#ImageOption-enum
+            scaledPreview = self.previewSize is not None and reader.supportsOption(QImageIOHandler.ScaledSize) and \
+                bytes(reader.format()) in SCALED_DECODE_FORMATS
+            if scaledPreview:
+                size = reader.size()
+                if size.isValid():
+                    # decoders supporting scaled reads only produce the pixels of the small image
+                    reader.setScaledSize(size.scaled(self.previewSize, Qt.KeepAspectRatio))
+                    preview = reader.read()
+                    if not preview.isNull():
+                        self.signals.preview.emit(preview)
+            self.checkCancelled()
+            self.signals.progress.emit(15)
+
+            reader = QImageReader(self.filePath)
+            image = reader.read()
+            if image.isNull():
+                self.signals.failed.emit("Could not open {}: {}".format(self.filePath, reader.errorString()))
+                return
+            self.checkCancelled()
+            self.signals.progress.emit(60)
+            if self.previewSize is not None and not scaledPreview:
+                self.signals.preview.emit(image.scaled(self.previewSize, Qt.KeepAspectRatio, Qt.SmoothTransformation))
+
+            imageFormat = self.format if self.format is not None else workingFormat(image)
+            background = self.background
+            if background is None:
+                background = Qt.transparent if imageFormat == QImage.Format_ARGB32_Premultiplied else Qt.white
+            canvas = TiledCanvas.fromImage(image, imageFormat, background, progress=self.tilesDone)
+            self.checkCancelled()
+            self.signals.progress.emit(100)
+            self.signals.finished.emit(canvas)
+        except LoadCancelled:
+            pass
+        except Exception as error:  # e.g. running out of memory while tiling, the progress dialog waits for a signal
+            self.signals.failed.emit(str(error) or type(error).__name__)
+
+
+def loadImage(task):
+    """Starts an ImageLoadTask on the global thread pool"""
+    QThreadPool.globalInstance().start(task)  # documentation: https://doc.qt.io/qt-5/qthreadpool.html#start
+    return task
@@ -0,0 +1,54 @@
+"""
+ImageSaver encodes a snapshot of the canvas on a QThreadPool so painting can continue while a big image is written.
+"""
+from PyQt5.QtGui import QImage, QImageWriter
+from PyQt5.QtCore import QObject, QRunnable, QThreadPool, Qt, pyqtSignal
+
+import time
+
+
+class ImageSaveSignals(QObject):
+    """Signals emitted by an ImageSaveTask, they are delivered in the GUI thread"""
+    finished = pyqtSignal(str, float)  # file path, seconds spent
+    failed = pyqtSignal(str, str)  # file path, error message
+
+
+class ImageSaveTask(QRunnable):  # documentation: https://doc.qt.io/qt-5/qrunnable.html
+    def __init__(self, canvas, filePath, compression=-1, quality=-1, imageFormat=None, colorTable=None):
+        super().__init__()
+        self.snapshot = canvas.snapshot()  # taken in the GUI thread, later strokes do not change it
+        self.filePath = filePath
+        self.compression = compression  # 0 (fast) to 9 (small), used by PNG and TIFF, -1 for the default
+        self.quality = quality  # 0 (small) to 100 (best), used by JPG and WebP, -1 for the default
+        # pixel format of the document, the flattened painting is 32-bit and a compact document is written compact again
+        self.format = imageFormat
+        self.colorTable = colorTable
+        self.signals = ImageSaveSignals()
+
+    def image(self):
+        """Returns the snapshot as an image in the pixel format of the document"""
+        image = self.snapshot.toImage()
+        if self.format == QImage.Format_Indexed8:
+            return image.convertToFormat(self.format, self.colorTable, Qt.ThresholdDither)
+        if self.format == QImage.Format_Grayscale8:
+            return image.convertToFormat(self.format)
+        return image
+
+    def run(self):
+        start = time.perf_counter()
+        writer = QImageWriter(self.filePath)  # documentation: https://doc.qt.io/qt-5/qimagewriter.html
+        if self.compression >= 0:
+            writer.setCompression(self.compression)
+        if self.quality >= 0:
+            writer.setQuality(self.quality)
+
+        if writer.write(self.image()):
+            self.signals.finished.emit(self.filePath, time.perf_counter() - start)
+        else:
+            self.signals.failed.emit(self.filePath, writer.errorString())
+
+
+def saveImage(task):
+    """Starts an ImageSaveTask on the global thread pool"""
+    QThreadPool.globalInstance().start(task)  # documentation: https://doc.qt.io/qt-5/qthreadpool.html#start
+    return task
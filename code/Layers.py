@@ -0,0 +1,181 @@
+"""
+Layer and LayerStack classes. Every layer is its own TiledCanvas, the bottom one is the opaque background layer.
+The flattened result is kept in a composite TiledCanvas which is what the Painter draws. When a layer changes
+only the changed area of the composite is blended again, so a frame never has to blend every layer everywhere.
+Layers above the background start without any tiles, an empty layer only costs its shared transparent tile.
+"""
+from PyQt5.QtGui import QImage, QPainter
+from PyQt5.QtCore import Qt, QRect
+
+from TiledCanvas import TiledCanvas
+from Profiler import profiler
+
+# blend modes offered for layers, documentation: https://doc.qt.io/qt-5/qpainter.html#CompositionMode-enum
+BLEND_MODES = {
+    "Normal": QPainter.CompositionMode_SourceOver,
+    "Multiply": QPainter.CompositionMode_Multiply,
+    "Screen": QPainter.CompositionMode_Screen,
+    "Overlay": QPainter.CompositionMode_Overlay,
+    "Darken": QPainter.CompositionMode_Darken,
+    "Lighten": QPainter.CompositionMode_Lighten,
+    "Difference": QPainter.CompositionMode_Difference,
+    "Add": QPainter.CompositionMode_Plus,
+}
+
+LAYER_FORMAT = QImage.Format_ARGB32_Premultiplied  # the fastest format to blend
+
+
+class Layer:
+    def __init__(self, name, canvas):
+        self.name = name
+        self.canvas = canvas
+        self.opacity = 1.0
+        self.visible = True
+        self.blendMode = "Normal"
+
+
+class LayerStack:
+    def __init__(self, background, writeListener=None):
+        """Creates a stack whose background layer is the given canvas"""
+        self.writeListener = writeListener  # added to the write listeners of every layer, e.g. the undo history
+        self.layers = []  # bottom first
+        self.activeIndex = 0
+
+        # the composite has the background of the background layer, so blank composite tiles can stay blank,
+        # it only needs an alpha channel when the background is transparent
+        compositeFormat = LAYER_FORMAT if background.background.alpha() < 255 else QImage.Format_RGB32
+        self.composite = TiledCanvas(background.width, background.height, compositeFormat, background.background,
+                                     background.tileSize)
+        self.dirty = {}  # composite tile key -> canvas rectangle which has to be blended again
+        self.insertLayer(0, Layer("Background", background))
+
+    @property
+    def width(self):
+        return self.composite.width
+
+    @property
+    def height(self):
+        return self.composite.height
+
+    def background(self):
+        return self.layers[0]
+
+    def active(self):
+        return self.layers[self.activeIndex]
+
+    def insertLayer(self, index, layer):
+        """Adds a layer at the given index and listens to its changes"""
+        if self.writeListener is not None:
+            layer.canvas.writeListeners.append(self.writeListener)
+        layer.canvas.changeListeners.append(self.layerChanged)
+        self.layers.insert(index, layer)
+        self.invalidateLayer(layer)
+
+    def addLayer(self, name=None):
+        """Adds an empty transparent layer above the active layer and makes it active"""
+        c = self.composite
+        canvas = TiledCanvas(c.width, c.height, LAYER_FORMAT, Qt.transparent, c.tileSize)
+        layer = Layer(name or "Layer {}".format(len(self.layers)), canvas)
+        self.activeIndex += 1
+        self.insertLayer(self.activeIndex, layer)
+        return layer
+
+    def removeLayer(self, index):
+        """Removes a layer, the background layer cannot be removed"""
+        if index <= 0 or index >= len(self.layers):
+            return
+        layer = self.layers.pop(index)
+        layer.canvas.changeListeners.remove(self.layerChanged)
+        self.invalidateLayer(layer)
+        self.activeIndex = min(self.activeIndex, len(self.layers) - 1)
+
+    def moveLayer(self, index, offset):
+        """Moves a layer up (positive offset) or down, the background layer stays at the bottom"""
+        target = index + offset
+        if index <= 0 or target <= 0 or target >= len(self.layers):
+            return
+        layer = self.layers.pop(index)
+        self.layers.insert(target, layer)
+        if self.activeIndex == index:
+            self.activeIndex = target
+        self.invalidateLayer(layer)
+
+    def setOpacity(self, index, opacity):
+        self.layers[index].opacity = opacity
+        self.invalidateLayer(self.layers[index])
+
+    def setVisible(self, index, visible):
+        self.layers[index].visible = visible
+        self.invalidateLayer(self.layers[index])
+
+    def setBlendMode(self, index, blendMode):
+        """Sets the blend mode of a layer, the background layer always uses Normal"""
+        if index > 0:
+            self.layers[index].blendMode = blendMode
+            self.invalidateLayer(self.layers[index])
+
+    def invalidateLayer(self, layer):
+        """Marks the area of all painted tiles of a layer as dirty, blank tiles of a layer do not change the result"""
+        for key in layer.canvas.tiles:
+            self.dirty[key] = layer.canvas.tileRect(key)
+
+    def layerChanged(self, canvas, keys, rect=None):
+        """Change listener of the layer canvases, remembers which part of each composite tile has to be blended"""
+        for key in keys:
+            area = self.composite.tileRect(key)
+            if rect is not None:
+                area = area.intersected(rect)
+            self.dirty[key] = self.dirty[key].united(area) if key in self.dirty else area
+
+    def extend(self, width, height):
+        """Grows every layer and the composite"""
+        for layer in self.layers:
+            layer.canvas.extend(width, height)
+        self.composite.extend(width, height)
+
+    @profiler.timed("LayerStack.updateComposite")
+    def updateComposite(self):
+        """Blends the dirty areas of the composite again, returns the canvas rectangle which changed"""
+        if not self.dirty:
+            return QRect()
+        dirty, self.dirty = self.dirty, {}
+        changed = QRect()
+        for key, area in dirty.items():
+            self.blendTile(key, area)
+            changed = changed.united(area)
+        self.composite.touch(list(dirty), changed)
+        return changed
+
+    def blendTile(self, key, area):
+        """Blends the layers of one composite tile inside the given canvas area"""
+        visible = [layer for layer in self.layers if layer.visible and layer.opacity > 0]
+        painted = [layer for layer in visible if not layer.canvas.isBlank(key)]
+        if not painted:
+            # blank layer tiles are transparent or the background colour, so the composite tile is blank too
+            self.composite.tiles.pop(key, None)
+            return
+
+        tile = self.composite.tiles.get(key)
+        if tile is None:
+            tile = self.composite.tiles[key] = self.composite.blankTile.copy()
+        tileRect = self.composite.tileRect(key)
+        local = area.translated(-tileRect.topLeft())
+
+        tilePainter = QPainter(tile)
+        tilePainter.setClipRect(local)
+        tilePainter.setCompositionMode(QPainter.CompositionMode_Source)  # a transparent background replaces the old pixels
+        tilePainter.fillRect(local, self.composite.background)
+        for layer in visible:
+            tilePainter.setOpacity(layer.opacity)
+            tilePainter.setCompositionMode(BLEND_MODES[layer.blendMode])
+            layerTile = layer.canvas.tiles.get(key)
+            if layerTile is not None:
+                tilePainter.drawImage(local.topLeft(), layerTile, local)
+            elif layer.canvas.background.alpha() > 0:
+                tilePainter.fillRect(local, layer.canvas.background)
+        tilePainter.end()
+
+    def flatten(self):
+        """Returns the composite after blending all pending changes"""
+        self.updateComposite()
+        return self.composite
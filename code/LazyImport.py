@@ -0,0 +1,33 @@
+"""
+LazyModule stands in for a module which is only imported the first time one of its attributes is used.
+Optional dependencies like numpy are slow to import but only needed by a few tools, deferring them keeps the
+start of the application fast.
+"""
+import importlib
+import importlib.util
+
+
+class LazyModule:
+    def __init__(self, name):
+        self.__dict__["_name"] = name
+        self.__dict__["_module"] = None
+        self.__dict__["_available"] = None
+
+    def available(self):
+        """Returns True if the module is installed, without importing it"""
+        if self._available is None:
+            self.__dict__["_available"] = self._module is not None or importlib.util.find_spec(self._name) is not None
+        return self._available
+
+    def __getattr__(self, attribute):
+        """Called for attributes which were not copied yet: imports the module and caches the attribute"""
+        if self._module is None:
+            self.__dict__["_module"] = importlib.import_module(self._name)
+        value = getattr(self._module, attribute)
+        self.__dict__[attribute] = value  # the next lookup is a plain instance attribute
+        return value
+
+
+def lazyImport(name):
+    """Returns a LazyModule for the module name"""
+    return LazyModule(name)
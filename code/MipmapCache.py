@@ -0,0 +1,84 @@
+"""
+MipmapCache class keeps downscaled copies of a TiledCanvas which are used to draw the canvas when zoomed out.
+A tile of level n covers 2^n x 2^n canvas tiles and is built lazily from the four tiles of level n - 1 below it.
+When canvas tiles change only the level tiles above them are dropped, the rest of the pyramid stays cached.
+"""
+from PyQt5.QtGui import QImage, QPainter
+from PyQt5.QtCore import QRect, QRectF
+
+import math
+
+
+class MipmapCache:
+    def __init__(self, canvas):
+        self.canvas = canvas
+        self.levels = {}  # (level, column, row) -> QImage, None when all the canvas tiles below it are blank
+        canvas.changeListeners.append(self.invalidate)
+
+    def maxLevel(self):
+        """Returns the level at which a single tile covers the whole canvas"""
+        span = max(self.canvas.width, self.canvas.height, 1) / self.canvas.tileSize
+        return max(0, math.ceil(math.log2(span))) if span > 1 else 0
+
+    def levelFor(self, zoom):
+        """Returns the level whose resolution is the closest one at or above the given zoom factor"""
+        if zoom >= 1:
+            return 0
+        return min(int(math.floor(math.log2(1 / zoom))), self.maxLevel())
+
+    def invalidate(self, canvas, keys, rect=None):
+        """Canvas change listener, drops the cached level tiles above the changed canvas tiles"""
+        for column, row in keys:
+            for level in range(1, self.maxLevel() + 1):
+                self.levels.pop((level, column >> level, row >> level), None)
+
+    def tile(self, level, column, row):
+        """Returns a level tile, building it and the missing tiles below it if needed"""
+        if level == 0:
+            return self.canvas.tiles.get((column, row))
+
+        key = level, column, row
+        if key in self.levels:
+            return self.levels[key]
+
+        tileSize = self.canvas.tileSize
+        half = tileSize / 2
+        children = [(dx, dy, self.tile(level - 1, column * 2 + dx, row * 2 + dy)) for dy in (0, 1) for dx in (0, 1)]
+
+        image = None
+        if any(child is not None for _, _, child in children):
+            image = QImage(tileSize, tileSize, self.canvas.format)
+            image.fill(self.canvas.background)
+            levelPainter = QPainter(image)
+            levelPainter.setRenderHint(QPainter.SmoothPixmapTransform)  # averages the pixels while halving
+            for dx, dy, child in children:
+                if child is not None:
+                    levelPainter.drawImage(QRectF(dx * half, dy * half, half, half), child)
+            levelPainter.end()
+
+        self.levels[key] = image
+        return image
+
+    def build(self):
+        """Builds every missing level tile, e.g. before the pyramid is saved"""
+        for level in range(1, self.maxLevel() + 1):
+            span = self.canvas.tileSize << level
+            for row in range(math.ceil(self.canvas.height / span)):
+                for column in range(math.ceil(self.canvas.width / span)):
+                    if (level, column, row) not in self.levels:
+                        self.tile(level, column, row)
+
+    def memoryUsage(self):
+        """Returns the bytes taken by the level tiles, tiles still compressed in a project file are not counted"""
+        levels = self.levels.loadedValues() if hasattr(self.levels, "loadedValues") else self.levels.values()
+        return sum(tile.sizeInBytes() for tile in levels if tile is not None)
+
+    def tiles(self, level, rect):
+        """Yields (canvas rectangle, image) for the level tiles intersecting a canvas rectangle"""
+        span = self.canvas.tileSize << level
+        rect = rect.intersected(self.canvas.rect())
+        if rect.isEmpty():
+            return
+        for row in range(rect.top() // span, rect.bottom() // span + 1):
+            for column in range(rect.left() // span, rect.right() // span + 1):
+                yield QRect(column * span, row * span, span, span), self.tile(level, column, row)
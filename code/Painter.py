@@ -1,6 +1,35 @@
 from PyQt5.QtWidgets import QWidget
-from PyQt5.QtGui import QIcon, QImage, QPainter, QPen
-from PyQt5.QtCore import Qt, QPoint
+from PyQt5.QtGui import QBrush, QColor, QImage, QPainter, QPixmap, QRegion, QTransform
+from PyQt5.QtCore import Qt, QEvent, QPoint, QPointF, QRect, QRectF
+
+import math
+
+from StrokeSession import StrokeSession, strokePadding
+from TiledCanvas import TiledCanvas
+from History import History
+from MipmapCache import MipmapCache
+from StrokeRecording import StrokeRecording
+from StrokeFilter import StrokeFilter
+from Layers import LayerStack
+from ProjectFile import applyBrushSettings
+from BrushEngine import DabBrush, DabStrokeSession
+import FloodFill
+from Profiler import profiler
+from Icons import icon
+
+# tools of the painter
+BRUSH_TOOL = "brush"
+SOFT_BRUSH_TOOL = "softBrush"
+FILL_TOOL = "fill"
+
+# limits of the view zoom factor
+MIN_ZOOM = 1 / 64
+MAX_ZOOM = 32
+
+# area of the widget covered by the performance HUD
+HUD_RECT = QRect(8, 8, 300, 84)
+
+CHECKER_SIZE = 8  # pixels of a square of the checkerboard shown behind transparent paintings
 
 class Painter(QWidget):
     def __init__(self):
@@ -11,57 +40,383 @@ class Painter(QWidget):
         self.setGeometry(top, left, width, height)
 
         # set window icon
-        self.setWindowIcon(QIcon("icons/paint-brush.png"))  # see: https://doc.qt.io/qt-5/qwidget.html#windowIcon-prop
+        self.setWindowIcon(icon("paint-brush"))  # see: https://doc.qt.io/qt-5/qwidget.html#windowIcon-prop
+
+        # the stroke which is currently being drawn, None when the mouse is not pressed
+        self.stroke = None
+
+        # undo and redo history which only keeps the tiles changed by each stroke
+        self.history = History()
 
-        # default image settings
-        self.image = QImage(self.size(), QImage.Format_RGB32)  # see: https://doc.qt.io/qt-5/qimage.html#QImage-1
-        self.image.fill(Qt.white)  # see: https://doc.qt.io/qt-5/qimage.html#fill-1
+        # view transform, a canvas point is shown at: canvas point * zoom + pan
+        self.zoom = 1.0
+        self.pan = QPoint(0, 0)
+        self.fitToWindow = False  # rescale the view (not the canvas) to keep the whole canvas visible
+        self.extendCanvas = True  # grow a new canvas together with the widget
+        self.panStart = None  # last mouse position of a middle button pan
 
-        self.resizeSavedImage = QImage(0, 0, QImage.Format_RGB32)  # used for resizing of an opened image
+        # default image settings, the painting is stored in lazily allocated tiles filled with white
+        self.layers = None  # the layers of the painting, strokes go to the active layer
+        self.mipmaps = None
+        self.recording = None  # every stroke applied to the canvas, see StrokeRecording
+        self.setCanvas(TiledCanvas(self.width(), self.height(), QImage.Format_RGB32, Qt.white))
 
         # set default values
-        self.drawing = False
         self.brushColor = Qt.blue
         self.brushStyle = Qt.SolidLine
         self.brushCap = Qt.FlatCap
         self.brushJoin = Qt.MiterJoin
         self.brushWidth = 2
 
-        # reference to last point recorded by mouse
-        self.lastPoint = QPoint()  # see: https://doc.qt.io/qt-5/qpoint.html
+        # decimates (and with Smooth curves checked smooths) the pointer points of a stroke before they are drawn,
+        # None draws every point as is
+        self.strokeFilter = StrokeFilter()
+
+        # told about every primitive a stroke draws, e.g. by a shared session which sends it to the other painters
+        self.strokeListeners = []  # callables(canvas, pen, points) after a point or polyline was drawn
+        self.dabListeners = []  # callables(canvas, dab cache key, top left QPointF) after a soft brush dab was stamped
+
+        # hardness, spacing, opacity and pressure response of SOFT_BRUSH_TOOL, its size is brushWidth
+        self.dabBrush = DabBrush()
+
+        # draws frame time, event rate, handler latency and memory use over the painting, see Profiler
+        self.showHud = False
+        self.checkerboard = None  # brush drawn behind transparent paintings, created when first needed
+
+        # the active tool, BRUSH_TOOL draws strokes with a pen, SOFT_BRUSH_TOOL stamps soft dabs
+        # and FILL_TOOL bucket fills with the brush color
+        self.tool = BRUSH_TOOL
+        self.fillTolerance = 0  # how much (0-255 per channel) a pixel may differ from the clicked one to be filled
 
     def mousePressEvent(self, event):
         """Mouse event handler that is called when mouse is pressed"""
-        if event.button() == Qt.LeftButton:
-            painter = QPainter(self.image)  # object which allows drawing to take place on an image
-            painter.setPen(QPen(self.brushColor, self.brushWidth, self.brushStyle, self.brushCap, self.brushJoin))
-            painter.drawPoint(event.pos())
-            self.drawing = True  # set the drawing mode
-            self.lastPoint = event.pos()  # save the last point
-
-            self.update()  # update and render the new painting
+        if event.button() == Qt.LeftButton and self.tool == FILL_TOOL:
+            self.fill(self.mapToCanvas(event.pos()))
+        elif event.button() == Qt.LeftButton:
+            self.beginStroke(self.mapToCanvas(event.pos()))
+        elif event.button() == Qt.MiddleButton:
+            self.panStart = event.pos()
 
+    @profiler.timed("Painter.mouseMoveEvent")
     def mouseMoveEvent(self, event):
         """Mouse event handler that is called when mouse is moved"""
-        if (event.buttons() & Qt.LeftButton) & self.drawing:
-            painter = QPainter(self.image)  # object which allows drawing to take place on an image
-            # allows the selection of brush colour, brush width, line type, cap type, join type
-            painter.setPen(QPen(self.brushColor, self.brushWidth, self.brushStyle, self.brushCap, self.brushJoin))
-            painter.drawLine(self.lastPoint, event.pos())
-            self.lastPoint = event.pos()
-            self.update()
+        if (event.buttons() & Qt.LeftButton) and self.stroke is not None:
+            # the point is only buffered here, it is drawn together with the others at the next paint event
+            self.updateCanvasRect(self.stroke.addPoint(self.mapToCanvas(event.pos())))
+        elif (event.buttons() & Qt.MiddleButton) and self.panStart is not None:
+            self.panBy(event.pos() - self.panStart)
+            self.panStart = event.pos()
+
+    @profiler.timed("Painter.tabletEvent")
+    def tabletEvent(self, event):
+        """Tablet event handler, the soft brush follows the pen pressure and tilt"""
+        if self.tool != SOFT_BRUSH_TOOL:
+            event.ignore()  # Qt sends the matching mouse events instead, documentation: https://doc.qt.io/qt-5/qtabletevent.html
+            return
+        point = self.viewTransform().inverted()[0].map(event.posF())
+        if event.type() == QEvent.TabletPress and event.button() == Qt.LeftButton:
+            self.beginStroke(point, event.pressure(), event.xTilt(), event.yTilt())
+        elif event.type() == QEvent.TabletMove and self.stroke is not None:
+            self.updateCanvasRect(self.stroke.addPoint(point, event.pressure(), event.xTilt(), event.yTilt()))
+        elif event.type() == QEvent.TabletRelease and event.button() == Qt.LeftButton:
+            self.endStroke()
+        event.accept()
+
+    def beginStroke(self, point, pressure=1.0, xTilt=0, yTilt=0):
+        """Starts a stroke of the current brush tool at a canvas point"""
+        self.endStroke()
+        self.history.beginStep()  # the stroke becomes one undo step
+        # opens the painters and pen used by the whole stroke
+        if self.tool == SOFT_BRUSH_TOOL:
+            self.stroke = DabStrokeSession(self, self.canvas, self.dabBrush)
+            self.updateCanvasRect(self.stroke.begin(point, pressure, xTilt, yTilt))
+        else:
+            self.stroke = StrokeSession(self, self.canvas, self.recording)
+            self.updateCanvasRect(self.stroke.begin(point))  # update and render the new painting
 
     def mouseReleaseEvent(self, event):
         """Mouse event handler that is called when mouse is released"""
-        if event.button == Qt.LeftButton:
-            self.drawing = False
+        if event.button() == Qt.LeftButton:
+            self.endStroke()
+        elif event.button() == Qt.MiddleButton:
+            self.panStart = None
+
+    def wheelEvent(self, event):
+        """Zooms around the mouse with Ctrl + wheel, otherwise pans the view"""
+        delta = event.angleDelta()  # documentation: https://doc.qt.io/qt-5/qwheelevent.html#angleDelta
+        if event.modifiers() & Qt.ControlModifier:
+            self.zoomBy(1.25 ** (delta.y() / 120), event.pos())
+        else:
+            self.panBy(QPoint(delta.x(), delta.y()) / 2)
+
+    def endStroke(self):
+        """Draws the remaining points of the current stroke and closes its painter"""
+        if self.stroke is not None:
+            self.updateCanvasRect(self.stroke.end())
+            self.stroke = None
+            self.endStep()
+
+    def fill(self, point):
+        """Bucket fills the region around a canvas point with the brush color"""
+        self.endStroke()
+        self.history.beginStep()  # the fill becomes one undo step
+        self.updateCanvasRect(FloodFill.floodFill(self.canvas, point, self.brushColor, self.fillTolerance))
+        self.endStep()
+
+    def endStep(self):
+        """Finishes the undo step of an operation, the tiles painted on an Indexed8 canvas snap to its palette here"""
+        self.updateCanvasRect(self.canvas.pack())
+        self.history.endStep()
+
+    def undo(self):
+        """Undoes the last stroke by restoring the tiles it changed"""
+        self.endStroke()
+        self.updateTiles(self.history.undo())
 
+    def redo(self):
+        """Redoes the last undone stroke"""
+        self.endStroke()
+        self.updateTiles(self.history.redo())
+
+    def updateTiles(self, tiles):
+        """Repaints the area of the given (canvas, key) pairs"""
+        for canvas, key in tiles:
+            self.updateCanvasRect(canvas.tileRect(key))
+
+    def updateCanvasRect(self, rect):
+        """Repaints the widget area showing the given canvas rectangle"""
+        if not rect.isEmpty():
+            self.update(self.mapFromCanvas(rect))  # see: https://doc.qt.io/qt-5/qwidget.html#update-1
+
+    @profiler.timed("Painter.paintEvent")
     def paintEvent(self, event):
         """triggered by QPainter"""
+        if self.stroke is not None:
+            # draw the points buffered since the last frame, the dirty area was already requested by mouseMoveEvent
+            dirtyRect = self.mapFromCanvas(self.stroke.flush())
+            if not QRegion(dirtyRect).subtracted(event.region()).isEmpty():
+                self.update(dirtyRect)  # the brush grew since the area was requested, repaint the rest next frame
+
+        # blend the layers again where they changed, the rest of the composite stays cached
+        dirtyRect = self.mapFromCanvas(self.layers.updateComposite())
+        if not QRegion(dirtyRect).subtracted(event.region()).isEmpty():
+            self.update(dirtyRect)
+
         canvasPainter = QPainter(self)  # see https://doc.qt.io/qt-5/qpainter.html
-        canvasPainter.drawImage(self.rect(), self.image, self.image.rect())  # draw the image , documentation: https://doc.qt.io/qt-5/qpainter.html#drawImage-1
+        transform = self.viewTransform()
+        canvasArea = transform.mapRect(QRectF(self.layers.composite.rect()))
+
+        # when zoomed out the canvas is drawn from the closest mipmap level, so only a small image has to be scaled
+        level = self.mipmaps.levelFor(self.zoom)
+        if self.zoom < 1:
+            canvasPainter.setRenderHint(QPainter.SmoothPixmapTransform)
+
+        # only blit the invalidated parts of the canvas, documentation: https://doc.qt.io/qt-5/qpaintevent.html#region
+        for rect in event.region().rects():
+            for outside in QRegion(rect).subtracted(QRegion(canvasArea.toAlignedRect())).rects():
+                canvasPainter.fillRect(outside, self.palette().window())  # the area around the canvas
+
+            canvasPainter.setClipRect(QRectF(rect).intersected(canvasArea))
+            if self.layers.composite.background.alpha() < 255:
+                canvasPainter.fillRect(rect, self.checkerboardBrush())
+            for tileRect, tile in self.mipmaps.tiles(level, self.mapToCanvasRect(rect)):
+                target = transform.mapRect(QRectF(tileRect))
+                if tile is None:
+                    canvasPainter.fillRect(target, self.layers.composite.background)
+                else:
+                    canvasPainter.drawImage(target, tile)  # documentation: https://doc.qt.io/qt-5/qpainter.html#drawImage
+
+        if self.showHud:
+            canvasPainter.setClipping(False)
+            self.drawHud(canvasPainter)
+
+    def checkerboardBrush(self):
+        """Returns the checkerboard brush which shows the transparent parts of a painting"""
+        if self.checkerboard is None:
+            pixmap = QPixmap(CHECKER_SIZE * 2, CHECKER_SIZE * 2)
+            pixmap.fill(Qt.white)
+            checkerPainter = QPainter(pixmap)
+            checkerPainter.fillRect(0, 0, CHECKER_SIZE, CHECKER_SIZE, Qt.lightGray)
+            checkerPainter.fillRect(CHECKER_SIZE, CHECKER_SIZE, CHECKER_SIZE, CHECKER_SIZE, Qt.lightGray)
+            checkerPainter.end()
+            self.checkerboard = QBrush(pixmap)  # documentation: https://doc.qt.io/qt-5/qbrush.html#QBrush-7
+        return self.checkerboard
+
+    def hudLines(self):
+        """Returns the lines of the performance HUD, computed from the samples of the profiler"""
+        def latency(name):
+            stats = profiler.statistics(name)
+            return "p50 {:.2f} ms, max {:.2f} ms".format(stats["p50"], stats["max"]) if stats else "-"
+
+        interval = profiler.interval("Painter.paintEvent")
+        frame = "{:.1f} ms ({:.0f} fps)".format(interval * 1000, 1 / interval) if interval else "-"
+        return ["Frame: " + frame,
+                "Move events: {:.0f}/s, {}".format(profiler.rate("Painter.mouseMoveEvent"),
+                                                   latency("Painter.mouseMoveEvent")),
+                "Paint: " + latency("Painter.paintEvent"),
+                "Memory: {:.1f} MB".format(self.memoryUsage() / 2 ** 20)]
+
+    def drawHud(self, qpainter):
+        """Draws the performance HUD in the top left corner of the widget"""
+        qpainter.fillRect(HUD_RECT, QColor(0, 0, 0, 160))
+        qpainter.setPen(Qt.white)
+        qpainter.drawText(HUD_RECT.adjusted(6, 4, -6, -4), Qt.AlignLeft | Qt.AlignTop, "\n".join(self.hudLines()))
+
+    def memoryUsage(self):
+        """Returns the bytes used by the tiles of the layers and the composite, the mipmaps and the undo history"""
+        canvases = [layer.canvas for layer in self.layers.layers] + [self.layers.composite]
+        used = sum(canvas.memoryUsage() for canvas in canvases)
+        used += self.mipmaps.memoryUsage()
+        return used + self.history.memoryUsed
+
+    def viewTransform(self):
+        """Returns the transform from canvas to widget coordinates"""
+        return QTransform(self.zoom, 0, 0, self.zoom, self.pan.x(), self.pan.y())  # see: https://doc.qt.io/qt-5/qtransform.html
+
+    def mapToCanvas(self, pos):
+        """Maps a widget position to a canvas position"""
+        return ((QPointF(pos) - QPointF(self.pan)) / self.zoom).toPoint()
+
+    def mapToCanvasRect(self, rect):
+        """Returns the canvas rectangle shown in the given widget rectangle"""
+        return self.viewTransform().inverted()[0].mapRect(QRectF(rect)).toAlignedRect().adjusted(-1, -1, 1, 1)
+
+    def mapFromCanvas(self, rect):
+        """Returns the widget rectangle showing the given canvas rectangle"""
+        if rect.isEmpty():
+            return QRect()
+        return self.viewTransform().mapRect(QRectF(rect)).toAlignedRect().adjusted(-1, -1, 1, 1)
+
+    def zoomBy(self, factor, anchor=None):
+        """Zooms the view, the canvas point under the anchor (by default the centre) stays in place"""
+        if anchor is None:
+            anchor = self.rect().center()
+        zoom = min(max(self.zoom * factor, MIN_ZOOM), MAX_ZOOM)
+        self.pan = (QPointF(anchor) - (QPointF(anchor) - QPointF(self.pan)) * (zoom / self.zoom)).toPoint()
+        self.zoom = zoom
+        self.fitToWindow = False
+        self.update()
+
+    def panBy(self, offset):
+        """Moves the view by the given widget offset"""
+        self.pan += offset
+        self.update()
+
+    def actualSize(self):
+        """Shows the canvas at 100% zoom"""
+        self.zoom = 1.0
+        self.pan = QPoint(0, 0)
+        self.fitToWindow = False
+        self.update()
+
+    def fitCanvas(self):
+        """Zooms the view so the whole canvas is visible and centred, the zoom follows later resizes"""
+        self.fitToWindow = True
+        self.zoom = min(self.width() / max(self.layers.width, 1), self.height() / max(self.layers.height, 1))
+        self.pan = QPoint(round((self.width() - self.layers.width * self.zoom) / 2),
+                          round((self.height() - self.layers.height * self.zoom) / 2))
+        self.update()
+
+    @property
+    def canvas(self):
+        """Returns the canvas of the active layer"""
+        return self.layers.active().canvas
+
+    @property
+    def image(self):
+        """Returns the whole painting flattened into a single QImage"""
+        return self.layers.flatten().toImage()
+
+    @image.setter
+    def image(self, image):
+        """Replaces the painting with the given QImage"""
+        background = self.layers.background().canvas
+        self.setCanvas(TiledCanvas.fromImage(image, background.format, background.background,
+                                             colorTable=background.colorTable))
+
+    def pixelFormat(self):
+        """Returns the working pixel format of the painting, the format of its background layer"""
+        return self.layers.background().canvas.format
+
+    def setPixelFormat(self, imageFormat):
+        """Converts the painting into another working pixel format, e.g. Grayscale8 for line art.
+        The layers are flattened and the undo history is dropped"""
+        background = self.layers.background().canvas.background
+        image = self.image
+        if imageFormat == QImage.Format_ARGB32_Premultiplied:
+            background = QColor(Qt.transparent)
+        elif background.alpha() < 255:
+            # the compact and RGB formats have no alpha channel, transparent areas become white
+            background = QColor(Qt.white)
+            opaque = QImage(image.size(), QImage.Format_RGB32)
+            opaque.fill(background)
+            opaquePainter = QPainter(opaque)
+            opaquePainter.drawImage(0, 0, image)
+            opaquePainter.end()
+            image = opaque
+        self.setCanvas(TiledCanvas.fromImage(image, imageFormat, background))
+
+    def layersChanged(self):
+        """Repaints the area changed by a layer operation (add, remove, move, opacity, visibility, blend mode)"""
+        self.updateCanvasRect(self.layers.updateComposite())
+
+    def openImage(self, image):
+        """Replaces the painting with an image at its full resolution and fits it into the widget"""
+        background = self.layers.background().canvas
+        self.openCanvas(TiledCanvas.fromImage(image, background.format, background.background))
+
+    def openProject(self, project):
+        """Replaces the painting with the layers, brush settings and undo history of an opened ProjectFile.
+        Only the tiles which are shown get decompressed. Everything is read from the index before the painting is
+        replaced, so a damaged project raises and leaves the current painting as it was"""
+        history = History(self.history.memoryBudget, self.history.compress)
+        layers = project.layerStack(history.tileWillChange)
+        mipmaps = MipmapCache(layers.composite)
+        project.restoreMipmaps(mipmaps)
+        project.restoreHistory(history, layers)
+        background = layers.background().canvas
+        recording = StrokeRecording(background.width, background.height, background.background)
+
+        self.endStroke()
+        applyBrushSettings(self, project.brushSettings())
+        self.history, self.layers, self.mipmaps, self.recording = history, layers, mipmaps, recording
+        self.extendCanvas = False
+        self.fitCanvas()
+
+    def openCanvas(self, canvas):
+        """Replaces the painting with an opened document and fits it into the widget"""
+        self.setCanvas(canvas)
+        self.extendCanvas = False
+        self.fitCanvas()
+
+    def setCanvas(self, canvas):
+        """Replaces the painting with a single layer holding the canvas.
+        The undo history and the stroke recording of the previous painting are dropped"""
+        self.endStroke()
+        self.history.clear()
+        self.layers = LayerStack(canvas, self.history.tileWillChange)
+        self.mipmaps = MipmapCache(self.layers.composite)  # the view shows the flattened layers
+        self.recording = StrokeRecording(canvas.width, canvas.height, canvas.background)
+        self.update()
+
+    def strokePadding(self):
+        """Returns how many pixels the current brush can reach beyond the centre line of a stroke"""
+        return strokePadding(self.brushWidth, self.brushCap, self.brushJoin)
+
+    def segmentRect(self, start, end):
+        """Returns the canvas area touched by a stroke segment between two points"""
+        pad = self.strokePadding()
+        return QRect(start, end).normalized().adjusted(-pad, -pad, pad, pad)
 
     # resize event - this function is called
+    @profiler.timed("Painter.resizeEvent")
     def resizeEvent(self, event):
-        """triggered when the painter is resized"""
-        self.image = self.image.scaled(self.width(), self.height())
\ No newline at end of file
+        """triggered when the painter is resized, only the view changes, the canvas is never resampled"""
+        self.endStroke()
+        if self.fitToWindow:
+            self.fitCanvas()
+        elif self.extendCanvas:
+            # a new painting grows to cover the widget, growing a tiled canvas does not touch any pixels
+            self.layers.extend(math.ceil((self.width() - self.pan.x()) / self.zoom),
+                               math.ceil((self.height() - self.pan.y()) / self.zoom))
+            self.recording.width, self.recording.height = self.layers.width, self.layers.height
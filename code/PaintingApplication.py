@@ -4,16 +4,41 @@
 # PyQt documentation links are prefixed with the word 'documentation' in the code below and can be accessed automatically
 #  in PyCharm using the following technique https://www.jetbrains.com/help/pycharm/inline-documentation.html
 
+import time
+
+STARTED = time.perf_counter()  # the startup report measures the imports from here
+
 from PyQt5.QtWidgets import QApplication, QMainWindow, QAction, QFileDialog, QMessageBox, QColorDialog, QDialog, \
-    QTextEdit, QGridLayout, QWidget, QGroupBox, QSlider, QLabel, QVBoxLayout, QRadioButton, QPushButton
-from PyQt5.QtGui import QIcon, QColor
-from PyQt5.QtCore import Qt, QSize
+    QTextEdit, QGridLayout, QWidget, QGroupBox, QSlider, QLabel, QVBoxLayout, QRadioButton, QPushButton, QProgressDialog, \
+    QDialogButtonBox, QListWidget, QListWidgetItem, QComboBox, QHBoxLayout, \
+    QCheckBox, QScrollArea, QActionGroup, QInputDialog
+from PyQt5.QtGui import QColor, QPixmap
+from PyQt5.QtCore import Qt, QProcess, QSize, QStandardPaths, QTimer
 
+import os
 import platform
 import sys
 
-from Painter import Painter
+from Painter import Painter, BRUSH_TOOL, SOFT_BRUSH_TOOL, FILL_TOOL
 from Tools import Tools
+from ImageLoader import ImageLoadTask, loadImage
+from ImageSaver import ImageSaveTask, saveImage
+from AutosaveJournal import AutosaveJournal
+from Layers import BLEND_MODES
+from BrushEngine import MAX_BRUSH_WIDTH
+import Filters
+from Profiler import profiler
+from Painter import HUD_RECT
+import FloodFill
+from Icons import icon
+from TiledCanvas import PIXEL_FORMATS
+from ProjectFile import ProjectFile, ProjectError, EXTENSION, isProject, saveProject
+from SessionClient import SessionClient
+from SessionProtocol import DEFAULT_PORT, SESSION_FORMATS
+
+IMPORTED = time.perf_counter()
+
+AUTOSAVE_INTERVAL = 10 * 1000  # milliseconds between two checkpoints of the crash recovery journal
 
 
 class PaintingApplication(QMainWindow):  # documentation https://doc.qt.io/qt-5/qmainwindow.html
@@ -39,17 +64,72 @@ class PaintingApplication(QMainWindow):  # documentation https://doc.qt.io/qt-5/
         self.roundCapBtn = QRadioButton("Round")
         self.squareCapBtn = QRadioButton("Square")
 
+        # soft brush and stroke smoothing panels, their widgets are only built when a panel is expanded
+        self.softBrushGroup = QGroupBox("Soft Brush")
+        self.softBrushSliders = {}  # DabBrush attribute -> (QSlider, QLabel, factor between slider value and setting)
+        self.softBrushChecks = {}  # DabBrush attribute -> QCheckBox
+        self.strokeGroup = QGroupBox("Stroke Smoothing")
+        self.smoothCurves = None
+        self.pointSpacing = None
+        self.pointSpacingLabel = None
+
         # brush line style components
         self.dotLineBtn = QRadioButton("Dot")
         self.dashLineBtn = QRadioButton("Dash")
         self.solidLineBtn = QRadioButton("Solid")
         self.brushLineType = QGroupBox("Brush Line Style")
 
+        # tool components
+        self.toolGroup = QGroupBox("Tool")
+        self.brushToolBtn = QRadioButton("Brush")
+        self.softBrushToolBtn = QRadioButton("Soft Brush")
+        self.fillToolBtn = QRadioButton("Bucket")
+        self.fillTolerance = QSlider(Qt.Horizontal)
+        self.fillToleranceLabel = QLabel()
+
+        # layer components
+        self.layerGroup = QGroupBox("Layers")
+        self.layerList = QListWidget()  # the top layer is the first row
+        self.layerOpacity = QSlider(Qt.Horizontal)
+        self.layerOpacityLabel = QLabel()
+        self.layerBlendMode = QComboBox()
+
         # brush color components
         self.brushColorPushBtn = QPushButton()
         self.brushColor = QColor(0, 0, 255) # blue color
         self.groupBoxColor = QGroupBox("Brush Color")
 
+        # the image which is being opened in the background and its progress dialog
+        self.openTask = None
+        self.openDialog = None
+
+        # images which are being saved in the background and the encoder settings of the last save
+        self.saveTasks = []
+        self.saveCompression = -1
+        self.saveQuality = -1
+
+        # the project file the painting was opened from or last saved to, Save Project only writes the changes into it
+        self.project = None
+
+        # the filter which is being applied in the background and the layer canvas it was started on
+        self.filterTask = None
+        self.filterCanvas = None
+
+        # performance HUD, refreshed by a timer while it is shown
+        self.hudLabel = QLabel()
+        self.hudTimer = QTimer(self)
+        self.hudTimer.timeout.connect(self.refreshHud)
+
+        # shared painting session, the server process is only started by Host Session
+        self.session = None
+        self.sessionServer = None
+        self.sessionAddress = None  # (host, port) the hosted server listens on
+
+        # crash recovery journal, started by startAutosave
+        self.journal = None
+        self.autosaveTimer = QTimer(self)
+        self.autosaveTimer.timeout.connect(self.autosave)
+
         # set the main window title
         self.setWindowTitle("Paint Application")
 
@@ -59,7 +139,7 @@ class PaintingApplication(QMainWindow):  # documentation https://doc.qt.io/qt-5/
 
         # set the icon
         # windows version
-        self.setWindowIcon(QIcon("icons/paint-brush.png")) # documentation: https://doc.qt.io/qt-5/qwidget.html#windowIcon-prop
+        self.setWindowIcon(icon("paint-brush")) # documentation: https://doc.qt.io/qt-5/qwidget.html#windowIcon-prop
         # mac version - not yet working
         # self.setWindowIcon(QIcon(QPixmap("./icons/paint-brush.png")))
 
@@ -69,14 +149,24 @@ class PaintingApplication(QMainWindow):  # documentation https://doc.qt.io/qt-5/
         self.painter = Painter()
 
         # init layouts for the required brush painting tools
+        self.initTools()
         self.initBrushCapStyle()
         self.initBrushJoinStyle()
         self.initBrushLineStyle()
         self.initBrushWidth()
+        self.initStrokeFilter()
+        self.initSoftBrush()
         self.initBrushColor()
+        self.initLayers()
 
         self.grid.addWidget(self.painter, 0, 0)
-        self.grid.addWidget(self.tools, 0, 1)
+        # the tool panel scrolls when it is taller than the window
+        toolScroll = QScrollArea()  # documentation: https://doc.qt.io/qt-5/qscrollarea.html
+        toolScroll.setWidget(self.tools)
+        toolScroll.setWidgetResizable(True)
+        toolScroll.setHorizontalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
+        toolScroll.setFixedWidth(self.tools.maximumWidth() + toolScroll.verticalScrollBar().sizeHint().width() + 2)
+        self.grid.addWidget(toolScroll, 0, 1)
         mainWindow = QWidget()
         mainWindow.setLayout(self.grid)
         self.setCentralWidget(mainWindow)
@@ -88,106 +178,209 @@ class PaintingApplication(QMainWindow):  # documentation https://doc.qt.io/qt-5/
             mainMenu.setNativeMenuBar(False)
 
         fileMenu = mainMenu.addMenu(" File") # add the file menu to the menu bar, the space is required as "File" is reserved in Mac
+        editMenu = mainMenu.addMenu(" Edit") # add the "Edit" menu to the menu bar
+        viewMenu = mainMenu.addMenu(" View") # add the "View" menu to the menu bar
+        filterMenu = mainMenu.addMenu(" Filter") # add the "Filter" menu to the menu bar
         brushSizeMenu = mainMenu.addMenu(" Brush Size") # add the "Brush Size" menu to the menu bar
         brushColorMenu = mainMenu.addMenu(" Brush Color") # add the "Brush Color" menu to the menu bar
+        sessionMenu = mainMenu.addMenu(" Session") # add the "Session" menu to the menu bar
         helpMenu = mainMenu.addMenu(" Help ") # add the "Help" menu to the menu bar
 
         # open menu item
-        openAction = QAction(QIcon("icons/open.png"), "Open", self)   # create a open action with a png as an icon, documenation: https://doc.qt.io/qt-5/qaction.html
+        openAction = QAction(icon("open"), "Open", self)   # create a open action with a png as an icon, documenation: https://doc.qt.io/qt-5/qaction.html
         openAction.setShortcut("Ctrl+O")                              # connect this save action to a keyboard shortcut, documentation: https://doc.qt.io/qt-5/qaction.html#shortcut-prop
         fileMenu.addAction(openAction)                                # add the save action to the file menu, documentation: https://doc.qt.io/qt-5/qwidget.html#addAction
         openAction.triggered.connect(self.open)                       # when the menu option is selected or the shortcut is used the save slot is triggered, documenation: https://doc.qt.io/qt-5/qaction.html#triggered
 
 
         # save menu item
-        saveAction = QAction(QIcon("icons/save.png"), "Save", self)   # create a save action with a png as an icon, documenation: https://doc.qt.io/qt-5/qaction.html
+        saveAction = QAction(icon("save"), "Save", self)   # create a save action with a png as an icon, documenation: https://doc.qt.io/qt-5/qaction.html
         saveAction.setShortcut("Ctrl+S")                                # connect this save action to a keyboard shortcut, documentation: https://doc.qt.io/qt-5/qaction.html#shortcut-prop
         fileMenu.addAction(saveAction)                                  # add the save action to the file menu, documentation: https://doc.qt.io/qt-5/qwidget.html#addAction
         saveAction.triggered.connect(self.save)                         # when the menu option is selected or the shortcut is used the save slot is triggered, documenation: https://doc.qt.io/qt-5/qaction.html#triggered
 
+        # save the layers, brush settings and history into a project file, only the changes are written again
+        saveProjectAction = QAction(icon("save"), "Save Project", self)
+        saveProjectAction.setShortcut("Ctrl+Shift+S")
+        fileMenu.addAction(saveProjectAction)
+        saveProjectAction.triggered.connect(self.saveProject)
+
         # clear
-        clearAction = QAction(QIcon("icons/clear.png"), "Clear", self) # create a clear action with a png as an icon
+        clearAction = QAction(icon("clear"), "Clear", self) # create a clear action with a png as an icon
         clearAction.setShortcut("Ctrl+C")                                # connect this clear action to a keyboard shortcut
         fileMenu.addAction(clearAction)                                  # add this action to the file menu
         clearAction.triggered.connect(self.clear)                        # when the menu option is selected or the shortcut is used the clear slot is triggered
 
+        # export the recorded strokes, e.g. to replay them when reproducing a problem
+        exportStrokesAction = QAction("Export Stroke Recording", self)
+        fileMenu.addAction(exportStrokesAction)
+        exportStrokesAction.triggered.connect(self.exportStrokes)
+
+        # working pixel format of the painting, 8-bit formats take a quarter of the memory, the actions are added
+        # when the menu is opened the first time
+        self.pixelFormatMenu = fileMenu.addMenu("Pixel Format")
+        self.pixelFormatActions = None
+        self.pixelFormatMenu.aboutToShow.connect(self.refreshPixelFormat)
+
         # exit
-        exitAction = QAction(QIcon('icons/exit.png'), '&Exit', self)
+        exitAction = QAction(icon("exit"), '&Exit', self)
         exitAction.setShortcut('Ctrl+Q')
         exitAction.setStatusTip('Exit application')
         exitAction.triggered.connect(self.exit)
         fileMenu.addAction(exitAction)
 
+        # undo and redo
+        undoAction = QAction("Undo", self)
+        undoAction.setShortcut("Ctrl+Z")
+        editMenu.addAction(undoAction)
+        undoAction.triggered.connect(self.undo)
+
+        redoAction = QAction("Redo", self)
+        redoAction.setShortcut("Ctrl+Shift+Z")
+        editMenu.addAction(redoAction)
+        redoAction.triggered.connect(self.redo)
+
+        # zoom, the canvas itself is never rescaled, only the view of it
+        zoomInAction = QAction("Zoom In", self)
+        zoomInAction.setShortcut("Ctrl++")
+        viewMenu.addAction(zoomInAction)
+        zoomInAction.triggered.connect(self.zoomIn)
+
+        zoomOutAction = QAction("Zoom Out", self)
+        zoomOutAction.setShortcut("Ctrl+-")
+        viewMenu.addAction(zoomOutAction)
+        zoomOutAction.triggered.connect(self.zoomOut)
+
+        actualSizeAction = QAction("Actual Size", self)
+        actualSizeAction.setShortcut("Ctrl+0")
+        viewMenu.addAction(actualSizeAction)
+        actualSizeAction.triggered.connect(self.actualSize)
+
+        fitAction = QAction("Fit to Window", self)
+        fitAction.setShortcut("Ctrl+F")
+        viewMenu.addAction(fitAction)
+        fitAction.triggered.connect(self.fitToWindow)
+
+        # filters of the active layer, the actions are added when the menu is opened the first time
+        filterMenu.aboutToShow.connect(lambda: self.initFilterMenu(filterMenu))
+
         # brush thickness
-        threepxAction = QAction(QIcon("../icons/threepx.png"), "3px", self)
+        threepxAction = QAction(icon("threepx"), "3px", self)
         threepxAction.setShortcut("Ctrl+3")
         brushSizeMenu.addAction(threepxAction) # connect the action to the function below
         threepxAction.triggered.connect(self.threepx)
 
-        fivepxAction = QAction(QIcon("../icons/fivepx.png"), "5px", self)
+        fivepxAction = QAction(icon("fivepx"), "5px", self)
         fivepxAction.setShortcut("Ctrl+5")
         brushSizeMenu.addAction(fivepxAction)
         fivepxAction.triggered.connect(self.fivepx)
 
-        sevenpxAction = QAction(QIcon("../icons/sevenpx.png"), "7px", self)
+        sevenpxAction = QAction(icon("sevenpx"), "7px", self)
         sevenpxAction.setShortcut("Ctrl+7")
         brushSizeMenu.addAction(sevenpxAction)
         sevenpxAction.triggered.connect(self.sevenpx)
 
-        ninepxAction = QAction(QIcon("../icons/ninepx.png"), "9px", self)
+        ninepxAction = QAction(icon("ninepx"), "9px", self)
         ninepxAction.setShortcut("Ctrl+9")
         brushSizeMenu.addAction(ninepxAction)
         ninepxAction.triggered.connect(self.ninepx)
 
         # brush colors
-        blackAction = QAction(QIcon("icons/black.png"), "Black", self)
+        blackAction = QAction(icon("black"), "Black", self)
         blackAction.setShortcut("Ctrl+B")
         brushColorMenu.addAction(blackAction);
         blackAction.triggered.connect(self.black)
 
-        redAction = QAction(QIcon("icons/red.png"), "Red", self)
+        redAction = QAction(icon("red"), "Red", self)
         redAction.setShortcut("Ctrl+R")
         brushColorMenu.addAction(redAction);
         redAction.triggered.connect(self.red)
 
-        greenAction = QAction(QIcon("icons/green.png"), "Green", self)
+        greenAction = QAction(icon("green"), "Green", self)
         greenAction.setShortcut("Ctrl+G")
         brushColorMenu.addAction(greenAction)
         greenAction.triggered.connect(self.green)
 
-        yellowAction = QAction(QIcon("icons/yellow.png"), "Yellow", self)
+        yellowAction = QAction(icon("yellow"), "Yellow", self)
         yellowAction.setShortcut("Ctrl+Y")
         brushColorMenu.addAction(yellowAction);
         yellowAction.triggered.connect(self.yellow)
 
-        helpAction = QAction(QIcon("../icons/help.png"), "User Guide", self)
+        # paint together with other painting applications on one shared canvas, the actions have no shortcuts
+        # so they are added when the menu is opened the first time
+        sessionMenu.aboutToShow.connect(lambda: self.initSessionMenu(sessionMenu))
+
+        helpAction = QAction(icon("help"), "User Guide", self)
         helpAction.setShortcut("Ctrl+H")
         helpMenu.addAction(helpAction)
         helpAction.triggered.connect(self.help)
 
-        aboutAction = QAction(QIcon("../icons/about.png"), "About", self)
+        # frame time, event rate, handler latency and memory use over the painting and in the status bar
+        hudAction = QAction("Performance HUD", self)
+        hudAction.setShortcut("Ctrl+Shift+P")
+        hudAction.setCheckable(True)
+        helpMenu.addAction(hudAction)
+        hudAction.toggled.connect(self.togglePerformanceHud)
+
+        traceAction = QAction("Save Performance Trace", self)
+        helpMenu.addAction(traceAction)
+        traceAction.triggered.connect(self.saveTrace)
+
+        aboutAction = QAction(icon("about"), "About", self)
         aboutAction.setShortcut("Ctrl+A")
         helpMenu.addAction(aboutAction)
         aboutAction.triggered.connect(self.about)
 
-    # resize event - this function is called
-    def resizeEvent(self, event):
-        """Invoked when the window is resized"""
-        if self.painter.resizeSavedImage.width() != 0:
-            self.painter.image = self.painter.resizeSavedImage.scaled(self.painter.width(), self.painter.height(), Qt.IgnoreAspectRatio)
-        self.painter.update()
-
     def brushWidthSliderChange(self, value):
         """Sets the pen size when the slider value changes"""
         self.painter.brushWidth = value
         self.brushWidthLabel.setText("{} px".format(value))
 
+    def initTools(self):
+        """Init the radio buttons to pick between the brush and the bucket fill, and the fill tolerance"""
+        self.brushToolBtn.clicked.connect(lambda: self.setTool(self.brushToolBtn))
+        self.softBrushToolBtn.clicked.connect(lambda: self.setTool(self.softBrushToolBtn))
+        self.fillToolBtn.clicked.connect(lambda: self.setTool(self.fillToolBtn))
+        self.brushToolBtn.setChecked(True)  # the brush is the default tool
+        if not FloodFill.available():
+            self.fillToolBtn.setEnabled(False)
+            self.fillToolBtn.setToolTip("The bucket fill requires numpy")
+
+        self.fillTolerance.setMinimum(0)
+        self.fillTolerance.setMaximum(255)
+        self.fillTolerance.valueChanged.connect(self.fillToleranceChange)
+        self.fillToleranceLabel.setText("Tolerance: {}".format(self.painter.fillTolerance))
+
+        qv = QVBoxLayout()
+        qv.addWidget(self.brushToolBtn)
+        qv.addWidget(self.softBrushToolBtn)
+        qv.addWidget(self.fillToolBtn)
+        qv.addWidget(self.fillTolerance)
+        qv.addWidget(self.fillToleranceLabel)
+        self.toolGroup.setLayout(qv)
+        self.tools.vbox.addWidget(self.toolGroup)
+
+    def setTool(self, btn):
+        """Sets the tool of the painter based on the btn text"""
+        if btn.text() == "Brush" and btn.isChecked():
+            self.painter.tool = BRUSH_TOOL
+        if btn.text() == "Soft Brush" and btn.isChecked():
+            self.painter.tool = SOFT_BRUSH_TOOL
+            self.softBrushGroup.setChecked(True)  # shows the soft brush settings
+        if btn.text() == "Bucket" and btn.isChecked():
+            self.painter.tool = FILL_TOOL
+
+    def fillToleranceChange(self, value):
+        """Sets the bucket fill tolerance when the slider value changes"""
+        self.painter.fillTolerance = value
+        self.fillToleranceLabel.setText("Tolerance: {}".format(value))
+
     def initBrushWidth(self):
         """Creates a QSlider that can be used to change the pen width"""
         self.groupBoxSlider.setMaximumHeight(100)
 
         self.brushWidth.setMinimum(1)
-        self.brushWidth.setMaximum(25)
+        self.brushWidth.setMaximum(MAX_BRUSH_WIDTH)
         self.brushWidth.valueChanged.connect(self.brushWidthSliderChange)
 
         self.brushWidthLabel.setText("{} px".format(self.painter.brushWidth))
@@ -199,6 +392,139 @@ class PaintingApplication(QMainWindow):  # documentation https://doc.qt.io/qt-5/
 
         self.tools.vbox.addWidget(self.groupBoxSlider)
 
+    def initDeferredGroup(self, group, build):
+        """Adds a collapsed group to the tools panel, build(content) creates its widgets when it is expanded the first time"""
+        content = QWidget()
+        content.hide()
+        qv = QVBoxLayout()
+        qv.setContentsMargins(0, 0, 0, 0)
+        qv.addWidget(content)
+        group.setLayout(qv)
+        group.setCheckable(True)  # the check box in the title expands the group
+        group.setChecked(False)
+
+        def expand(checked):
+            if checked and content.layout() is None:
+                build(content)
+            content.setVisible(checked)
+
+        group.toggled.connect(expand)
+        self.tools.vbox.addWidget(group)
+
+    def initFilterMenu(self, filterMenu):
+        """Adds one action per filter the first time the Filter menu is opened"""
+        if filterMenu.actions():
+            return
+        for name in Filters.FILTERS:
+            filterAction = QAction(name + "...", self)
+            filterAction.setEnabled(Filters.available())  # the filters require numpy
+            filterMenu.addAction(filterAction)
+            filterAction.triggered.connect(lambda checked, name=name: self.filter(name))
+
+    def initSessionMenu(self, sessionMenu):
+        """Adds the session actions the first time the Session menu is opened"""
+        if sessionMenu.actions():
+            return
+        for name, slot in (("Host Session", self.hostSession), ("Join Session", self.joinSession),
+                           ("Leave Session", self.leaveSession)):
+            sessionAction = QAction(name, self)
+            sessionMenu.addAction(sessionAction)
+            sessionAction.triggered.connect(slot)
+
+    def initStrokeFilter(self):
+        """Init the collapsed panel of the point decimation and curve smoothing of strokes"""
+        self.initDeferredGroup(self.strokeGroup, self.buildStrokeFilter)
+
+    def buildStrokeFilter(self, content):
+        """Creates the stroke smoothing widgets"""
+        strokeFilter = self.painter.strokeFilter
+        self.smoothCurves = QCheckBox("Smooth curves")
+        self.smoothCurves.setChecked(strokeFilter.smooth)
+        self.smoothCurves.toggled.connect(self.smoothCurvesChange)
+
+        self.pointSpacing = QSlider(Qt.Horizontal)
+        self.pointSpacing.setMinimum(0)
+        self.pointSpacing.setMaximum(20)
+        self.pointSpacing.setValue(round(strokeFilter.minDistance))
+        self.pointSpacing.valueChanged.connect(self.pointSpacingChange)
+        self.pointSpacingLabel = QLabel("Point spacing: {} px".format(self.pointSpacing.value()))
+
+        qv = QVBoxLayout()
+        qv.addWidget(self.smoothCurves)
+        qv.addWidget(self.pointSpacing)
+        qv.addWidget(self.pointSpacingLabel)
+        content.setLayout(qv)
+
+    def initSoftBrush(self):
+        """Init the collapsed panel of the soft brush settings, it expands when the soft brush is picked"""
+        self.initDeferredGroup(self.softBrushGroup, self.buildSoftBrush)
+
+    def buildSoftBrush(self, content):
+        """Creates the sliders of the soft brush settings and its pressure response"""
+        dabBrush = self.painter.dabBrush
+        qv = QVBoxLayout()
+        # attribute, label, slider range and the factor between the slider value and the setting
+        for attribute, label, minimum, maximum, factor in (("hardness", "Hardness", 0, 100, 100),
+                                                           ("spacing", "Spacing", 5, 200, 100),
+                                                           ("opacity", "Opacity", 1, 100, 100),
+                                                           ("rotation", "Rotation", 0, 179, 1)):
+            slider = QSlider(Qt.Horizontal)
+            slider.setRange(minimum, maximum)
+            slider.setValue(round(getattr(dabBrush, attribute) * factor))
+            valueLabel = QLabel()
+            slider.valueChanged.connect(lambda value, attribute=attribute, label=label, factor=factor:
+                                        self.softBrushChange(attribute, label, value, factor))
+            self.softBrushSliders[attribute] = slider, valueLabel, factor
+            self.softBrushChange(attribute, label, slider.value(), factor)
+            qv.addWidget(slider)
+            qv.addWidget(valueLabel)
+
+        for attribute, label in (("pressureSize", "Pressure changes size"), ("pressureOpacity", "Pressure changes opacity")):
+            check = QCheckBox(label)
+            check.setChecked(getattr(dabBrush, attribute))
+            check.toggled.connect(lambda checked, attribute=attribute: setattr(self.painter.dabBrush, attribute, checked))
+            self.softBrushChecks[attribute] = check
+            qv.addWidget(check)
+        content.setLayout(qv)
+
+    def softBrushChange(self, attribute, label, value, factor):
+        """Sets a soft brush setting when its slider value changes"""
+        setattr(self.painter.dabBrush, attribute, value / factor)
+        self.softBrushSliders[attribute][1].setText("{}: {}{}".format(label, value, "%" if factor == 100 else "\u00b0"))
+
+    def refreshBrushControls(self):
+        """Shows the brush settings of the painter in the tool panel, e.g. after a project was opened"""
+        p = self.painter
+        self.brushColor = QColor(p.brushColor)
+        self.brushColorPushBtn.setStyleSheet("background-color: {}".format(self.brushColor.name()))
+        self.brushWidth.setValue(p.brushWidth)
+        self.brushWidthLabel.setText("{} px".format(p.brushWidth))
+        self.fillTolerance.setValue(p.fillTolerance)
+        # checking a radio button from code does not emit clicked, the painter keeps its settings
+        {BRUSH_TOOL: self.brushToolBtn, SOFT_BRUSH_TOOL: self.softBrushToolBtn,
+         FILL_TOOL: self.fillToolBtn}.get(p.tool, self.brushToolBtn).setChecked(True)
+        {Qt.DashLine: self.dashLineBtn, Qt.DotLine: self.dotLineBtn}.get(p.brushStyle, self.solidLineBtn).setChecked(True)
+        {Qt.RoundCap: self.roundCapBtn, Qt.SquareCap: self.squareCapBtn}.get(p.brushCap, self.flatCapBtn).setChecked(True)
+        {Qt.BevelJoin: self.bevelJoinBtn, Qt.RoundJoin: self.roundJoinBtn}.get(p.brushJoin, self.miterJoinBtn).setChecked(True)
+
+        # the deferred panels only when they were built
+        for attribute, (slider, _, factor) in self.softBrushSliders.items():
+            slider.setValue(round(getattr(p.dabBrush, attribute) * factor))
+        for attribute, check in self.softBrushChecks.items():
+            check.setChecked(getattr(p.dabBrush, attribute))
+        if self.smoothCurves is not None and p.strokeFilter is not None:
+            self.smoothCurves.setChecked(p.strokeFilter.smooth)
+            self.pointSpacing.setValue(round(p.strokeFilter.minDistance))
+
+    def smoothCurvesChange(self, checked):
+        """Fits curves through the stroke points or joins them with straight segments"""
+        self.painter.strokeFilter.smooth = checked
+
+    def pointSpacingChange(self, value):
+        """Sets the distance below which pointer points are dropped"""
+        self.painter.strokeFilter.minDistance = value
+        self.pointSpacingLabel.setText("Point spacing: {} px".format(value))
+
     def initBrushLineStyle(self):
         """Init brush line styles"""
         self.brushLineType.setMaximumHeight(100)
@@ -208,15 +534,15 @@ class PaintingApplication(QMainWindow):  # documentation https://doc.qt.io/qt-5/
         Each one is connected to a method which will change the setting depending on which
         button is clicked.
         """
-        self.solidLineBtn.setIcon(QIcon("../icons/solid.png"))
+        self.solidLineBtn.setIcon(icon("solid"))
         self.solidLineBtn.setIconSize(QSize(25, 50))
         self.solidLineBtn.clicked.connect(lambda: self.setBrushLineStyle(self.solidLineBtn))
 
-        self.dashLineBtn.setIcon(QIcon("../icons/dash.png"))
+        self.dashLineBtn.setIcon(icon("dash"))
         self.dashLineBtn.setIconSize(QSize(25, 50))
         self.dashLineBtn.clicked.connect(lambda: self.setBrushLineStyle(self.dashLineBtn))
 
-        self.dotLineBtn.setIcon(QIcon("../icons/dot.png"))
+        self.dotLineBtn.setIcon(icon("dot"))
         self.dotLineBtn.setIconSize(QSize(25, 50))
         self.dotLineBtn.clicked.connect(lambda: self.setBrushLineStyle(self.dotLineBtn))
 
@@ -278,40 +604,136 @@ class PaintingApplication(QMainWindow):  # documentation https://doc.qt.io/qt-5/
 
         self.tools.vbox.addWidget(self.groupBoxColor)
 
+    def initLayers(self):
+        """Init the layer list with its buttons, the opacity slider and the blend mode of the active layer"""
+        self.layerList.setMaximumHeight(120)
+        self.layerList.currentRowChanged.connect(self.selectLayer)
+        self.layerList.itemChanged.connect(self.layerVisibilityChange)  # the check box of a row shows the layer
+
+        buttons = QHBoxLayout()
+        for text, slot in (("+", self.addLayer), ("-", self.removeLayer), ("Up", lambda: self.moveLayer(1)),
+                           ("Down", lambda: self.moveLayer(-1))):
+            btn = QPushButton(text)
+            btn.setFixedWidth(40)
+            btn.clicked.connect(slot)
+            buttons.addWidget(btn)
+
+        self.layerOpacity.setMinimum(0)
+        self.layerOpacity.setMaximum(100)
+        self.layerOpacity.valueChanged.connect(self.layerOpacityChange)
+
+        self.layerBlendMode.addItems(list(BLEND_MODES))
+        self.layerBlendMode.currentTextChanged.connect(self.layerBlendModeChange)
+
+        qv = QVBoxLayout()
+        qv.addWidget(self.layerList)
+        qv.addLayout(buttons)
+        qv.addWidget(self.layerOpacity)
+        qv.addWidget(self.layerOpacityLabel)
+        qv.addWidget(self.layerBlendMode)
+        self.layerGroup.setLayout(qv)
+        self.tools.vbox.addWidget(self.layerGroup)
+        self.refreshLayers()
+
+    def layerRow(self, index):
+        """Converts between layer indexes (bottom first) and rows of the layer list (top first)"""
+        return len(self.painter.layers.layers) - 1 - index
+
+    def refreshLayers(self):
+        """Rebuilds the layer list and the controls of the active layer from the layer stack of the painter"""
+        layers = self.painter.layers
+        self.layerList.blockSignals(True)  # the rows are rebuilt, not changed by the user
+        self.layerList.clear()
+        for layer in reversed(layers.layers):
+            item = QListWidgetItem(layer.name)  # documentation: https://doc.qt.io/qt-5/qlistwidgetitem.html
+            item.setFlags(item.flags() | Qt.ItemIsUserCheckable)
+            item.setCheckState(Qt.Checked if layer.visible else Qt.Unchecked)
+            self.layerList.addItem(item)
+        self.layerList.setCurrentRow(self.layerRow(layers.activeIndex))
+        self.layerList.blockSignals(False)
+
+        active = layers.active()
+        self.layerOpacity.blockSignals(True)
+        self.layerOpacity.setValue(round(active.opacity * 100))
+        self.layerOpacity.blockSignals(False)
+        self.layerOpacityLabel.setText("Opacity: {}%".format(round(active.opacity * 100)))
+        self.layerBlendMode.blockSignals(True)
+        self.layerBlendMode.setCurrentText(active.blendMode)
+        self.layerBlendMode.setEnabled(layers.activeIndex > 0)  # the background layer is always Normal
+        self.layerBlendMode.blockSignals(False)
+
+    def layersChanged(self):
+        """Repaints the painting and the layer controls after a layer operation"""
+        self.painter.layersChanged()
+        self.refreshLayers()
+
+    def selectLayer(self, row):
+        """Makes the layer of the selected row the one the strokes go to"""
+        if row < 0:
+            return
+        self.painter.endStroke()
+        self.painter.layers.activeIndex = self.layerRow(row)
+        self.refreshLayers()
+
+    def addLayer(self):
+        """Adds an empty layer above the active layer"""
+        self.painter.endStroke()
+        self.painter.layers.addLayer()
+        self.layersChanged()
+
+    def removeLayer(self):
+        """Removes the active layer, the background layer stays"""
+        self.painter.endStroke()
+        self.painter.layers.removeLayer(self.painter.layers.activeIndex)
+        self.layersChanged()
+
+    def moveLayer(self, offset):
+        """Moves the active layer up or down"""
+        self.painter.endStroke()
+        self.painter.layers.moveLayer(self.painter.layers.activeIndex, offset)
+        self.layersChanged()
+
+    def layerVisibilityChange(self, item):
+        """Shows or hides the layer of a row when its check box changes"""
+        index = self.layerRow(self.layerList.row(item))
+        self.painter.layers.setVisible(index, item.checkState() == Qt.Checked)
+        self.layersChanged()
+
+    def layerOpacityChange(self, value):
+        """Sets the opacity of the active layer when the slider value changes"""
+        self.painter.layers.setOpacity(self.painter.layers.activeIndex, value / 100)
+        self.layersChanged()
+
+    def layerBlendModeChange(self, blendMode):
+        """Sets the blend mode of the active layer"""
+        self.painter.layers.setBlendMode(self.painter.layers.activeIndex, blendMode)
+        self.layersChanged()
+
     def setBrushCap(self, btn):
         """Sets the brush cap based on the btn text"""
         if btn.text() == "Flat" and btn.isChecked():
-            print("setting flat cap")
             self.painter.brushCap = Qt.FlatCap
         if btn.text() == "Round" and btn.isChecked():
-            print("setting round cap")
             self.painter.brushCap = Qt.RoundCap
         if btn.text() == "Square" and btn.isChecked():
-            print("setting square cap")
             self.painter.brushCap = Qt.SquareCap
 
     def setBrushJoin(self, btn):
         """Sets the brush join based on the btn text"""
         if btn.text() == "Bevel" and btn.isChecked():
-            print("setting bevel join")
             self.painter.brushJoin = Qt.BevelJoin
         if btn.text() == "Miter" and btn.isChecked():
-            print("setting miter join")
             self.painter.brushJoin = Qt.MiterJoin
         if btn.text() == "Round" and btn.isChecked():
-            print("setting round join")
             self.painter.brushJoin = Qt.RoundJoin
 
     def setBrushLineStyle(self, btn):
         """Sets the brush line style based on the btn text"""
         if btn.text() == "Dash" and btn.isChecked():
-            print("dash line style")
             self.painter.brushStyle = Qt.DashLine
         if btn.text() == "Dot" and btn.isChecked():
-            print("dot line style")
             self.painter.brushStyle = Qt.DotLine
         if btn.text() == "Solid" and btn.isChecked():
-            print("solid line style")
             self.painter.brushStyle = Qt.SolidLine
 
     def colorDialog(self):
@@ -323,18 +745,268 @@ class PaintingApplication(QMainWindow):  # documentation https://doc.qt.io/qt-5/
 
     def save(self):
         """Saves the painting into an image"""
-        filePath, _ = QFileDialog.getSaveFileName(self, "Save Image", "", "PNG(*.png);;JPG(*.jpg *.jpeg);;All Files (*.*)")
+        filePath, _ = QFileDialog.getSaveFileName(self, "Save Image", "", "PNG(*.png);;JPG(*.jpg *.jpeg);;Project(*.pqp);;All Files (*.*)")
         if filePath == "":  # if the file path is empty
             return  # do nothing and return
-        self.painter.image.save(filePath)  # save file image to the file path
+        if filePath.lower().endswith(EXTENSION):
+            self.saveProjectAs(filePath)
+            return
+
+        options = self.saveOptions(filePath)
+        if options is None:  # the options dialog was cancelled
+            return
+        self.saveCompression, self.saveQuality = options
+
+        # the canvas is snapshotted here and encoded on a worker thread, painting can continue while it is written
+        background = self.painter.layers.background().canvas  # compact documents are written in their own format
+        task = ImageSaveTask(self.painter.layers.flatten(), filePath, self.saveCompression, self.saveQuality,
+                             background.format, background.colorTable)
+        task.signals.finished.connect(self.saveFinished)
+        task.signals.failed.connect(self.saveFailed)
+        self.saveTasks.append(task)
+        self.statusBar().showMessage("Saving {}...".format(filePath))  # documentation: https://doc.qt.io/qt-5/qmainwindow.html#statusBar
+        saveImage(task)
+
+    def saveProject(self):
+        """Writes the changes since the last save into the current project, asks for a file the first time"""
+        if self.project is not None:
+            self.saveProjectAs(self.project.path)
+            return
+        filePath, _ = QFileDialog.getSaveFileName(self, "Save Project", "", "Project(*.pqp);;All Files (*.*)")
+        if filePath == "":
+            return
+        if not filePath.lower().endswith(EXTENSION):
+            filePath += EXTENSION
+        self.saveProjectAs(filePath)
+
+    def saveProjectAs(self, filePath):
+        """Saves the layers, brush settings and history into a project file, unchanged tiles are not written again"""
+        start = time.perf_counter()
+        try:
+            self.project = saveProject(self.painter, filePath, self.project)
+        except (OSError, ProjectError) as error:
+            self.statusBar().showMessage("Could not save {}: {}".format(filePath, error))
+            return
+        self.statusBar().showMessage("Saved {} in {:.2f} s".format(filePath, time.perf_counter() - start), 5000)
+
+    def openProject(self, filePath):
+        """Opens a project file, its tiles are only read when they are shown"""
+        project = None
+        try:
+            project = ProjectFile(filePath)
+            self.painter.openProject(project)
+        except (OSError, ProjectError, LookupError, TypeError, ValueError) as error:  # LookupError: a damaged index
+            if project is not None:
+                project.close()  # the painting was left as it was
+            QMessageBox.warning(self, "Open Project", "Could not open {}: {}".format(filePath, error))
+            return
+        self.replaceProject(project)
+        self.refreshLayers()
+        self.refreshBrushControls()
+
+    def replaceProject(self, project):
+        """Makes project (None for a painting without one) the ProjectFile of the painting, the file of the replaced
+        painting is closed"""
+        if self.project is not None and self.project is not project:
+            self.project.close()
+        self.project = project
+
+    def saveOptions(self, filePath):
+        """Asks for the encoder settings, returns (compression, quality) or None if cancelled"""
+        dialog = QDialog(self)
+        dialog.setWindowTitle("Save Options")
+        isPng = filePath.lower().endswith((".png", ".tif", ".tiff"))
+
+        # lower compression is faster to encode but gives bigger PNG files
+        compression = QSlider(Qt.Horizontal)
+        compression.setRange(0, 9)
+        compression.setValue(self.saveCompression if self.saveCompression >= 0 else 6)
+        compression.setEnabled(isPng)
+        compressionLabel = QLabel(str(compression.value()))
+        compression.valueChanged.connect(lambda value: compressionLabel.setText(str(value)))
+
+        # lower quality gives smaller JPG files
+        quality = QSlider(Qt.Horizontal)
+        quality.setRange(0, 100)
+        quality.setValue(self.saveQuality if self.saveQuality >= 0 else 75)
+        quality.setEnabled(not isPng)
+        qualityLabel = QLabel(str(quality.value()))
+        quality.valueChanged.connect(lambda value: qualityLabel.setText(str(value)))
+
+        buttons = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Cancel)  # documentation: https://doc.qt.io/qt-5/qdialogbuttonbox.html
+        buttons.accepted.connect(dialog.accept)
+        buttons.rejected.connect(dialog.reject)
+
+        grid = QGridLayout()
+        grid.addWidget(QLabel("Compression level (PNG)"), 0, 0)
+        grid.addWidget(compression, 0, 1)
+        grid.addWidget(compressionLabel, 0, 2)
+        grid.addWidget(QLabel("Quality (JPG)"), 1, 0)
+        grid.addWidget(quality, 1, 1)
+        grid.addWidget(qualityLabel, 1, 2)
+        grid.addWidget(buttons, 2, 0, 1, 3)
+        dialog.setLayout(grid)
+
+        if dialog.exec() != QDialog.Accepted:
+            return None
+        return (compression.value() if isPng else -1), (quality.value() if not isPng else -1)
+
+    def saveFinished(self, filePath, seconds):
+        """Reports a finished background save in the status bar"""
+        self.saveTasks = [task for task in self.saveTasks if task.signals is not self.sender()]
+        self.statusBar().showMessage("Saved {} in {:.2f} s".format(filePath, seconds), 5000)
+
+    def saveFailed(self, filePath, message):
+        """Reports a failed background save in the status bar"""
+        self.saveTasks = [task for task in self.saveTasks if task.signals is not self.sender()]
+        self.statusBar().showMessage("Could not save {}: {}".format(filePath, message))
+
+    def refreshPixelFormat(self):
+        """Checks the working pixel format of the painting in the Pixel Format menu, adding its actions the first time"""
+        if self.pixelFormatActions is None:
+            self.pixelFormatActions = QActionGroup(self)  # documentation: https://doc.qt.io/qt-5/qactiongroup.html
+            for name, imageFormat in PIXEL_FORMATS.items():
+                action = self.pixelFormatActions.addAction(name)
+                action.setCheckable(True)
+                action.setData(imageFormat)
+                action.triggered.connect(lambda checked, imageFormat=imageFormat: self.setPixelFormat(imageFormat))
+                self.pixelFormatMenu.addAction(action)
+        for action in self.pixelFormatActions.actions():
+            action.setChecked(action.data() == self.painter.pixelFormat())
+
+    def setPixelFormat(self, imageFormat):
+        """Converts the painting into another pixel format after asking, the layers are flattened"""
+        if imageFormat == self.painter.pixelFormat():
+            return
+        btnReply = QMessageBox.question(self, 'Pixel Format', "Converting flattens the layers and clears the undo history. Convert?",
+                                        QMessageBox.Yes | QMessageBox.No, QMessageBox.No)
+        if btnReply == QMessageBox.Yes:
+            self.painter.setPixelFormat(imageFormat)
+            self.replaceProject(None)  # the converted painting no longer matches the tiles of the project
+            self.refreshLayers()
+
+    def exportStrokes(self):
+        """Saves the strokes recorded since the painting was created or opened"""
+        filePath, _ = QFileDialog.getSaveFileName(self, "Export Stroke Recording", "", "Stroke Recording(*.strokes);;All Files (*.*)")
+        if filePath == "":
+            return
+        self.painter.recording.save(filePath)
+        self.statusBar().showMessage("Exported {} strokes to {}".format(len(self.painter.recording.strokes), filePath), 5000)
 
     def clear(self):
         """Clears the painting without saving it"""
         btnReply = QMessageBox.question(self, 'Clear Confirmation', "Clear Painting?", QMessageBox.Yes | QMessageBox.No, QMessageBox.No)
         if btnReply == QMessageBox.Yes:
-            self.painter.image.fill(Qt.white)   # fill the image with white, documentaiton: https://doc.qt.io/qt-5/qimage.html#fill-2
+            self.painter.endStroke()
+            self.painter.history.beginStep()    # clearing can be undone
+            self.painter.canvas.clear()         # release the painted tiles of the active layer
+            self.painter.history.endStep()
             self.painter.update()               # call the update method of the widget which calls the paintEvent of this class
 
+    def filter(self, name):
+        """Shows the dialog of a filter and applies it to the active layer in the background when confirmed"""
+        if self.filterTask is not None:
+            return  # one filter at a time
+        self.painter.endStroke()
+        filter = Filters.FILTERS[name]
+        canvas = self.painter.canvas
+        image = canvas.toImage()
+
+        values = self.filterOptions(filter, image)
+        if values is None:  # the dialog was cancelled
+            return
+
+        self.filterCanvas = canvas
+        self.filterTask = Filters.FilterTask(image, filter, values)
+        self.filterTask.signals.finished.connect(self.filterFinished)
+        self.filterTask.signals.failed.connect(self.filterFailed)
+        self.painter.setEnabled(False)  # the result replaces the layer, strokes made meanwhile would be lost
+        self.statusBar().showMessage("Applying {}...".format(name))
+        Filters.runFilter(self.filterTask)
+
+    def filterOptions(self, filter, image):
+        """Asks for the filter parameters while previewing them on a small proxy, returns the values or None if cancelled"""
+        dialog = QDialog(self)
+        dialog.setWindowTitle(filter.name)
+        proxy, scale = Filters.previewProxy(image)
+
+        previewLabel = QLabel()
+        previewLabel.setAlignment(Qt.AlignCenter)
+        previewLabel.setMinimumSize(Filters.PREVIEW_SIZE, Filters.PREVIEW_SIZE)
+        sliders = []
+
+        def updatePreview():
+            values = [slider.value() for slider in sliders]
+            previewLabel.setPixmap(QPixmap.fromImage(Filters.preview(proxy, scale, filter, values)))
+
+        grid = QGridLayout()
+        grid.addWidget(previewLabel, 0, 0, 1, 3)
+        for row, parameter in enumerate(filter.parameters, 1):
+            slider = QSlider(Qt.Horizontal)
+            slider.setRange(parameter.minimum, parameter.maximum)
+            slider.setValue(parameter.default)
+            valueLabel = QLabel(str(parameter.default))
+            slider.valueChanged.connect(lambda value, label=valueLabel: label.setText(str(value)))
+            slider.valueChanged.connect(updatePreview)
+            grid.addWidget(QLabel(parameter.name), row, 0)
+            grid.addWidget(slider, row, 1)
+            grid.addWidget(valueLabel, row, 2)
+            sliders.append(slider)
+
+        buttons = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Cancel)
+        buttons.accepted.connect(dialog.accept)
+        buttons.rejected.connect(dialog.reject)
+        grid.addWidget(buttons, len(filter.parameters) + 1, 0, 1, 3)
+        dialog.setLayout(grid)
+        updatePreview()
+
+        if dialog.exec() != QDialog.Accepted:
+            return None
+        return [slider.value() for slider in sliders]
+
+    def filterFinished(self, image, seconds):
+        """Writes the filtered layer back as one undo step"""
+        self.painter.history.beginStep()
+        rect = Filters.applyImage(self.filterCanvas, image)
+        self.painter.history.endStep()
+        self.painter.updateCanvasRect(rect)
+        self.statusBar().showMessage("{} applied in {:.2f} s".format(self.filterTask.filter.name, seconds), 5000)
+        self.endFilter()
+
+    def filterFailed(self, message):
+        """Reports a filter which could not be applied"""
+        self.statusBar().showMessage("Could not apply {}: {}".format(self.filterTask.filter.name, message))
+        self.endFilter()
+
+    def endFilter(self):
+        self.filterTask = None
+        self.filterCanvas = None
+        self.painter.setEnabled(True)
+
+    def undo(self):
+        """Undoes the last stroke"""
+        self.painter.undo()
+
+    def redo(self):
+        """Redoes the last undone stroke"""
+        self.painter.redo()
+
+    def zoomIn(self):
+        """Zooms the view in"""
+        self.painter.zoomBy(1.25)
+
+    def zoomOut(self):
+        """Zooms the view out"""
+        self.painter.zoomBy(0.8)
+
+    def actualSize(self):
+        """Shows the painting at 100% zoom"""
+        self.painter.actualSize()
+
+    def fitToWindow(self):
+        """Zooms the view so the whole painting is visible"""
+        self.painter.fitCanvas()
+
     def threepx(self):
         """sets the brush width is set to 3"""
         self.painter.brushWidth = 3
@@ -375,16 +1047,25 @@ class PaintingApplication(QMainWindow):  # documentation https://doc.qt.io/qt-5/
         tb.setReadOnly(True)
         tb.setText("<p>User Guide</p>"
                    "<p>Menus:</p>"
-                   "<p>File:<ul><li>Save</li><li>Clear</li><li>Exit</li></ul></p>"
+                   "<p>File:<ul><li>Open</li><li>Save</li><li>Export Stroke Recording</li><li>Clear</li><li>Exit</li></ul></p>"
+                   "<p>Edit:<ul><li>Undo</li><li>Redo</li></ul></p>"
+                   "<p>View:<ul><li>Zoom In</li><li>Zoom Out</li><li>Actual Size</li><li>Fit to Window</li></ul></p>"
+                   "<p>Filter:<ul><li>Blur</li><li>Sharpen</li><li>Brightness/Contrast</li><li>Invert</li><li>Grayscale</li><li>Threshold</li></ul></p>"
                    "<p>Brush Size:<ul><li>3px</li><li>5px</li><li>7px</li><li>9px</li></ul></p>"
+                   "<p>Help:<ul><li>User Guide</li><li>Performance HUD</li><li>Save Performance Trace</li><li>About</li></ul></p>"
                    "<p>Brush Color:<ul><li>Black</li><li>Red</li><li>Green</li><li>Yellow</li></ul></p>"
+                   "<p>Session:<ul><li>Host Session</li><li>Join Session</li><li>Leave Session</li></ul></p>"
                    "<p>Tools:</p>"
                    "<ul>"
+                   "<li>Tool: Brush, Soft Brush (follows tablet pressure and tilt) or Bucket fill (with color tolerance)</li>"
+                   "<li>Soft Brush: hardness, spacing, opacity, rotation and pressure response</li>"
                    "<li>Brush Cap Style</li>"
                    "<li>Brush Join Style</li>"
                    "<li>Brush Line Style</li>"
                    "<li>Brush Width</li>"
+                   "<li>Stroke Smoothing: point spacing and curve smoothing of strokes</li>"
                    "<li>Brush Color</li>"
+                   "<li>Layers: add, remove, reorder, show or hide layers, set their opacity and blend mode</li>"
                    "</ul>"
                    )
         tb.setAlignment(Qt.AlignLeft)
@@ -393,6 +1074,36 @@ class PaintingApplication(QMainWindow):  # documentation https://doc.qt.io/qt-5/
         helpWindow.setFixedWidth(360)
         helpWindow.show()
 
+    def togglePerformanceHud(self, checked):
+        """Shows or hides the performance HUD, the hot paths are only timed while it is shown"""
+        profiler.enabled = checked
+        self.painter.showHud = checked
+        if checked:
+            profiler.reset()
+            self.statusBar().addPermanentWidget(self.hudLabel)  # documentation: https://doc.qt.io/qt-5/qstatusbar.html#addPermanentWidget
+            self.hudLabel.show()
+            self.hudTimer.start(500)
+        else:
+            self.hudTimer.stop()
+            self.statusBar().removeWidget(self.hudLabel)
+        self.painter.update(HUD_RECT)
+
+    def refreshHud(self):
+        """Updates the HUD overlay and the status bar readout with the latest samples"""
+        self.hudLabel.setText(" | ".join(self.painter.hudLines()))
+        self.painter.update(HUD_RECT)
+
+    def saveTrace(self):
+        """Saves the samples of the profiled hot paths as a JSON trace, e.g. to attach it to a lag report"""
+        if not profiler.trace:
+            QMessageBox.information(self, "Performance Trace", "No samples yet, show the Performance HUD while reproducing the lag.")
+            return
+        filePath, _ = QFileDialog.getSaveFileName(self, "Save Performance Trace", "trace.json", "JSON(*.json);;All Files (*.*)")
+        if filePath == "":
+            return
+        count = profiler.saveTrace(filePath)
+        self.statusBar().showMessage("Saved {} samples to {}".format(count, filePath), 5000)
+
     def about(self):
         """Opens a QDialog to display about page"""
         aboutWindow = QDialog(self)
@@ -408,29 +1119,220 @@ class PaintingApplication(QMainWindow):  # documentation https://doc.qt.io/qt-5/
         aboutWindow.show()
 
     def open(self):
-        """Opens a file dialog box and sets the QImage into the scaled version of the file"""
-        filePath, _ = QFileDialog.getOpenFileName(self, "Open Image", "", "PNG(*.png);;JPG(*.jpg *.jpeg);;All Files (*.*)")
+        """Opens a file dialog box and loads the selected image in the background"""
+        filePath, _ = QFileDialog.getOpenFileName(self, "Open Image", "", "PNG(*.png);;JPG(*.jpg *.jpeg);;Project(*.pqp);;All Files (*.*)")
         if filePath == "":
             # if no file is selected return
             return
+        if isProject(filePath):
+            self.cancelOpen()
+            self.openProject(filePath)
+            return
 
-        # opens the file to read in binary mode
-        with open(filePath, 'rb') as f:
-            fileData = f.read()
-
-        # loads file into the painter image variable
-        self.painter.image.loadFromData(fileData)
-
-        # gets the width of the current painter QImage
-        width = self.width()
-        # gets the height of the current painter QImage
-        height = self.height()
-
-        # scales the painter image from the file and put it in the QImage
-        self.painter.image = self.painter.image.scaled(width, height)
-
-        # update the widget
-        self.update()
+        # decode the file on a worker thread, the painting is replaced once the full image is ready
+        self.cancelOpen()
+        # the image replaces all layers with a background layer in the working format picked from the file
+        self.openTask = ImageLoadTask(filePath, None, None, QSize(240, 240))
+        self.openTask.signals.progress.connect(self.openProgress)
+        self.openTask.signals.preview.connect(self.openPreview)
+        self.openTask.signals.finished.connect(self.openFinished)
+        self.openTask.signals.failed.connect(self.openFailed)
+
+        # documentation: https://doc.qt.io/qt-5/qprogressdialog.html
+        self.openDialog = QProgressDialog("Opening {}".format(filePath), "Cancel", 0, 100, self)
+        self.openDialog.setWindowTitle("Open Image")
+        self.openDialog.setWindowModality(Qt.WindowModal)
+        self.openDialog.setMinimumDuration(300)  # quick opens never show the dialog
+        self.openDialog.canceled.connect(self.cancelOpen)
+
+        loadImage(self.openTask)
+
+    def openProgress(self, value):
+        """Shows the progress of the image which is being opened"""
+        if self.isCurrentOpen():
+            self.openDialog.setValue(value)
+
+    def openPreview(self, preview):
+        """Shows the reduced size preview of the image which is being opened"""
+        if self.isCurrentOpen():
+            label = QLabel()
+            label.setPixmap(QPixmap.fromImage(preview))
+            label.setAlignment(Qt.AlignCenter)
+            self.openDialog.setLabel(label)  # documentation: https://doc.qt.io/qt-5/qprogressdialog.html#setLabel
+
+    def openFinished(self, canvas):
+        """Swaps the fully decoded image into the painter"""
+        if not self.isCurrentOpen():
+            return
+        self.closeOpenDialog()
+        self.openTask = None
+        # the image keeps its full resolution, only the view of the painter is zoomed to fit into the window
+        self.painter.openCanvas(canvas)
+        self.replaceProject(None)  # saving the image as a project writes a new file
+        self.refreshLayers()
+
+    def openFailed(self, message):
+        """Reports an image which could not be decoded"""
+        if not self.isCurrentOpen():
+            return
+        self.closeOpenDialog()
+        self.openTask = None
+        QMessageBox.warning(self, "Open Image", message)
+
+    def isCurrentOpen(self):
+        """Returns True if the emitting task is the image which is being opened, not a cancelled one"""
+        return self.openTask is not None and self.sender() is self.openTask.signals
+
+    def cancelOpen(self):
+        """Stops the image which is currently being opened"""
+        if self.openTask is not None:
+            self.openTask.cancel()
+            self.openTask = None
+        self.closeOpenDialog()
+
+    def closeOpenDialog(self):
+        if self.openDialog is not None:
+            self.openDialog.canceled.disconnect(self.cancelOpen)
+            self.openDialog.close()
+            self.openDialog = None
+
+    def sessionClient(self):
+        """Returns the client of the shared session, created when first needed"""
+        if self.session is None:
+            self.session = SessionClient(self.painter, platform.node(), self)
+            self.session.joined.connect(self.sessionJoined)
+            self.session.left.connect(self.sessionLeft)
+        return self.session
+
+    def askAddress(self, title, label, host):
+        """Asks for a HOST:PORT address, returns (host, port) or None if cancelled"""
+        text, ok = QInputDialog.getText(self, title, label, text="{}:{}".format(host, DEFAULT_PORT))
+        if not ok:
+            return None
+        host, _, port = text.strip().rpartition(":")
+        if not host or not port.isdigit():
+            QMessageBox.warning(self, title, "Expected HOST:PORT, e.g. 127.0.0.1:{}".format(DEFAULT_PORT))
+            return None
+        return host, int(port)
+
+    def hostSession(self):
+        """Starts a session server sharing the background layer of the painting and joins it"""
+        canvas = self.painter.layers.background().canvas
+        formatName = {imageFormat: name for name, imageFormat in SESSION_FORMATS.items()}.get(canvas.format)
+        if formatName is None:
+            QMessageBox.warning(self, "Host Session", "Indexed paintings cannot be shared, convert the painting with "
+                                                      "File > Pixel Format first.")
+            return
+        address = self.askAddress("Host Session", "Listen on (0.0.0.0 accepts the local network):", "127.0.0.1")
+        if address is None:
+            return
+        self.leaveSession()
+
+        # the server runs in its own process, so painting never waits for the clients
+        self.sessionAddress = address
+        self.sessionServer = QProcess(self)  # documentation: https://doc.qt.io/qt-5/qprocess.html
+        self.sessionServer.setProcessChannelMode(QProcess.MergedChannels)
+        self.sessionServer.readyReadStandardOutput.connect(self.sessionServerOutput)
+        self.sessionServer.finished.connect(self.sessionServerFinished)
+        self.sessionServer.start(sys.executable, [os.path.abspath(__file__), "--serve", "--host", address[0],
+                                                  "--port", str(address[1]), "--size", "{}x{}".format(canvas.width, canvas.height),
+                                                  "--format", formatName, "--background", canvas.background.name(QColor.HexArgb)])
+        self.statusBar().showMessage("Starting the session server...")
+
+    def sessionServerOutput(self):
+        """Joins the hosted session once its server listens, the rest of its output is shown in the status bar"""
+        for line in bytes(self.sessionServer.readAllStandardOutput()).decode(errors="replace").splitlines():
+            if line.startswith("listening on") and not self.sessionClient().active:
+                host = "127.0.0.1" if self.sessionAddress[0] in ("0.0.0.0", "") else self.sessionAddress[0]
+                self.session.join(host, self.sessionAddress[1], share=True)
+            elif line:
+                self.statusBar().showMessage("Session: {}".format(line), 5000)
+
+    def sessionServerFinished(self):
+        if self.sessionServer is not None and self.sessionServer.exitCode() != 0:
+            QMessageBox.warning(self, "Host Session", "The session server stopped with exit code {}.".format(
+                self.sessionServer.exitCode()))
+        self.sessionServer = None
+
+    def joinSession(self):
+        """Replaces the painting with the shared canvas of a session"""
+        address = self.askAddress("Join Session", "Session address, the painting is replaced by the shared canvas:",
+                                  "127.0.0.1")
+        if address is not None:
+            self.joinAddress(*address)
+
+    def joinAddress(self, host, port):
+        self.leaveSession()
+        self.sessionClient().join(host, port)
+        self.statusBar().showMessage("Joining {}:{}...".format(host, port))
+
+    def leaveSession(self):
+        """Leaves the session, a hosted session ends for everyone"""
+        if self.session is not None:
+            self.session.leave()
+        if self.sessionServer is not None:
+            server, self.sessionServer = self.sessionServer, None
+            server.readyReadStandardOutput.disconnect(self.sessionServerOutput)
+            server.finished.disconnect(self.sessionServerFinished)
+            server.terminate()
+            server.waitForFinished(1000)
+
+    def sessionJoined(self):
+        if self.session.share:
+            # the hosted canvas is the painting itself, tiles it has not read yet still come from the project file
+            self.project = None
+        else:
+            self.replaceProject(None)  # the shared canvas is not the painting of the project
+        self.refreshLayers()
+        self.statusBar().showMessage("Joined the session, strokes on the background layer are shared", 5000)
+
+    def sessionLeft(self, reason):
+        self.statusBar().showMessage(reason, 5000)
+
+    def startAutosave(self, path=None):
+        """Offers to restore the painting of a crashed session, then checkpoints the canvas periodically"""
+        if path is None:
+            # documentation: https://doc.qt.io/qt-5/qstandardpaths.html
+            directory = QStandardPaths.writableLocation(QStandardPaths.AppLocalDataLocation)
+            os.makedirs(directory, exist_ok=True)
+            path = os.path.join(directory, "autosave.journal")
+
+        self.journal = AutosaveJournal(path)
+        if not self.journal.acquire():
+            return  # another instance owns the journal
+        if self.journal.exists():
+            interrupted = self.journal.interrupted()
+            if interrupted:
+                # the default answer starts with a new painting, the tiles may be a mix of two autosaves
+                btnReply = QMessageBox.warning(self, 'Restore Painting', "The painting of the last session was not saved "
+                                               "and its last autosave was interrupted, parts of it may be older than the "
+                                               "rest. Restore it anyway?", QMessageBox.Yes | QMessageBox.No, QMessageBox.No)
+            else:
+                btnReply = QMessageBox.question(self, 'Restore Painting', "The painting of the last session was not saved. "
+                                                "Restore it?", QMessageBox.Yes | QMessageBox.No, QMessageBox.Yes)
+            if btnReply == QMessageBox.Yes:
+                canvas = self.journal.recover(allowInterrupted=interrupted)
+                if canvas is not None:
+                    self.painter.openCanvas(canvas)  # layers and the pixel format are not journaled
+                    self.replaceProject(None)
+                    self.refreshLayers()
+                else:
+                    self.statusBar().showMessage("The painting of the last session could not be restored", 5000)
+
+        self.journal.reset(self.painter.layers.flatten())  # the journal keeps the flattened painting
+        self.autosaveTimer.start(AUTOSAVE_INTERVAL)
+
+    def autosave(self):
+        """Writes the tiles changed since the last autosave into the journal"""
+        self.journal.checkpoint(self.painter.layers.flatten())
+
+    def closeEvent(self, event):
+        """The journal is only kept when the application does not exit normally"""
+        if self.journal is not None:
+            self.autosaveTimer.stop()
+            self.journal.discard()
+        self.leaveSession()
+        super().closeEvent(event)
 
     def exit(self):
         """Exits the applications after a confirmation"""
@@ -439,11 +1341,55 @@ class PaintingApplication(QMainWindow):  # documentation https://doc.qt.io/qt-5/
             self.close()
 
 
+def reportStartup(stages):
+    """Prints how long each startup stage took, stages are (name, start, end) perf_counter timestamps"""
+    print("Startup time:", file=sys.stderr)
+    for name, start, end in stages:
+        print("  {:<22}{:8.1f} ms".format(name, (end - start) * 1000), file=sys.stderr)
+    print("  {:<22}{:8.1f} ms".format("total", (stages[-1][2] - stages[0][1]) * 1000), file=sys.stderr)
+
+
 # this code will be executed if it is the main module but not if the module is imported
 #  https://stackoverflow.com/questions/419163/what-does-if-name-main-do
 if __name__ == "__main__":
+    if sys.argv[1:2] == ["--batch"]:
+        # headless mode, no window is opened and no display server is needed
+        import Batch
+        sys.exit(Batch.main(sys.argv[2:]))
+    if sys.argv[1:2] == ["--serve"]:
+        # hosts a shared painting session without a window
+        import SessionServer
+        sys.exit(SessionServer.main(sys.argv[2:]))
+
+    # --startup-report prints how long the imports, the widgets and the first paint took
+    startupReport = "--startup-report" in sys.argv
+    if startupReport:
+        sys.argv.remove("--startup-report")
+    # --join HOST:PORT joins a shared session once the window is shown
+    joinAddress = None
+    if "--join" in sys.argv[:-1]:
+        index = sys.argv.index("--join")
+        joinAddress = sys.argv[index + 1].rpartition(":")
+        del sys.argv[index:index + 2]
+
     app = QApplication(sys.argv)
+    app.setApplicationName("PyQt Paint")  # names the directory of the autosave journal
+    appCreated = time.perf_counter()
     window = PaintingApplication()
+    windowBuilt = time.perf_counter()
     window.show()
+    shown = time.perf_counter()
+    window.startAutosave()
+    autosaveStarted = time.perf_counter()
+    if joinAddress is not None:
+        window.joinAddress(joinAddress[0], int(joinAddress[2]))
+
+    if startupReport:
+        def firstPaint(name, seconds):
+            profiler.removeHook(name, firstPaint)
+            reportStartup([("imports", STARTED, IMPORTED), ("QApplication", IMPORTED, appCreated),
+                           ("widgets", appCreated, windowBuilt), ("show", windowBuilt, shown),
+                           ("autosave journal", shown, autosaveStarted), ("first paint", autosaveStarted, time.perf_counter())])
+        profiler.addHook("Painter.paintEvent", firstPaint)
     # starts the event loop running
     app.exec()
\ No newline at end of file
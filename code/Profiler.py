@@ -0,0 +1,134 @@
+"""
+Profiler keeps timing samples of named hot paths (e.g. "Painter.mouseMoveEvent") for the performance HUD and for
+JSON trace files. Hot paths are wrapped with the profiler.timed(name) decorator; while the profiler is not enabled and
+nothing is attached the wrapper only checks a flag.
+
+Hook API:
+    profiler.addHook(name, hook)       hook(name, seconds) is called after every run of the hot path
+    profiler.attachProfile(name)       runs the hot path under a cProfile.Profile, returned for pstats
+    profiler.saveTrace(path)           writes the samples as a Chrome trace (chrome://tracing, ui.perfetto.dev)
+"""
+from collections import deque
+import cProfile
+import functools
+import json
+import os
+import threading
+import time
+
+MAX_SAMPLES = 2000  # latest runs kept per hot path for the statistics
+MAX_TRACE_EVENTS = 200000  # runs kept for the trace file, about 20 MB of JSON
+
+
+class Profiler:
+    def __init__(self):
+        self.enabled = False  # collect samples and trace events
+        self.samples = {}  # name -> deque of (start, seconds)
+        self.trace = deque(maxlen=MAX_TRACE_EVENTS)  # (name, start, seconds, thread id)
+        self.hooks = {}  # name -> list of hook(name, seconds)
+        self.profiles = {}  # name -> cProfile.Profile
+        self.origin = time.perf_counter()
+
+    def active(self, name):
+        return self.enabled or name in self.hooks or name in self.profiles
+
+    def addHook(self, name, hook):
+        self.hooks.setdefault(name, []).append(hook)
+
+    def removeHook(self, name, hook):
+        hooks = self.hooks.get(name, [])
+        if hook in hooks:
+            hooks.remove(hook)
+        if not hooks:
+            self.hooks.pop(name, None)
+
+    def attachProfile(self, name):
+        """Runs the hot path under cProfile from now on and returns the profile"""
+        profile = self.profiles.get(name)
+        if profile is None:
+            profile = self.profiles[name] = cProfile.Profile()  # documentation: https://docs.python.org/3/library/profile.html
+        return profile
+
+    def detachProfile(self, name):
+        """Stops profiling the hot path and returns its profile, e.g. for profile.dump_stats(path)"""
+        return self.profiles.pop(name, None)
+
+    def run(self, name, function, *args, **kwargs):
+        """Calls function and records how long it took under the given name"""
+        profile = self.profiles.get(name)
+        if profile is not None:
+            try:
+                profile.enable()
+            except ValueError:  # another profile is already running, e.g. a nested hot path
+                profile = None
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            seconds = time.perf_counter() - start
+            if profile is not None:
+                profile.disable()
+            self.record(name, start, seconds)
+
+    def record(self, name, start, seconds):
+        """Adds a sample measured elsewhere, e.g. by a timer of its own"""
+        if self.enabled:
+            samples = self.samples.get(name)
+            if samples is None:
+                samples = self.samples[name] = deque(maxlen=MAX_SAMPLES)
+            samples.append((start, seconds))
+            self.trace.append((name, start, seconds, threading.get_ident()))
+        for hook in tuple(self.hooks.get(name, ())):  # a hook may remove itself
+            hook(name, seconds)
+
+    def timed(self, name):
+        """Decorator recording every call of a function under the given name"""
+        def decorate(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                if not self.active(name):
+                    return function(*args, **kwargs)
+                return self.run(name, function, *args, **kwargs)
+            return wrapper
+        return decorate
+
+    def rate(self, name, window=1.0):
+        """Returns how many times per second the hot path ran during the last window seconds"""
+        samples = self.samples.get(name, ())
+        since = time.perf_counter() - window
+        return sum(1 for start, _ in reversed(samples) if start >= since) / window if samples else 0.0
+
+    def interval(self, name, window=1.0):
+        """Returns the mean seconds between two runs of the hot path during the last window seconds, None if unknown"""
+        since = time.perf_counter() - window
+        starts = [start for start, _ in self.samples.get(name, ()) if start >= since]
+        return (starts[-1] - starts[0]) / (len(starts) - 1) if len(starts) > 1 else None
+
+    def statistics(self, name):
+        """Returns the latency percentiles of the kept samples in milliseconds, None without samples"""
+        durations = sorted(seconds for _, seconds in self.samples.get(name, ()))
+        if not durations:
+            return None
+
+        def at(fraction):
+            return durations[min(len(durations) - 1, int(fraction * len(durations)))] * 1000
+
+        return {"p50": at(0.5), "p90": at(0.9), "p99": at(0.99), "max": durations[-1] * 1000,
+                "mean": sum(durations) / len(durations) * 1000, "count": len(durations)}
+
+    def reset(self):
+        self.samples = {}
+        self.trace.clear()
+
+    def saveTrace(self, path):
+        """Writes the trace events and the statistics of every hot path into a JSON file in the Chrome trace format"""
+        pid = os.getpid()
+        events = [{"name": name, "ph": "X", "pid": pid, "tid": thread, "ts": round((start - self.origin) * 1e6, 1),
+                   "dur": round(seconds * 1e6, 1)} for name, start, seconds, thread in list(self.trace)]
+        with open(path, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms",
+                       "statistics": {name: self.statistics(name) for name in self.samples}}, f)
+        return len(events)
+
+
+profiler = Profiler()  # shared by all hot paths of the application
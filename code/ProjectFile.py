@@ -0,0 +1,430 @@
+"""
+Native project files (.pqp) keep the layers, the brush settings and the undo history of a painting.
+Every tile is compressed on its own and listed in an index, so opening a project only maps the file with mmap and
+reads the index: a tile is decompressed the first time it is read, e.g. when it becomes visible (see LazyTiles).
+The blended composite and its mipmap levels are stored as well, so even a zoomed out view of a huge painting is shown
+from a few small tiles without decoding or blending the layers below it.
+
+Saving into the file a painting was opened from or last saved to appends only the tiles changed since then and a new
+index, then points the header to the new index. The blobs left behind are garbage; when more than half of the file
+would be garbage it is rewritten instead.
+
+File layout (little endian):
+    header      HEADER_FORMAT: magic, version, index offset, index length
+    blobs       zlib compressed tiles and undo history states, in any order
+    index       zlib compressed JSON: canvas size, layers, composite, mipmaps, brush settings and history,
+                every tile or state refers to its blob as [offset, length]
+"""
+from PyQt5.QtGui import QColor, QImage
+from PyQt5.QtCore import Qt
+
+from concurrent.futures import ThreadPoolExecutor
+import json
+import mmap
+import os
+import struct
+import weakref
+import zlib
+
+from TiledCanvas import TiledCanvas
+from Layers import Layer, LayerStack
+from History import HistoryStep, TileState
+from BrushEngine import DabBrush
+from StrokeFilter import StrokeFilter
+
+MAGIC = b"PQPPROJ1"
+VERSION = 1
+HEADER_FORMAT = "<8sIQQ"  # magic, version, index offset, index length
+HEADER_SIZE = 64
+EXTENSION = ".pqp"
+COMPRESSION = 1  # zlib level, the fastest one already shrinks flat painted areas to almost nothing
+GARBAGE_LIMIT = 0.5  # fraction of the file which may be garbage before a save rewrites it
+
+
+class ProjectError(Exception):
+    """Raised for a file which is not a readable project"""
+
+
+def isProject(path):
+    """Returns True if the file starts like a project file"""
+    try:
+        with open(path, "rb") as f:
+            return f.read(len(MAGIC)) == MAGIC
+    except OSError:
+        return False
+
+
+class LazyTiles(dict):
+    """A tile dictionary whose tiles stay compressed in a project file until they are read.
+    saved remembers the blob of every tile which still equals the file, so the next save can reuse it"""
+
+    def __init__(self, project, layout, pending, saved, loaded=None):
+        super().__init__(loaded or {})
+        self.project = project  # the ProjectFile holding the blobs
+        self.layout = layout  # (width, height, bytes per line, format, colour table) of the tiles
+        self.pending = dict(pending)  # key -> blob of the tiles not decompressed yet, None for a blank mipmap tile
+        self.saved = dict(saved)  # key -> blob of the tiles unchanged since they were read or saved
+
+    def decode(self, key):
+        """Decompresses a pending tile and keeps it"""
+        tile = self.project.readTile(self.pending.pop(key), self.layout)
+        super().__setitem__(key, tile)
+        return tile
+
+    def loadedValues(self):
+        """Returns the tiles decompressed so far, e.g. to count their memory"""
+        return super().values()
+
+    def changed(self, canvas, keys, rect=None):
+        """Change listener of the canvas, its changed tiles have to be written by the next save"""
+        for key in keys:
+            self.saved.pop(key, None)
+
+    def get(self, key, default=None):
+        if key in self.pending:
+            return self.decode(key)
+        return super().get(key, default)
+
+    def __getitem__(self, key):
+        if key in self.pending:
+            return self.decode(key)
+        return super().__getitem__(key)
+
+    def __setitem__(self, key, tile):
+        self.pending.pop(key, None)
+        self.saved.pop(key, None)
+        super().__setitem__(key, tile)
+
+    def __delitem__(self, key):
+        self.saved.pop(key, None)
+        if self.pending.pop(key, False) is False:
+            super().__delitem__(key)
+
+    def pop(self, key, *default):
+        if key in self.pending:
+            self.decode(key)
+        self.saved.pop(key, None)
+        return super().pop(key, *default)
+
+    def clear(self):
+        self.pending.clear()
+        self.saved.clear()
+        super().clear()
+
+    def __contains__(self, key):
+        return key in self.pending or super().__contains__(key)
+
+    def __len__(self):
+        return super().__len__() + len(self.pending)
+
+    def __iter__(self):
+        return iter(self.keys())  # a copy, reading a tile while iterating moves it out of pending
+
+    def keys(self):
+        return list(super().keys()) + list(self.pending)
+
+    def items(self):
+        """Yields every tile, pending tiles are decompressed one at a time without keeping them"""
+        yield from list(super().items())
+        for key, blob in list(self.pending.items()):
+            yield key, self.project.readTile(blob, self.layout)
+
+    def values(self):
+        for _, tile in self.items():
+            yield tile
+
+
+def tileLayout(canvas):
+    return canvas.tileSize, canvas.tileSize, canvas.blankTile.bytesPerLine(), int(canvas.format), canvas.colorTable
+
+
+def tilePixels(tile):
+    return tile.constBits().asstring(tile.sizeInBytes())
+
+
+def brushSettings(painter):
+    """Returns the brush settings of a Painter as JSON values"""
+    return {"color": QColor(painter.brushColor).rgba(), "width": painter.brushWidth, "style": int(painter.brushStyle),
+            "cap": int(painter.brushCap), "join": int(painter.brushJoin), "tool": painter.tool,
+            "fillTolerance": painter.fillTolerance, "dabBrush": dict(vars(painter.dabBrush)),
+            "strokeFilter": dict(vars(painter.strokeFilter)) if painter.strokeFilter is not None else None}
+
+
+def applyBrushSettings(painter, settings):
+    """Restores the brush settings of a Painter, settings missing in the file keep their current value.
+    Every setting is read before the first one is applied, so damaged settings leave the Painter as it was"""
+    color = QColor.fromRgba(settings.get("color", QColor(painter.brushColor).rgba()))
+    width = settings.get("width", painter.brushWidth)
+    style = Qt.PenStyle(settings.get("style", int(painter.brushStyle)))
+    cap = Qt.PenCapStyle(settings.get("cap", int(painter.brushCap)))
+    join = Qt.PenJoinStyle(settings.get("join", int(painter.brushJoin)))
+    tool = settings.get("tool", painter.tool)
+    fillTolerance = settings.get("fillTolerance", painter.fillTolerance)
+    dabBrush = DabBrush(**settings["dabBrush"]) if settings.get("dabBrush") is not None else painter.dabBrush
+    strokeFilter = StrokeFilter(**settings["strokeFilter"]) if settings.get("strokeFilter") is not None \
+        else painter.strokeFilter
+
+    painter.brushColor, painter.brushWidth, painter.brushStyle = color, width, style
+    painter.brushCap, painter.brushJoin = cap, join
+    painter.tool, painter.fillTolerance = tool, fillTolerance
+    painter.dabBrush, painter.strokeFilter = dabBrush, strokeFilter
+
+
+class ProjectFile:
+    def __init__(self, path):
+        """Maps a project file and reads its index, the tiles are read later"""
+        self.path = path
+        self.file = open(path, "rb")
+        try:
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)  # documentation: https://docs.python.org/3/library/mmap.html
+            magic, version, indexOffset, indexLength = struct.unpack_from(HEADER_FORMAT, self.map)
+            if magic != MAGIC:
+                raise ProjectError("{} is not a project file".format(path))
+            if version > VERSION:
+                raise ProjectError("{} was saved by a newer version".format(path))
+            self.index = json.loads(zlib.decompress(self.map[indexOffset:indexOffset + indexLength]))
+        except (ValueError, struct.error, zlib.error) as error:  # json and mmap errors are ValueErrors
+            self.close()
+            raise ProjectError("{} is damaged: {}".format(path, error))
+        except ProjectError:
+            self.close()
+            raise
+        self.size = len(self.map)
+        self.stateRefs = weakref.WeakKeyDictionary()  # history TileState -> its entry in this file
+
+    def close(self):
+        if getattr(self, "map", None) is not None:
+            self.map.close()
+            self.map = None
+        self.file.close()
+
+    def blob(self, ref):
+        offset, length = ref
+        return self.map[offset:offset + length]
+
+    def readTile(self, ref, layout):
+        """Decompresses a tile blob, None stands for a blank tile"""
+        if ref is None:
+            return None
+        width, height, bytesPerLine, imageFormat, colorTable = layout
+        # documentation: https://doc.qt.io/qt-5/qimage.html#QImage-5, copy() detaches the image from the bytes
+        tile = QImage(zlib.decompress(self.blob(ref)), width, height, bytesPerLine, QImage.Format(imageFormat)).copy()
+        if colorTable:
+            tile.setColorTable(colorTable)
+        return tile
+
+    def canvas(self, entry):
+        """Returns a canvas whose tiles are read from this file when they are needed"""
+        index = self.index
+        canvas = TiledCanvas(index["width"], index["height"], QImage.Format(entry["format"]),
+                             QColor.fromRgba(entry["background"]), index["tileSize"], entry["colorTable"])
+        blobs = {(column, row): [offset, length] for column, row, offset, length in entry["tiles"]}
+        self.attach(canvas, LazyTiles(self, tileLayout(canvas), blobs, blobs))
+        return canvas
+
+    @staticmethod
+    def attach(canvas, tiles):
+        canvas.tiles = tiles
+        canvas.changeListeners.append(tiles.changed)
+
+    def layerStack(self, writeListener=None):
+        """Returns the layers of the project, the composite is read from the file instead of being blended"""
+        entries = self.index["layers"]
+        stack = LayerStack(self.canvas(entries[0]["canvas"]), writeListener)
+        for entry in entries[1:]:
+            stack.insertLayer(len(stack.layers), Layer(entry["name"], self.canvas(entry["canvas"])))
+        for layer, entry in zip(stack.layers, entries):
+            layer.name, layer.opacity = entry["name"], entry["opacity"]
+            layer.visible, layer.blendMode = entry["visible"], entry["blendMode"]
+        stack.activeIndex = min(self.index["activeIndex"], len(stack.layers) - 1)
+
+        composite = self.index["composite"]
+        if composite["format"] == int(stack.composite.format):
+            blobs = {(column, row): [offset, length] for column, row, offset, length in composite["tiles"]}
+            self.attach(stack.composite, LazyTiles(self, tileLayout(stack.composite), blobs, blobs))
+            stack.dirty = {}  # the composite was saved blended
+        return stack
+
+    def restoreMipmaps(self, mipmaps):
+        """Reads the mipmap levels of the composite lazily too, unless the composite has to be blended again"""
+        if not isinstance(mipmaps.canvas.tiles, LazyTiles):
+            return
+        blobs = {(level, column, row): [offset, length] if offset is not None else None
+                 for level, column, row, offset, length in self.index["mipmaps"]}
+        mipmaps.levels = LazyTiles(self, tileLayout(mipmaps.canvas), blobs, blobs)
+
+    def state(self, entry):
+        """Returns a history TileState, the compressed bytes are copied out of the file"""
+        if entry is None:
+            return TileState(None, True)
+        offset, length, width, height, bytesPerLine, imageFormat, colorTable = entry
+        state = TileState.fromData(self.map[offset:offset + length], width, height, bytesPerLine,
+                                   QImage.Format(imageFormat), colorTable)
+        self.stateRefs[state] = entry
+        return state
+
+    def restoreHistory(self, history, layers):
+        """Puts the saved undo and redo steps of the layers into a History"""
+        canvases = [layer.canvas for layer in layers.layers]
+        history.clear()
+        for name, stack in (("undo", history.undoStack), ("redo", history.redoStack)):
+            for changes in self.index["history"][name]:
+                step = HistoryStep()
+                for layer, column, row, before, after in changes:
+                    step.before[(canvases[layer], (column, row))] = self.state(before)
+                    step.after[(canvases[layer], (column, row))] = self.state(after)
+                stack.append(step)
+        history.memoryUsed = sum(step.size() for step in history.undoStack + history.redoStack)
+
+    def brushSettings(self):
+        return self.index.get("brush", {})
+
+
+def savedSteps(history, canvases):
+    """Returns the undo and redo steps which only changed the given canvases, as (name, [(step, [changes])])
+    A step changing a removed layer cannot be restored, it is left out together with the steps beyond it"""
+    layerIndex = {id(canvas): index for index, canvas in enumerate(canvases)}
+
+    def changes(step):
+        if any(id(canvas) not in layerIndex for canvas, _ in step.before):
+            return None
+        return [(layerIndex[id(canvas)], key, step.before[(canvas, key)], step.after.get((canvas, key)))
+                for canvas, key in step.before]
+
+    undo = []
+    for step in reversed(history.undoStack):  # newest first, older steps can only be undone after it
+        stepChanges = changes(step)
+        if stepChanges is None:
+            break
+        undo.insert(0, stepChanges)
+    redo = []
+    for step in reversed(history.redoStack):  # the next step to redo is the last one
+        stepChanges = changes(step)
+        if stepChanges is None:
+            break
+        redo.insert(0, stepChanges)
+    return {"undo": undo, "redo": redo}
+
+
+def saveProject(painter, path, project=None):
+    """Saves the painting of a Painter as a project and returns the ProjectFile backing it from now on.
+    project is the ProjectFile the painting was opened from or last saved to, its unchanged blobs are reused"""
+    painter.endStroke()
+    layers = painter.layers
+    for layer in layers.layers:
+        layer.canvas.pack()
+    layers.flatten()
+    painter.mipmaps.build()  # a zoomed out view of the reopened project needs no full resolution tile
+
+    # the tile dictionaries to save with their layout, and how to swap in the LazyTiles replacing a plain dict
+    canvases = [layer.canvas for layer in layers.layers] + [layers.composite]
+    dictionaries = [(canvas.tiles, tileLayout(canvas), lambda tiles, canvas=canvas: ProjectFile.attach(canvas, tiles))
+                    for canvas in canvases]
+    dictionaries.append((painter.mipmaps.levels, tileLayout(layers.composite),
+                         lambda tiles: setattr(painter.mipmaps, "levels", tiles)))
+
+    # blobs which can be reused as they are, and the tiles which have to be compressed
+    reused = {}  # (dictionary index, key) -> blob in project
+    changed = []  # (dictionary index, key, tile)
+    for number, (tiles, _, _) in enumerate(dictionaries):
+        reusable = tiles.saved if isinstance(tiles, LazyTiles) and tiles.project is project else {}
+        for key in tiles.keys():
+            if key in reusable:
+                reused[(number, key)] = reusable[key]
+            else:
+                changed.append((number, key, tiles.get(key)))
+    steps = savedSteps(painter.history, canvases[:-1])
+    states = [state for changes in steps["undo"] + steps["redo"] for change in changes for state in change[2:]
+              if state is not None and (state.data is not None or state.tile is not None)]
+    reusedStates = {state: project.stateRefs[state] for state in states
+                    if project is not None and state in project.stateRefs}
+
+    # append to the same file unless too much of it would become garbage
+    append = project is not None and os.path.abspath(path) == os.path.abspath(project.path)
+    if append:
+        kept = sum(ref[1] for ref in reused.values() if ref is not None)
+        kept += sum(entry[1] for entry in reusedStates.values())
+        append = project.size - kept <= GARBAGE_LIMIT * project.size
+
+    target = path if append else path + ".tmp"
+    with open(target, "r+b" if append else "wb") as f:
+        if append:
+            f.seek(0, os.SEEK_END)
+        else:
+            f.write(bytes(HEADER_SIZE))
+
+        def write(data):
+            offset = f.tell()
+            f.write(data)
+            return [offset, len(data)]
+
+        refs = {}  # (dictionary index, key) -> blob in the new file
+        for item, ref in reused.items():
+            refs[item] = ref if append or ref is None else write(project.blob(ref))
+
+        # documentation: https://docs.python.org/3/library/concurrent.futures.html, zlib releases the GIL
+        with ThreadPoolExecutor(max_workers=os.cpu_count() or 1) as pool:
+            blobs = pool.map(lambda item: None if item[2] is None else zlib.compress(tilePixels(item[2]), COMPRESSION),
+                             changed)
+            for (number, key, _), blob in zip(changed, blobs):
+                refs[(number, key)] = write(blob) if blob is not None else None
+
+        stateEntries = {}
+        for state in states:
+            if state in stateEntries:
+                continue
+            entry = reusedStates.get(state)
+            if entry is not None:
+                stateEntries[state] = entry if append else write(project.blob(entry[:2])) + list(entry[2:])
+            else:
+                data, width, height, bytesPerLine, imageFormat, colorTable = state.compressed(COMPRESSION)
+                stateEntries[state] = write(data) + [width, height, bytesPerLine, int(imageFormat), colorTable or None]
+
+        def canvasEntry(number, canvas):
+            return {"format": int(canvas.format), "background": canvas.background.rgba(), "colorTable": canvas.colorTable,
+                    "tiles": [[column, row] + refs[(number, (column, row))] for column, row in canvas.tiles.keys()]}
+
+        def stateEntry(state):
+            return stateEntries.get(state) if state is not None and state in stateEntries else None
+
+        index = {
+            "width": layers.width, "height": layers.height, "tileSize": layers.composite.tileSize,
+            "activeIndex": layers.activeIndex,
+            "layers": [{"name": layer.name, "opacity": layer.opacity, "visible": layer.visible,
+                        "blendMode": layer.blendMode, "canvas": canvasEntry(number, layer.canvas)}
+                       for number, layer in enumerate(layers.layers)],
+            "composite": canvasEntry(len(canvases) - 1, layers.composite),
+            "mipmaps": [list(key) + (refs[(len(canvases), key)] or [None, 0]) for key in painter.mipmaps.levels.keys()],
+            "brush": brushSettings(painter),
+            "history": {name: [[[layer, key[0], key[1], stateEntry(before), stateEntry(after)]
+                                for layer, key, before, after in changes] for changes in stepList]
+                        for name, stepList in steps.items()},
+        }
+        indexRef = write(zlib.compress(json.dumps(index).encode(), COMPRESSION))
+
+        # the header is written last, a save interrupted before it leaves the previous index in place
+        f.flush()
+        os.fsync(f.fileno())
+        f.seek(0)
+        f.write(struct.pack(HEADER_FORMAT, MAGIC, VERSION, *indexRef))
+        f.flush()
+        os.fsync(f.fileno())
+
+    if project is not None:
+        project.close()
+    if not append:
+        os.replace(target, path)
+    saved = ProjectFile(path)
+
+    # the painting is backed by the new file from now on, every tile in it equals its blob
+    for number, (tiles, layout, swap) in enumerate(dictionaries):
+        blobs = {key: refs[(number, key)] for key in tiles.keys()}
+        if isinstance(tiles, LazyTiles):
+            tiles.project = saved
+            tiles.pending = {key: blobs[key] for key in tiles.pending}
+            tiles.saved = blobs
+        else:
+            swap(LazyTiles(saved, layout, {}, blobs, tiles))
+    for state, entry in stateEntries.items():
+        saved.stateRefs[state] = entry
+    return saved
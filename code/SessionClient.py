@@ -0,0 +1,340 @@
+"""
+SessionClient connects a Painter to a SessionServer over a QTcpSocket served by the Qt event loop.
+The background layer of the painting is the shared canvas: the points and dabs drawn on it by local strokes are sent
+as they are drawn, other changes of its tiles (fills, filters, undo) are sent as whole tiles, and the batches of the
+other clients are drawn onto it as they arrive. The ops drawn during a frame are sent together once per frame.
+
+Local strokes are drawn at once, before the server has ordered them among the ops of the others. To end up with
+exactly the canvas of the server, the client keeps a confirmed copy of every tile its unacknowledged ops drew on:
+an op of another client landing on such a tile is drawn onto the confirmed copy, and the tile is rebuilt from the copy
+with the own unacknowledged ops drawn over it again. Undo restores whole tiles, so it also takes back what the others
+painted on those tiles during the undone step.
+"""
+from PyQt5.QtNetwork import QAbstractSocket, QTcpSocket
+from PyQt5.QtGui import QColor, QImage, QPainter, QPen
+from PyQt5.QtCore import QObject, QTimer, pyqtSignal
+
+from collections import deque
+import json
+
+from TiledCanvas import TiledCanvas
+from SessionProtocol import VERSION, FRAME_RATE, HELLO, WELCOME, SNAPSHOT, OPS, BATCH, OP_POLYLINE, OP_DAB, OP_TILE, \
+    SESSION_FORMATS, ProtocolError, frame, jsonFrame, splitFrames, encodePolyline, encodeDab, encodeTile, \
+    compressTile, splitSnapshot, decodeOps, decodeTile, opKeys, drawOp, drawOnTile, applyOp
+
+
+class SessionClient(QObject):
+    joined = pyqtSignal()  # the painter shows the shared canvas
+    left = pyqtSignal(str)  # the session ended, with the reason
+
+    def __init__(self, painter, name="", parent=None):
+        super().__init__(parent)
+        self.painter = painter
+        self.name = name  # shown by the server when the client joins and leaves
+        self.active = False  # between join and leave
+        self.share = False  # the session takes the background layer of the painting instead of replacing it
+
+        self.socket = QTcpSocket(self)  # documentation: https://doc.qt.io/qt-5/qtcpsocket.html
+        self.socket.connected.connect(self.connected)
+        self.socket.readyRead.connect(self.readyRead)
+        self.socket.disconnected.connect(self.disconnected)
+        self.socket.errorOccurred.connect(self.socketError)
+        self.buffer = bytearray()  # received bytes which do not make a complete frame yet
+
+        self.number = None  # number of this client in the session, its own ops come back with it
+        self.info = None  # the WELCOME values of the server
+        self.canvas = None  # the shared canvas, known once the snapshot arrived
+        self.outgoing = []  # op records drawn since the last frame
+        self.dirtyTiles = set()  # keys of tiles changed by anything but strokes, sent as whole tiles
+        self.applying = False  # drawing the ops of other clients, their changes are not sent back
+
+        self.unacknowledged = deque()  # (kind, payload, keys) of the own ops the server has not sent back yet
+        self.acknowledged = 0  # own ops the server sent back or included in a snapshot
+        self.pendingOps = {}  # tile key -> number of unacknowledged ops drawing on the tile
+        self.confirmed = {}  # tile key -> the tile as the server has it, None if blank
+
+        # traffic of the session, e.g. for a benchmark
+        self.bytesSent = 0
+        self.bytesReceived = 0
+        self.opsReceived = 0
+
+        self.frameTimer = QTimer(self)
+        self.frameTimer.setInterval(round(1000 / FRAME_RATE))
+        self.frameTimer.timeout.connect(self.sendFrame)
+
+    def join(self, host, port, share=False):
+        """Connects to a session server, share=True sends the background layer of the painting to the session
+        instead of replacing the painting with the session canvas"""
+        self.leave()
+        self.active = True
+        self.share = share
+        self.socket.connectToHost(host, port)  # documentation: https://doc.qt.io/qt-5/qabstractsocket.html#connectToHost
+
+    def leave(self, reason="You left the session"):
+        """Disconnects from the server, the shared canvas stays in the painter as an ordinary painting"""
+        if not self.active:
+            return
+        self.active = False
+        self.frameTimer.stop()
+        self.detach()
+        self.socket.abort()
+        self.buffer = bytearray()
+        self.number = self.info = None
+        self.outgoing = []
+        self.dirtyTiles = set()
+        self.forgetUnacknowledged()
+        self.left.emit(reason)
+
+    def isJoined(self):
+        return self.active and self.canvas is not None
+
+    def connected(self):
+        self.socket.setSocketOption(QAbstractSocket.LowDelayOption, 1)  # strokes are small, do not wait to fill packets
+        self.write(jsonFrame(HELLO, {"version": VERSION, "name": self.name}))
+
+    def disconnected(self):
+        self.leave("The server closed the session")
+
+    def socketError(self, error):
+        self.leave(self.socket.errorString())
+
+    def write(self, data):
+        self.socket.write(data)
+        self.bytesSent += len(data)
+
+    def readyRead(self):
+        data = self.socket.readAll().data()
+        self.bytesReceived += len(data)
+        self.buffer += data
+        try:
+            for kind, body in splitFrames(self.buffer):
+                if not self.active:
+                    return
+                self.handleFrame(kind, body)
+        except (ProtocolError, ValueError) as error:
+            self.leave("The server sent a broken message: {}".format(error))
+
+    def handleFrame(self, kind, body):
+        if kind == WELCOME:
+            info = json.loads(body)
+            if info.get("version") != VERSION or info.get("format") not in [int(f) for f in SESSION_FORMATS.values()]:
+                raise ProtocolError("unsupported session")
+            self.info = info
+            self.number = info["client"]
+        elif kind == SNAPSHOT and self.info is not None:
+            self.applySnapshot(body)
+        elif kind == BATCH and self.canvas is not None:
+            self.queueTiles()  # a fill waiting for the next frame has to be reconciled like any own op
+            for opKind, client, payload, _ in decodeOps(body):
+                if client == self.number:
+                    self.acknowledge(opKind, payload)
+                else:
+                    self.applyRemote(opKind, payload)
+                    self.opsReceived += 1
+        else:
+            raise ProtocolError("unexpected message {}".format(kind))
+
+    def applySnapshot(self, body):
+        """Takes the tiles of the server when joining, or after the client fell too far behind"""
+        sequenced, records = splitSnapshot(body)
+        tiles = {payload[0]: payload[1] for kind, _, payload, _ in decodeOps(records) if kind == OP_TILE}
+        if self.canvas is not None:
+            self.resync(sequenced, tiles)
+            return
+
+        info = self.info
+        if self.share:
+            canvas = self.painter.layers.background().canvas
+            if (canvas.width, canvas.height, int(canvas.format), canvas.background.rgba(), canvas.tileSize) != \
+                    (info["width"], info["height"], info["format"], info["background"], info["tileSize"]):
+                self.leave("The painting does not match the canvas of the session")
+                return
+            # every tile of the session takes the tile of the painting
+            for key in set(canvas.tiles) | set(tiles):
+                self.confirmed[key] = decodeTile(canvas, tiles.get(key, b""))
+                self.dirtyTiles.add(key)
+        else:
+            canvas = TiledCanvas(info["width"], info["height"], QImage.Format(info["format"]),
+                                 QColor.fromRgba(info["background"]), info["tileSize"])
+            for key, data in tiles.items():
+                tile = decodeTile(canvas, data)
+                if tile is not None:
+                    canvas.tiles[key] = tile
+            self.painter.openCanvas(canvas)
+        self.attach(canvas)
+        self.frameTimer.start()
+        self.joined.emit()
+
+    def resync(self, sequenced, tiles):
+        """Replaces the shared canvas with the tiles of a snapshot sent after skipped batches. The snapshot includes
+        the first sequenced own ops, the ones sent after them are drawn over its tiles again and still come back"""
+        self.queueTiles()  # a fill waiting for the next frame is sent after the snapshot
+        while self.acknowledged < sequenced and self.unacknowledged:
+            _, _, keys = self.unacknowledged.popleft()  # acknowledged by the skipped batches
+            self.acknowledged += 1
+            for key in keys:
+                self.pendingOps[key] -= 1
+                if not self.pendingOps[key]:
+                    del self.pendingOps[key]
+
+        openPainters = self.openPainters()
+        keys = set(self.canvas.tiles) | set(tiles) | set(self.confirmed)
+        self.applying = True
+        try:
+            for key in keys:
+                tile = decodeTile(self.canvas, tiles.get(key, b""))
+                if key in self.pendingOps or key in openPainters:
+                    self.confirmed[key] = tile
+                    self.rebuild(key, openPainters)
+                else:
+                    self.confirmed.pop(key, None)
+                    self.canvas.setTile(key, tile)
+        finally:
+            self.applying = False
+        for key in keys:
+            self.painter.updateCanvasRect(self.canvas.tileRect(key).intersected(self.canvas.rect()))
+
+    def attach(self, canvas):
+        self.canvas = canvas
+        canvas.writeListeners.append(self.tileWillChange)
+        canvas.changeListeners.append(self.canvasChanged)
+        self.painter.strokeListeners.append(self.strokeDrawn)
+        self.painter.dabListeners.append(self.dabStamped)
+
+    def detach(self):
+        if self.canvas is None:
+            return
+        self.canvas.writeListeners.remove(self.tileWillChange)
+        self.canvas.changeListeners.remove(self.canvasChanged)
+        self.painter.strokeListeners.remove(self.strokeDrawn)
+        self.painter.dabListeners.remove(self.dabStamped)
+        self.canvas = None
+
+    def openPainters(self):
+        """Returns the tile painters of the local stroke if it draws on the shared canvas"""
+        stroke = self.painter.stroke
+        return stroke.tilePainters if stroke is not None and stroke.canvas is self.canvas else {}
+
+    def applyRemote(self, kind, payload):
+        """Draws an op of another client onto the shared canvas and repaints its area"""
+        keys = opKeys(self.canvas, kind, payload)
+        openPainters = self.openPainters()
+        self.applying = True
+        try:
+            applyOp(self.canvas, kind, payload, openPainters, [key for key in keys if key not in self.confirmed])
+            for key in keys:
+                if key in self.confirmed:
+                    # the server drew the op before the own unacknowledged ops, so they are drawn over it again
+                    self.confirmed[key] = drawOnTile(self.canvas, key, self.confirmed[key], kind, payload)
+                    self.rebuild(key, openPainters)
+        finally:
+            self.applying = False
+        for key in keys:
+            self.painter.updateCanvasRect(self.canvas.tileRect(key).intersected(self.canvas.rect()))
+
+    def rebuild(self, key, openPainters):
+        """Makes a tile its confirmed copy with the unacknowledged own ops drawn over it"""
+        ops = [(kind, payload) for kind, payload, keys in self.unacknowledged if key in keys]
+        confirmed = self.confirmed[key]
+        tilePainter = openPainters.get(key)
+        if tilePainter is None and not ops:
+            self.canvas.setTile(key, QImage(confirmed) if confirmed is not None else None)
+            return
+
+        opened = tilePainter is None
+        if opened:
+            tilePainter = QPainter(self.canvas.tileForWrite(key))
+            tilePainter.translate(-self.canvas.tileRect(key).topLeft())
+        tileRect = self.canvas.tileRect(key)
+        tilePainter.save()
+        tilePainter.setCompositionMode(QPainter.CompositionMode_Source)
+        if confirmed is None:
+            tilePainter.fillRect(tileRect, self.canvas.background)
+        else:
+            tilePainter.drawImage(tileRect.topLeft(), confirmed)
+        tilePainter.restore()
+        for kind, payload in ops:
+            drawOp(tilePainter, self.canvas, kind, payload)
+        if opened:
+            tilePainter.end()
+        self.canvas.touch([key])
+
+    def acknowledge(self, kind, payload):
+        """The server sent back an own op, it is now drawn onto the confirmed copies of its tiles"""
+        if not self.unacknowledged:
+            raise ProtocolError("the server sent back an op which was not sent")
+        _, _, keys = self.unacknowledged.popleft()
+        self.acknowledged += 1
+        openPainters = self.openPainters()
+        for key in keys:
+            if key in self.confirmed:
+                self.confirmed[key] = drawOnTile(self.canvas, key, self.confirmed[key], kind, payload)
+            self.pendingOps[key] -= 1
+            if not self.pendingOps[key]:
+                del self.pendingOps[key]
+                if key not in openPainters:
+                    self.confirmed.pop(key, None)  # the tile is the tile of the server again
+
+    def addUnacknowledged(self, kind, payload):
+        keys = opKeys(self.canvas, kind, payload)
+        for key in keys:
+            if key not in self.confirmed:
+                tile = self.canvas.tiles.get(key)  # a tile the op did not change, e.g. one only reached by the padding
+                self.confirmed[key] = QImage(tile) if tile is not None else None
+            self.pendingOps[key] = self.pendingOps.get(key, 0) + 1
+        self.unacknowledged.append((kind, payload, keys))
+
+    def forgetUnacknowledged(self):
+        self.unacknowledged.clear()
+        self.acknowledged = 0
+        self.pendingOps = {}
+        self.confirmed = {}
+
+    def tileWillChange(self, canvas, key):
+        """Write listener of the shared canvas, keeps the tile as the server has it before an own op changes it"""
+        if not self.applying and key not in self.confirmed:
+            tile = canvas.tiles.get(key)
+            self.confirmed[key] = QImage(tile) if tile is not None else None  # shares the pixels until either changes
+
+    def canvasChanged(self, canvas, keys, rect=None):
+        """Change listener of the shared canvas, remembers the tiles changed by anything but strokes"""
+        if self.applying:
+            return
+        stroke = self.painter.stroke
+        if stroke is not None and stroke.canvas is canvas:
+            return  # strokes are sent as the primitives they draw
+        self.dirtyTiles.update(keys)
+
+    def strokeDrawn(self, canvas, pen, points):
+        if canvas is self.canvas:
+            self.queueTiles()  # tiles changed before the stroke have to arrive before it
+            payload = QPen(pen), list(points)
+            self.outgoing.append(encodePolyline(0, *payload))
+            self.addUnacknowledged(OP_POLYLINE, payload)
+
+    def dabStamped(self, canvas, key, topLeft):
+        if canvas is self.canvas:
+            self.queueTiles()
+            self.outgoing.append(encodeDab(0, key, topLeft))
+            self.addUnacknowledged(OP_DAB, (key, topLeft))
+
+    def queueTiles(self):
+        for key in self.dirtyTiles:
+            data = compressTile(self.canvas.tiles.get(key))
+            self.outgoing.append(encodeTile(0, key, data))
+            self.addUnacknowledged(OP_TILE, (key, data))
+        self.dirtyTiles = set()
+
+    def sendFrame(self):
+        """Sends the ops drawn since the last frame as one compressed message"""
+        if self.painter.layers.background().canvas is not self.canvas:
+            self.leave("The painting was replaced, you left the session")
+            return
+        self.queueTiles()
+        if self.outgoing:
+            self.write(frame(OPS, b"".join(self.outgoing)))
+            self.outgoing = []
+        # tiles kept while the local stroke held them, all their own ops were acknowledged meanwhile
+        openPainters = self.openPainters()
+        for key in [key for key in self.confirmed if key not in self.pendingOps and key not in openPainters]:
+            del self.confirmed[key]
@@ -0,0 +1,323 @@
+"""
+Wire protocol of shared painting sessions, see SessionServer and SessionClient. Every message is a frame: a little
+endian header holding the length of the body and the kind of the message, followed by the body.
+
+    HELLO     client -> server  JSON {"version", "name"}
+    WELCOME   server -> client  JSON {"version", "client", "width", "height", "format", "background", "tileSize"}
+    SNAPSHOT  server -> client  the number of own ops of the client the snapshot includes, then TILE records of every
+                                painted tile of the session canvas, sent after WELCOME and again when a client fell
+                                too far behind
+    OPS       client -> server  zlib compressed op records drawn by the client since its last frame
+    BATCH     server -> client  zlib compressed op records of all clients received during one server frame, the same
+                                bytes go to every client and acknowledge the own ops of each client
+
+Op records replay exactly the primitives drawn onto the canvas of the client which sent them:
+
+    POLYLINE  the pen and the points of one StrokeSession flush, a single point is drawn with drawPoint
+    DAB       the dab cache key and the position of one soft brush dab, the dab image is rasterized from the key
+    TILE      the zlib compressed pixels of a tile changed by anything else (fills, filters, undo), empty means blank
+
+Every record carries the number of the client which drew it, the server stamps it into the records it receives.
+"""
+from PyQt5.QtGui import QColor, QImage, QPainter, QPen, QPolygon
+from PyQt5.QtCore import QPoint, QPointF, QRect, QRectF, QSizeF, Qt
+
+import json
+import math
+import struct
+import zlib
+
+from BrushEngine import DabCache, MAX_BRUSH_WIDTH, dabCache
+from ProjectFile import tilePixels
+from StrokeSession import strokePadding
+
+VERSION = 2
+DEFAULT_PORT = 47210
+FRAME_RATE = 60  # frames per second of the server batches and of the client sends
+MAX_FRAME = 256 * 1024 * 1024  # bytes of the largest frame body accepted
+COMPRESSION = 1  # zlib level of the frames and the tiles, the fastest level already shrinks strokes a lot
+
+HEADER_FORMAT = "<IB"  # body length, message kind
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+SNAPSHOT_FORMAT = "<Q"  # own ops of the client the snapshot includes, followed by the TILE records
+
+# message kinds
+HELLO = 1
+WELCOME = 2
+SNAPSHOT = 3
+OPS = 4
+BATCH = 5
+COMPRESSED = {OPS, BATCH}  # the body of a SNAPSHOT is not compressed again, its tiles already are
+
+# op records
+OP_POLYLINE = 1
+OP_DAB = 2
+OP_TILE = 3
+OP_FORMAT = "<BH"  # kind, client number
+POLYLINE_FORMAT = "<BHIfBBBI"  # kind, client, color rgba, width, style, cap, join, number of points
+DAB_FORMAT = "<BHIIIIIIdd"  # kind, client, dab cache key (rgba, size, hardness, opacity, rotation, roundness), x, y
+TILE_FORMAT = "<BHiiI"  # kind, client, column, row, bytes of compressed pixels
+
+# pen settings a polyline record can carry, Qt accepts any number as a pen style and paints it somehow
+PEN_STYLES = {int(style) for style in (Qt.SolidLine, Qt.DashLine, Qt.DotLine, Qt.DashDotLine, Qt.DashDotDotLine)}
+PEN_CAPS = {int(cap) for cap in (Qt.FlatCap, Qt.SquareCap, Qt.RoundCap)}
+PEN_JOINS = {int(join) for join in (Qt.MiterJoin, Qt.BevelJoin, Qt.RoundJoin, Qt.SvgMiterJoin)}
+MAX_COORDINATE = 2 ** 31 - 1  # dab positions stay in the int32 range of the polyline points
+
+# working pixel formats a session canvas can use, QPainter cannot paint on Indexed8 tiles directly
+SESSION_FORMATS = {
+    "rgb": QImage.Format_RGB32,
+    "argb": QImage.Format_ARGB32_Premultiplied,
+    "gray": QImage.Format_Grayscale8,
+}
+
+
+class ProtocolError(Exception):
+    pass
+
+
+def frame(kind, body):
+    """Returns a message as the bytes sent over the socket"""
+    if kind in COMPRESSED:
+        body = zlib.compress(body, COMPRESSION)
+    return struct.pack(HEADER_FORMAT, len(body), kind) + body
+
+
+def jsonFrame(kind, values):
+    return frame(kind, json.dumps(values).encode("utf-8"))
+
+
+def frameHeader(data, offset=0):
+    """Returns (body length, kind) of the frame header at the offset"""
+    length, kind = struct.unpack_from(HEADER_FORMAT, data, offset)
+    if length > MAX_FRAME:
+        raise ProtocolError("frame of {} bytes is too large".format(length))
+    return length, kind
+
+
+def frameBody(kind, body):
+    """Returns the body of a received frame, decompressed if its kind is compressed"""
+    if kind in COMPRESSED:
+        return inflate(body, MAX_FRAME, "frame")  # bounded like the compressed body
+    return bytes(body)
+
+
+def inflate(data, limit, name):
+    """Decompresses zlib data which must hold one complete stream of at most limit bytes, so a small frame cannot
+    inflate into gigabytes"""
+    decompressor = zlib.decompressobj()  # documentation: https://docs.python.org/3/library/zlib.html#zlib.decompressobj
+    try:
+        result = decompressor.decompress(data, limit)
+    except zlib.error as error:
+        raise ProtocolError("broken {}: {}".format(name, error))
+    if decompressor.unconsumed_tail:
+        raise ProtocolError("broken {}: more than {} bytes".format(name, limit))
+    if decompressor.unused_data or not decompressor.eof:
+        raise ProtocolError("broken {}: truncated or followed by other bytes".format(name))
+    return result
+
+
+def snapshotBody(sequenced, records):
+    """Returns the body of a SNAPSHOT including the first sequenced ops of the client it is sent to"""
+    return struct.pack(SNAPSHOT_FORMAT, sequenced) + records
+
+
+def splitSnapshot(body):
+    """Returns (own ops included, TILE records) of a SNAPSHOT body"""
+    try:
+        sequenced, = struct.unpack_from(SNAPSHOT_FORMAT, body)
+    except struct.error as error:
+        raise ProtocolError("truncated snapshot: {}".format(error))
+    return sequenced, body[struct.calcsize(SNAPSHOT_FORMAT):]
+
+
+def splitFrames(buffer):
+    """Removes the complete frames from the start of a bytearray and returns them as (kind, body) pairs"""
+    frames = []
+    offset = 0
+    while len(buffer) - offset >= HEADER_SIZE:
+        length, kind = frameHeader(buffer, offset)
+        if len(buffer) - offset - HEADER_SIZE < length:
+            break  # the rest of the frame has not arrived yet
+        start = offset + HEADER_SIZE
+        frames.append((kind, frameBody(kind, buffer[start:start + length])))
+        offset = start + length
+    del buffer[:offset]
+    return frames
+
+
+def encodePolyline(client, pen, points):
+    """Returns the op record of a point or polyline drawn with a pen"""
+    coordinates = [value for point in points for value in (point.x(), point.y())]
+    return struct.pack(POLYLINE_FORMAT, OP_POLYLINE, client, pen.color().rgba(), pen.widthF(), int(pen.style()),
+                       int(pen.capStyle()), int(pen.joinStyle()), len(points)) + \
+        struct.pack("<{}i".format(len(coordinates)), *coordinates)
+
+
+def encodeDab(client, key, topLeft):
+    """Returns the op record of a dab stamped at a canvas position"""
+    return struct.pack(DAB_FORMAT, OP_DAB, client, *key, topLeft.x(), topLeft.y())
+
+
+def compressTile(tile):
+    """Returns the zlib compressed pixels of a tile, None (a blank tile) gives no bytes"""
+    return zlib.compress(tilePixels(tile), COMPRESSION) if tile is not None else b""
+
+
+def encodeTile(client, key, data):
+    """Returns the op record of a tile whose pixels were compressed by compressTile"""
+    return struct.pack(TILE_FORMAT, OP_TILE, client, key[0], key[1], len(data)) + data
+
+
+def stampClient(record, client):
+    """Returns an op record with the number of the client which drew it"""
+    return record[:1] + struct.pack("<H", client) + record[3:]
+
+
+def decodeOps(data):
+    """Yields (kind, client, payload, record) for the op records of a body, the payload of
+    POLYLINE is (QPen, points), of DAB (dab cache key, top left QPointF) and of TILE (key, compressed pixels).
+    Records which the painting application cannot have drawn raise ProtocolError: the ops come from the network and
+    a huge dab or pen would make the receiver allocate or paint without limit. Pen widths are clamped to the widest
+    brush instead"""
+    offset = 0
+    try:
+        while offset < len(data):
+            start = offset
+            kind, client = struct.unpack_from(OP_FORMAT, data, offset)
+            if kind == OP_POLYLINE:
+                _, _, color, width, style, cap, join, count = struct.unpack_from(POLYLINE_FORMAT, data, offset)
+                offset += struct.calcsize(POLYLINE_FORMAT)
+                if count == 0:
+                    raise ProtocolError("polyline without points")
+                if style not in PEN_STYLES or cap not in PEN_CAPS or join not in PEN_JOINS:
+                    raise ProtocolError("unknown pen style {}, cap {} or join {}".format(style, cap, join))
+                if not math.isfinite(width):
+                    raise ProtocolError("pen width {}".format(width))
+                width = min(max(width, 0.0), MAX_BRUSH_WIDTH)
+                if count * 8 > len(data) - offset:
+                    raise ProtocolError("truncated polyline")
+                coordinates = struct.unpack_from("<{}i".format(count * 2), data, offset)
+                offset += count * 8
+                pen = QPen(QColor.fromRgba(color), width, Qt.PenStyle(style), Qt.PenCapStyle(cap), Qt.PenJoinStyle(join))
+                payload = pen, [QPoint(x, y) for x, y in zip(coordinates[::2], coordinates[1::2])]
+            elif kind == OP_DAB:
+                values = struct.unpack_from(DAB_FORMAT, data, offset)
+                offset += struct.calcsize(DAB_FORMAT)
+                key, x, y = tuple(values[2:8]), values[8], values[9]
+                if not DabCache.validKey(key):
+                    raise ProtocolError("dab {} is out of the brush range".format(key))
+                if not (abs(x) <= MAX_COORDINATE and abs(y) <= MAX_COORDINATE):  # also false for NaN
+                    raise ProtocolError("dab position {}, {}".format(x, y))
+                payload = key, QPointF(x, y)
+            elif kind == OP_TILE:
+                _, _, column, row, length = struct.unpack_from(TILE_FORMAT, data, offset)
+                offset += struct.calcsize(TILE_FORMAT)
+                if offset + length > len(data):
+                    raise ProtocolError("truncated tile")
+                payload = (column, row), bytes(data[offset:offset + length])
+                offset += length
+            else:
+                raise ProtocolError("unknown op {}".format(kind))
+            yield kind, client, payload, bytes(data[start:offset])
+    except struct.error as error:
+        raise ProtocolError("truncated op: {}".format(error))
+    except (ValueError, TypeError, OverflowError) as error:
+        raise ProtocolError("invalid op: {}".format(error))
+
+
+def decodeTile(canvas, data):
+    """Returns the tile of compressed pixels in the format of a canvas, no bytes give None (a blank tile)"""
+    if not data:
+        return None
+    bytesPerLine = canvas.blankTile.bytesPerLine()
+    pixels = inflate(data, bytesPerLine * canvas.tileSize, "tile")
+    if len(pixels) != bytesPerLine * canvas.tileSize:
+        raise ProtocolError("tile of {} bytes does not match the canvas".format(len(pixels)))
+    # documentation: https://doc.qt.io/qt-5/qimage.html#QImage-5
+    return QImage(pixels, canvas.tileSize, canvas.tileSize, bytesPerLine, canvas.format).copy()
+
+
+def opRect(canvas, kind, payload):
+    """Returns the canvas area an op can draw on"""
+    if kind == OP_TILE:
+        key, _ = payload
+        column, row = key
+        if not (0 <= column * canvas.tileSize < canvas.width and 0 <= row * canvas.tileSize < canvas.height):
+            raise ProtocolError("tile {} is outside of the canvas".format(key))
+        return canvas.tileRect(key)
+    if kind == OP_POLYLINE:
+        pen, points = payload
+        pad = strokePadding(pen.widthF(), pen.capStyle(), pen.joinStyle())
+        return QPolygon(points).boundingRect().adjusted(-pad, -pad, pad, pad)
+    key, topLeft = payload
+    return QRectF(topLeft, QSizeF(dabCache.dabForKey(key).size())).toAlignedRect()
+
+
+def opKeys(canvas, kind, payload):
+    """Returns the keys of the tiles an op draws on"""
+    return list(canvas.tileKeys(opRect(canvas, kind, payload)))
+
+
+def drawOp(tilePainter, canvas, kind, payload):
+    """Draws an op through a QPainter in canvas coordinates, e.g. onto one tile"""
+    tilePainter.save()
+    if kind == OP_TILE:
+        key, data = payload
+        tile = decodeTile(canvas, data)
+        tilePainter.setCompositionMode(QPainter.CompositionMode_Source)  # the pixels are replaced, not blended
+        if tile is None:
+            tilePainter.fillRect(canvas.tileRect(key), canvas.background)
+        else:
+            tilePainter.drawImage(canvas.tileRect(key).topLeft(), tile)
+    elif kind == OP_POLYLINE:
+        pen, points = payload
+        tilePainter.setPen(pen)
+        if len(points) == 1:
+            tilePainter.drawPoint(points[0])
+        else:
+            tilePainter.drawPolyline(QPolygon(points))
+    else:
+        key, topLeft = payload
+        tilePainter.drawImage(topLeft, dabCache.dabForKey(key))
+    tilePainter.restore()
+
+
+def drawOnTile(canvas, key, tile, kind, payload):
+    """Returns a tile image which is not stored in the canvas, e.g. a copy, with an op drawn onto it.
+    None stands for a blank tile"""
+    tile = canvas.blankTile.copy() if tile is None else tile
+    tilePainter = QPainter(tile)
+    tilePainter.translate(-canvas.tileRect(key).topLeft())
+    drawOp(tilePainter, canvas, kind, payload)
+    tilePainter.end()
+    return tile
+
+
+def applyOp(canvas, kind, payload, openPainters=None, keys=None):
+    """Draws an op onto the tiles of a canvas, or only onto the tiles with the given keys, and returns the changed
+    canvas rectangle. openPainters are the tile painters of a local stroke on the same canvas: a tile can only have
+    one QPainter at a time, so the op is drawn through them on the tiles they hold"""
+    openPainters = openPainters or {}
+    rect = opRect(canvas, kind, payload)
+    keys = list(canvas.tileKeys(rect)) if keys is None else keys
+    painted = []
+    for key in keys:
+        tilePainter = openPainters.get(key)
+        if tilePainter is not None:
+            drawOp(tilePainter, canvas, kind, payload)
+            painted.append(key)
+        elif kind == OP_TILE:
+            canvas.setTile(key, decodeTile(canvas, payload[1]))  # nothing to paint, the tile is replaced
+        else:
+            tilePainter = QPainter(canvas.tileForWrite(key))
+            tilePainter.translate(-canvas.tileRect(key).topLeft())  # draw in canvas coordinates
+            drawOp(tilePainter, canvas, kind, payload)
+            tilePainter.end()
+            painted.append(key)
+    canvas.touch(painted, rect)
+
+    changed = QRect()
+    for key in keys:
+        changed = changed.united(canvas.tileRect(key))
+    return changed.intersected(rect).intersected(canvas.rect())
@@ -0,0 +1,209 @@
+"""
+SessionServer shares one canvas between several painting clients over TCP, on localhost or a LAN.
+Clients send the primitives their strokes drew (see SessionProtocol), the server draws them onto its own TiledCanvas
+and broadcasts everything received during one frame as a single compressed batch, encoded once for all clients.
+A client joining late gets the painted tiles of the server canvas followed by the batches. A client whose socket
+cannot keep up is skipped instead of queueing batches without limit, and gets a new snapshot once it caught up.
+
+Usage (from the code directory):
+    python PaintingApplication.py --serve [--host 0.0.0.0] [--port 47210] [--size 1920x1080] [--format rgb]
+
+Qt is only used to paint on QImages, so the server needs neither a QApplication nor a display server.
+"""
+from PyQt5.QtGui import QColor
+from PyQt5.QtCore import Qt
+
+import argparse
+import asyncio
+import json
+import sys
+
+from TiledCanvas import TiledCanvas
+from SessionProtocol import VERSION, DEFAULT_PORT, FRAME_RATE, HEADER_SIZE, HELLO, WELCOME, SNAPSHOT, OPS, BATCH, \
+    OP_TILE, SESSION_FORMATS, ProtocolError, frame, jsonFrame, frameHeader, frameBody, encodeTile, compressTile, \
+    stampClient, snapshotBody, decodeOps, decodeTile, opRect, applyOp
+
+MAX_BACKLOG = 8 * 1024 * 1024  # bytes queued for a client before it is skipped until it caught up
+
+
+def report(message):
+    print(message, flush=True)
+
+
+class Participant:
+    """A connected client"""
+
+    def __init__(self, number, name, writer):
+        self.number = number  # stamped into the op records of the client
+        self.name = name
+        self.writer = writer
+        self.stale = False  # batches were skipped, a snapshot is sent once the socket drained
+        self.sequenced = 0  # ops of the client drawn onto the server canvas, a snapshot tells the client how many
+
+
+class SessionServer:
+    def __init__(self, canvas, frameRate=FRAME_RATE, log=report):
+        self.canvas = canvas
+        self.frameInterval = 1 / frameRate
+        self.log = log  # callable(message) telling about clients joining and leaving
+
+        self.participants = {}  # client number -> Participant
+        self.nextNumber = 1
+        self.pending = []  # (client number, kind, payload, record) received since the last frame, in arrival order
+        self.blobs = {}  # tile key -> (tile revision, compressed pixels), reused by every snapshot
+        self.port = None  # the port listened on, known once serving
+
+    async def serve(self, host, port, ready=None):
+        """Accepts clients and broadcasts the batches until cancelled, ready() is called once listening"""
+        # documentation: https://docs.python.org/3/library/asyncio-stream.html#asyncio.start_server
+        server = await asyncio.start_server(self.handle, host, port)
+        self.port = server.sockets[0].getsockname()[1]
+        self.log("listening on {}:{}".format(host, self.port))
+        if ready is not None:
+            ready()
+        async with server:
+            await self.broadcastLoop()
+
+    async def readFrame(self, reader):
+        length, kind = frameHeader(await reader.readexactly(HEADER_SIZE))
+        return kind, frameBody(kind, await reader.readexactly(length))
+
+    async def handle(self, reader, writer):
+        """Serves one client: the handshake and snapshot, then the ops it sends"""
+        participant = None
+        reason = "disconnected"
+        try:
+            kind, body = await self.readFrame(reader)
+            hello = json.loads(body) if kind == HELLO else None
+            if not isinstance(hello, dict) or hello.get("version") != VERSION:
+                raise ProtocolError("expected a version {} HELLO".format(VERSION))
+
+            participant = Participant(self.nextNumber, str(hello.get("name", ""))[:64], writer)
+            self.nextNumber += 1
+            c = self.canvas
+            writer.write(jsonFrame(WELCOME, {"version": VERSION, "client": participant.number, "width": c.width,
+                                             "height": c.height, "format": int(c.format),
+                                             "background": c.background.rgba(), "tileSize": c.tileSize}))
+            # no await between the snapshot and joining, so the first batch the client gets follows the snapshot
+            writer.write(self.snapshotFrame(participant))
+            self.participants[participant.number] = participant
+            self.log("#{} {} joined, {} clients".format(participant.number, participant.name, len(self.participants)))
+
+            while True:
+                kind, body = await self.readFrame(reader)
+                if kind != OPS:
+                    raise ProtocolError("unexpected message {}".format(kind))
+                # the whole message is checked first: the server acknowledges ops by echoing them in order, so a
+                # client with a dropped op could not match the echoes any more and is disconnected instead
+                ops = list(decodeOps(body))
+                for kind, _, payload, _ in ops:
+                    opRect(self.canvas, kind, payload)  # raises for tiles outside of the canvas
+                    if kind == OP_TILE:
+                        decodeTile(self.canvas, payload[1])  # raises for pixels which are not a tile of the canvas
+                for kind, _, payload, record in ops:
+                    self.pending.append((participant.number, kind, payload, stampClient(record, participant.number)))
+        except asyncio.IncompleteReadError:
+            pass
+        except (ConnectionError, ProtocolError, ValueError) as error:
+            reason = str(error)
+        finally:
+            writer.close()
+            if participant is not None:
+                self.participants.pop(participant.number, None)
+                self.log("#{} {} left ({}), {} clients".format(participant.number, participant.name, reason,
+                                                               len(self.participants)))
+
+    async def broadcastLoop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            self.sendFrame()
+            await asyncio.sleep(max(0.0, self.frameInterval - (loop.time() - start)))
+
+    def sendFrame(self):
+        """Draws the ops received since the last frame onto the canvas and sends them to every client as one batch"""
+        batch = None
+        if self.pending:
+            records = []
+            for number, kind, payload, record in self.pending:
+                # handle checked every op, an op is never dropped here: clients match the echoes of their ops in order
+                applyOp(self.canvas, kind, payload)
+                sender = self.participants.get(number)
+                if sender is not None:
+                    sender.sequenced += 1
+                if kind == OP_TILE:
+                    key, data = payload
+                    self.blobs[key] = self.canvas.tileRevisions.get(key, 0), data  # saves compressing it again
+                records.append(record)
+            self.pending = []
+            if records:
+                batch = frame(BATCH, b"".join(records))  # compressed once for all clients
+
+        for participant in list(self.participants.values()):
+            queued = participant.writer.transport.get_write_buffer_size()
+            if queued > MAX_BACKLOG:
+                participant.stale = True  # the snapshot sent once it caught up replaces the skipped batches
+            elif participant.stale:
+                if queued < MAX_BACKLOG // 4:
+                    participant.writer.write(self.snapshotFrame(participant))
+                    participant.stale = False
+            elif batch is not None:
+                participant.writer.write(batch)
+
+    def snapshotFrame(self, participant):
+        """Returns a SNAPSHOT of the painted tiles for a client, only the tiles changed since the last snapshot are
+        compressed"""
+        records = []
+        for key, tile in self.canvas.tiles.items():
+            revision = self.canvas.tileRevisions.get(key, 0)
+            blob = self.blobs.get(key)
+            if blob is None or blob[0] != revision:
+                blob = self.blobs[key] = revision, compressTile(tile)
+            records.append(encodeTile(0, key, blob[1]))
+        for key in [key for key in self.blobs if key not in self.canvas.tiles]:
+            del self.blobs[key]
+        return frame(SNAPSHOT, snapshotBody(participant.sequenced, b"".join(records)))
+
+
+def parseSize(text):
+    width, _, height = text.lower().partition("x")
+    try:
+        size = int(width), int(height)
+    except ValueError:
+        raise argparse.ArgumentTypeError("expected WIDTHxHEIGHT, e.g. 1920x1080")
+    if min(size) <= 0:
+        raise argparse.ArgumentTypeError("the size must be positive")
+    return size
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="PaintingApplication.py --serve",
+                                     description="Hosts a shared painting session for several painting applications")
+    parser.add_argument("--host", default="127.0.0.1", help="address to listen on, 0.0.0.0 accepts the local network")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="port to listen on, 0 picks a free one")
+    parser.add_argument("--size", type=parseSize, default=(1920, 1080), help="canvas size, WIDTHxHEIGHT")
+    parser.add_argument("--format", choices=SESSION_FORMATS, default="rgb", help="working pixel format of the canvas")
+    parser.add_argument("--background", help="background colour, e.g. #ffffff, transparent for the argb format")
+    parser.add_argument("--frame-rate", type=int, default=FRAME_RATE, help="batches sent per second")
+    args = parser.parse_args(argv)
+
+    background = QColor(args.background) if args.background else QColor(Qt.transparent if args.format == "argb" else Qt.white)
+    if not background.isValid():
+        parser.error("invalid background colour {}".format(args.background))
+    if background.alpha() < 255 and args.format != "argb":
+        parser.error("only the argb format has a transparent background")
+
+    canvas = TiledCanvas(args.size[0], args.size[1], SESSION_FORMATS[args.format], background)
+    server = SessionServer(canvas, max(args.frame_rate, 1))
+    try:
+        asyncio.run(server.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    except OSError as error:
+        print("Cannot listen on {}:{}: {}".format(args.host, args.port, error), file=sys.stderr)
+        return 2
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
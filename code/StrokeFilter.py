@@ -0,0 +1,106 @@
+"""
+StrokeFilter class processes the pointer points of a stroke before they are rasterized. Fast pointers deliver many
+points only a pixel or two apart, drawing each of them gives thousands of tiny segments and a jagged line.
+The points buffered for a frame are decimated (points closer than minDistance are dropped), runs of nearly collinear
+points are simplified with the Ramer-Douglas-Peucker algorithm and, optionally, a Catmull-Rom curve is fitted
+through the remaining points, so a frame draws a few long segments instead of many short ones.
+"""
+from PyQt5.QtCore import QPoint
+
+import math
+
+DEFAULT_MIN_DISTANCE = 2.0  # pixels between two kept points
+DEFAULT_TOLERANCE = 0.75  # pixels a point may be off the line through its neighbours and still be dropped
+DEFAULT_CURVE_STEP = 3.0  # length in pixels of the segments a fitted curve is split into
+
+
+def distance(a, b):
+    return math.hypot(b.x() - a.x(), b.y() - a.y())
+
+
+def lineDistance(point, start, end):
+    """Returns the distance between a point and the line through start and end"""
+    dx, dy = end.x() - start.x(), end.y() - start.y()
+    length = math.hypot(dx, dy)
+    if length == 0:
+        return distance(point, start)
+    return abs(dy * (point.x() - start.x()) - dx * (point.y() - start.y())) / length
+
+
+def simplify(points, tolerance):
+    """Ramer-Douglas-Peucker: returns the points needed to stay within tolerance of the polyline, ends are kept"""
+    if len(points) < 3 or tolerance <= 0:
+        return list(points)
+    keep = [False] * len(points)
+    keep[0] = keep[-1] = True
+    ranges = [(0, len(points) - 1)]
+    while ranges:
+        first, last = ranges.pop()
+        farthest, farthestDistance = None, tolerance
+        for index in range(first + 1, last):
+            d = lineDistance(points[index], points[first], points[last])
+            if d > farthestDistance:
+                farthest, farthestDistance = index, d
+        if farthest is not None:
+            keep[farthest] = True
+            ranges.append((first, farthest))
+            ranges.append((farthest, last))
+    return [point for point, kept in zip(points, keep) if kept]
+
+
+def catmullRom(p0, p1, p2, p3, t):
+    """Returns the point at t (0 to 1) of the Catmull-Rom segment between p1 and p2"""
+    t2, t3 = t * t, t * t * t
+
+    def axis(a, b, c, d):
+        return 0.5 * (2 * b + (c - a) * t + (2 * a - 5 * b + 4 * c - d) * t2 + (3 * b - a - 3 * c + d) * t3)
+
+    return QPoint(round(axis(p0.x(), p1.x(), p2.x(), p3.x())), round(axis(p0.y(), p1.y(), p2.y(), p3.y())))
+
+
+class StrokeFilter:
+    def __init__(self, minDistance=DEFAULT_MIN_DISTANCE, tolerance=DEFAULT_TOLERANCE, smooth=False,
+                 curveStep=DEFAULT_CURVE_STEP):
+        self.minDistance = minDistance  # 0 keeps every point
+        self.tolerance = tolerance  # 0 keeps collinear points
+        self.smooth = smooth  # fit curves through the kept points instead of straight segments, see Smooth curves
+        self.curveStep = curveStep
+
+    def decimate(self, lastPoint, points, final=False):
+        """Drops the points closer than minDistance to the previous kept point.
+        The last point of a stroke is always kept so the stroke ends where the pointer was released"""
+        kept = []
+        anchor = lastPoint
+        for point in points:
+            if distance(anchor, point) >= self.minDistance:
+                kept.append(point)
+                anchor = point
+        if final and points and points[-1] != anchor:
+            kept.append(points[-1])
+        return kept
+
+    def curve(self, previous, points):
+        """Returns the points of Catmull-Rom curves through points, previous is the point drawn before the first one.
+        The curve of the last segment ends with the direction of the segment because the next point is not known yet"""
+        result = []
+        for index in range(1, len(points)):
+            p1, p2 = points[index - 1], points[index]
+            p0 = points[index - 2] if index >= 2 else (previous if previous is not None else p1)
+            p3 = points[index + 1] if index + 1 < len(points) else p2
+            steps = max(1, math.ceil(distance(p1, p2) / self.curveStep))
+            for step in range(1, steps + 1):
+                point = catmullRom(p0, p1, p2, p3, step / steps)
+                if point != (result[-1] if result else p1):
+                    result.append(point)
+        return result
+
+    def process(self, previous, lastPoint, points, final=False):
+        """Returns the points to draw after lastPoint for the points received since lastPoint was drawn.
+        previous is the point drawn before lastPoint (None at the start of a stroke), it gives the curve direction"""
+        points = self.decimate(lastPoint, points, final)
+        if not points:
+            return []
+        points = simplify([lastPoint] + points, self.tolerance)
+        if self.smooth and len(points) > 1:
+            return self.curve(previous, points)
+        return points[1:]
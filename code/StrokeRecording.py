@@ -0,0 +1,135 @@
+"""
+StrokeRecording class records the strokes applied by the Painter: the pen of every stroke and its points.
+Points are kept in array-backed buffers together with the point counts of every flush, so a replay draws exactly
+the same primitives as the live stroke did. Replaying does not need a widget, only a QImage.
+"""
+from PyQt5.QtGui import QColor, QImage, QPainter, QPen, QPolygon
+from PyQt5.QtCore import QPoint, Qt
+
+from array import array
+import struct
+import sys
+import time
+
+MAGIC = b"PQPSTRK1"
+HEADER_FORMAT = "<8sIIII"  # magic, canvas width, canvas height, background rgba, number of strokes
+STROKE_FORMAT = "<IfIIIII"  # color rgba, width, style, cap, join, number of points, number of flushes
+
+
+class StrokeRecord:
+    """One stroke drawn with one pen"""
+
+    def __init__(self, color, width, style, cap, join):
+        self.color = QColor(color).rgba()
+        self.width = width
+        self.style = int(style)
+        self.cap = int(cap)
+        self.join = int(join)
+
+        self.xs = array("i")  # documentation: https://docs.python.org/3/library/array.html
+        self.ys = array("i")
+        self.flushes = array("I")  # number of points drawn after every flush, the first point is drawn on its own
+
+    def addPoints(self, points):
+        """Appends the points drawn by one flush"""
+        for point in points:
+            self.xs.append(point.x())
+            self.ys.append(point.y())
+        self.flushes.append(len(self.xs))
+
+    def pen(self):
+        """Returns the pen the stroke was drawn with"""
+        return QPen(QColor.fromRgba(self.color), self.width, Qt.PenStyle(self.style), Qt.PenCapStyle(self.cap),
+                    Qt.PenJoinStyle(self.join))
+
+    def draw(self, qpainter):
+        """Draws the stroke with the same primitives as the live stroke"""
+        if not self.xs:
+            return
+        qpainter.setPen(self.pen())
+        start = 0
+        for end in self.flushes:
+            if start == 0 and end == 1:
+                qpainter.drawPoint(self.xs[0], self.ys[0])
+            else:
+                first = max(start - 1, 0)  # every polyline continues from the last point of the previous flush
+                qpainter.drawPolyline(QPolygon([QPoint(x, y) for x, y in zip(self.xs[first:end], self.ys[first:end])]))
+            start = end
+
+
+class StrokeRecording:
+    def __init__(self, width, height, background=Qt.white):
+        self.width = width
+        self.height = height
+        self.background = QColor(background).rgba()
+        self.strokes = []
+
+    def beginStroke(self, color, width, style, cap, join):
+        """Starts recording a stroke and returns its StrokeRecord"""
+        record = StrokeRecord(color, width, style, cap, join)
+        self.strokes.append(record)
+        return record
+
+    def pointCount(self):
+        return sum(len(record.xs) for record in self.strokes)
+
+    def replay(self, image, scale=1.0):
+        """Draws all recorded strokes onto a QImage, scaled by the given factor"""
+        imagePainter = QPainter(image)
+        if scale != 1.0:
+            imagePainter.scale(scale, scale)  # pen widths are scaled together with the points
+        for record in self.strokes:
+            record.draw(imagePainter)
+        imagePainter.end()
+
+    def render(self, scale=1.0, imageFormat=QImage.Format_RGB32):
+        """Returns a new QImage with the recording drawn onto the recorded background"""
+        image = QImage(round(self.width * scale), round(self.height * scale), imageFormat)
+        image.fill(QColor.fromRgba(self.background))
+        self.replay(image, scale)
+        return image
+
+    def benchmark(self, repeat=1, scale=1.0):
+        """Replays the recording onto a fresh image repeat times, returns strokes per second"""
+        image = QImage(round(self.width * scale), round(self.height * scale), QImage.Format_RGB32)
+        start = time.perf_counter()
+        for _ in range(repeat):
+            self.replay(image, scale)
+        seconds = time.perf_counter() - start
+        return len(self.strokes) * repeat / seconds if seconds > 0 else float("inf")
+
+    def save(self, path):
+        """Writes the recording into a compact binary file"""
+        with open(path, "wb") as f:
+            f.write(struct.pack(HEADER_FORMAT, MAGIC, self.width, self.height, self.background, len(self.strokes)))
+            for record in self.strokes:
+                f.write(struct.pack(STROKE_FORMAT, record.color, record.width, record.style, record.cap, record.join,
+                                    len(record.xs), len(record.flushes)))
+                for values in (record.xs, record.ys, record.flushes):
+                    if sys.byteorder == "big":
+                        values = array(values.typecode, values)
+                        values.byteswap()  # the file is little endian
+                    f.write(values.tobytes())
+
+    @classmethod
+    def load(cls, path):
+        """Reads a recording written by save"""
+        with open(path, "rb") as f:
+            data = f.read()
+        magic, width, height, background, count = struct.unpack_from(HEADER_FORMAT, data, 0)
+        if magic != MAGIC:
+            raise ValueError("{} is not a stroke recording".format(path))
+
+        recording = cls(width, height, QColor.fromRgba(background))
+        offset = struct.calcsize(HEADER_FORMAT)
+        for _ in range(count):
+            color, penWidth, style, cap, join, points, flushes = struct.unpack_from(STROKE_FORMAT, data, offset)
+            offset += struct.calcsize(STROKE_FORMAT)
+            record = recording.beginStroke(QColor.fromRgba(color), penWidth, style, cap, join)
+            for values, length in ((record.xs, points), (record.ys, points), (record.flushes, flushes)):
+                size = length * values.itemsize
+                values.frombytes(data[offset:offset + size])
+                if sys.byteorder == "big":
+                    values.byteswap()
+                offset += size
+        return recording
@@ -0,0 +1,133 @@
+"""
+StrokeSession class keeps the QPainters and the QPen used by a stroke open for the whole duration of the stroke.
+Every canvas tile touched by the stroke gets one QPainter, opened the first time the stroke reaches the tile.
+Mouse points are buffered between frames and flushed as a single polyline per paint event, after the StrokeFilter
+of the painter has decimated, simplified and optionally smoothed them.
+"""
+from PyQt5.QtGui import QColor, QPainter, QPen, QPolygon
+from PyQt5.QtCore import QRect, Qt
+
+import math
+
+from Profiler import profiler
+
+# QPen's default miter limit, see: https://doc.qt.io/qt-5/qpen.html#miterLimit
+MITER_LIMIT = 2.0
+
+
+def strokePadding(width, cap, join):
+    """Returns how many pixels a pen can reach beyond the centre line of a stroke"""
+    halfWidth = max(width, 1) / 2
+    if join == Qt.MiterJoin:
+        reach = halfWidth * 2 * MITER_LIMIT  # a sharp miter sticks out up to the limit, which is in pen widths
+    elif cap == Qt.SquareCap:
+        reach = halfWidth * math.sqrt(2)  # the corner of a square cap on a diagonal segment
+    else:
+        reach = halfWidth
+    return math.ceil(reach) + 1
+
+
+class StrokeSession:
+    def __init__(self, painter, canvas, recording=None):
+        self.painter = painter  # the Painter widget which owns the brush settings
+        self.canvas = canvas
+        self.recording = recording  # optional StrokeRecording the stroke is recorded into
+        self.record = None  # StrokeRecord of the current pen
+
+        self.tilePainters = {}  # tile key -> QPainter kept open until the stroke ends
+        self.pen = None
+        self.penKey = None  # brush settings the current pen was built from
+
+        self.lastPoint = None  # last point which has been drawn onto the canvas
+        self.previousPoint = None  # point drawn before lastPoint, gives the direction of a smoothed curve
+        self.pendingPoints = []  # points received since the last flush
+
+    def brushKey(self):
+        """Returns the brush settings which the pen depends on"""
+        p = self.painter
+        return QColor(p.brushColor).rgba(), p.brushWidth, p.brushStyle, p.brushCap, p.brushJoin
+
+    def updatePen(self):
+        """Rebuilds the pen only when a brush setting has changed since the last flush"""
+        key = self.brushKey()
+        if key != self.penKey:
+            p = self.painter
+            self.pen = QPen(p.brushColor, p.brushWidth, p.brushStyle, p.brushCap, p.brushJoin)
+            self.penKey = key
+            if self.recording is not None:
+                self.record = self.recording.beginStroke(p.brushColor, p.brushWidth, p.brushStyle, p.brushCap, p.brushJoin)
+            for tilePainter in self.tilePainters.values():
+                tilePainter.setPen(self.pen)
+
+    def paintersFor(self, rect):
+        """Yields a QPainter for every tile intersecting the rectangle, opening the missing ones"""
+        for key in self.canvas.tileKeys(rect):
+            tilePainter = self.tilePainters.get(key)
+            if tilePainter is None:
+                tilePainter = QPainter(self.canvas.tileForWrite(key))  # see: https://doc.qt.io/qt-5/qpainter.html#begin
+                tilePainter.translate(-self.canvas.tileRect(key).topLeft())  # draw in canvas coordinates
+                tilePainter.setPen(self.pen)
+                self.tilePainters[key] = tilePainter
+            yield tilePainter
+
+    def begin(self, point):
+        """Draws the first point of the stroke and returns the dirty rectangle"""
+        self.updatePen()
+        dirtyRect = self.painter.segmentRect(point, point)
+        for tilePainter in self.paintersFor(dirtyRect):
+            tilePainter.drawPoint(point)
+        self.canvas.touch(list(self.canvas.tileKeys(dirtyRect)), dirtyRect)
+        self.notifyDrawn([point])
+        if self.record is not None:
+            self.record.addPoints([point])
+        self.lastPoint = point
+        return dirtyRect
+
+    def addPoint(self, point):
+        """Buffers a point until the next flush and returns the rectangle which will become dirty"""
+        previous = self.pendingPoints[-1] if self.pendingPoints else self.lastPoint
+        self.pendingPoints.append(point)
+        return self.painter.segmentRect(previous, point)
+
+    @profiler.timed("StrokeSession.flush")
+    def flush(self, final=False):
+        """Draws all buffered points as one polyline and returns the dirty rectangle.
+        final is True for the last flush of the stroke, which always reaches the last point"""
+        if not self.pendingPoints:
+            return QRect()
+
+        points = self.pendingPoints
+        if self.painter.strokeFilter is not None:
+            points = self.painter.strokeFilter.process(self.previousPoint, self.lastPoint, points, final)
+        self.pendingPoints = []
+        if not points:
+            return QRect()  # all points were too close to the last drawn one, the next points are measured from it
+
+        self.updatePen()
+        polyline = QPolygon([self.lastPoint] + points)
+        pad = self.painter.strokePadding()
+        dirtyRect = polyline.boundingRect().adjusted(-pad, -pad, pad, pad)
+        for tilePainter in self.paintersFor(dirtyRect):
+            tilePainter.drawPolyline(polyline)  # documentation: https://doc.qt.io/qt-5/qpainter.html#drawPolyline-2
+        self.canvas.touch(list(self.canvas.tileKeys(dirtyRect)), dirtyRect)
+        self.notifyDrawn([self.lastPoint] + points)
+        if self.record is not None:
+            # a stroke whose pen changed continues in a new record which starts at the last drawn point
+            self.record.addPoints(points if self.record.xs else [self.lastPoint] + points)
+
+        self.previousPoint = points[-2] if len(points) > 1 else self.lastPoint
+        self.lastPoint = points[-1]
+        return dirtyRect
+
+    def notifyDrawn(self, points):
+        """Tells the stroke listeners of the painter about a point or polyline drawn with the current pen"""
+        for listener in self.painter.strokeListeners:
+            listener(self.canvas, self.pen, points)
+
+    def end(self):
+        """Flushes the remaining points, closes the painters and returns the dirty rectangle"""
+        dirtyRect = self.flush(final=True)
+        for tilePainter in self.tilePainters.values():
+            tilePainter.end()
+        self.tilePainters = {}
+        return dirtyRect
@@ -0,0 +1,278 @@
+"""
+TiledCanvas class stores the painting as a grid of tiles which are allocated the first time they are painted on.
+Tiles which were never painted are not stored at all, they all share one blank tile filled with the background.
+The tiles are stored in the pixel format of the document. QPainter cannot paint on Indexed8 images, so the tiles of an
+Indexed8 canvas are unpacked into the paint format while they are painted on and packed again by pack().
+"""
+from PyQt5.QtGui import QColor, QImage, QPainter, QRegion, qRgb
+from PyQt5.QtCore import Qt, QRect, QSize
+
+TILE_SIZE = 256  # width and height of a tile in pixels
+
+# working pixel formats a document can use, documentation: https://doc.qt.io/qt-5/qimage.html#Format-enum
+PIXEL_FORMATS = {
+    "RGB (32-bit)": QImage.Format_RGB32,
+    "ARGB premultiplied (32-bit, transparency)": QImage.Format_ARGB32_Premultiplied,
+    "Grayscale (8-bit)": QImage.Format_Grayscale8,
+    "Indexed (8-bit palette)": QImage.Format_Indexed8,
+}
+
+
+def defaultColorTable():
+    """Returns the palette of new Indexed8 documents: the 216 web colours followed by 40 grays"""
+    table = [qRgb(r, g, b) for r in range(0, 256, 51) for g in range(0, 256, 51) for b in range(0, 256, 51)]
+    return table + [qRgb(v, v, v) for v in (round(i * 255 / 41) for i in range(1, 41))]
+
+
+def workingFormat(image):
+    """Returns the working format for an opened image: compact formats stay compact, alpha uses premultiplied ARGB"""
+    if image.format() == QImage.Format_Grayscale8 or (image.format() == QImage.Format_Indexed8 and image.isGrayscale()):
+        return QImage.Format_Grayscale8
+    if image.format() in (QImage.Format_Indexed8, QImage.Format_Mono, QImage.Format_MonoLSB):
+        return QImage.Format_Indexed8
+    if image.hasAlphaChannel():
+        return QImage.Format_ARGB32_Premultiplied
+    return QImage.Format_RGB32
+
+
+class TiledCanvas:
+    def __init__(self, width, height, imageFormat=QImage.Format_RGB32, background=Qt.white, tileSize=TILE_SIZE,
+                 colorTable=None):
+        self.width = width
+        self.height = height
+        self.format = imageFormat
+        self.background = QColor(background)
+        self.tileSize = tileSize
+
+        # the palette of an Indexed8 canvas, strokes are mapped to its nearest colours when the tiles are packed
+        self.colorTable = None
+        self.paintFormat = imageFormat  # the format the tiles are painted in
+        self.unpacked = set()  # keys of the tiles currently stored in the paint format instead of the format
+        if imageFormat == QImage.Format_Indexed8:
+            self.colorTable = list(colorTable or defaultColorTable())
+            if self.background.rgba() not in self.colorTable and len(self.colorTable) < 256:
+                self.colorTable.append(self.background.rgba())
+            self.paintFormat = QImage.Format_ARGB32_Premultiplied if self.background.alpha() < 255 else QImage.Format_RGB32
+
+        self.tiles = {}  # (column, row) -> QImage, a missing key means the tile is blank
+        self.writeListeners = []  # callables(canvas, key) notified before a tile is changed, e.g. by the undo history
+        self.changeListeners = []  # callables(canvas, keys, rect) notified after tiles were changed, e.g. by the mipmap cache
+
+        # every change bumps the revision, tileRevisions remembers the revision of the last change of each tile
+        self.revision = 0
+        self.tileRevisions = {}
+
+        # the shared sentinel returned for every tile which has not been painted yet
+        self.blankTile = QImage(tileSize, tileSize, imageFormat)  # see: https://doc.qt.io/qt-5/qimage.html#QImage-1
+        if self.colorTable is not None:
+            self.blankTile = QImage(tileSize, tileSize, self.paintFormat)
+            self.blankTile.fill(self.background)
+            self.blankTile = self.packed(self.blankTile)
+        else:
+            self.blankTile.fill(self.background)
+
+    @classmethod
+    def fromImage(cls, image, imageFormat=QImage.Format_RGB32, background=Qt.white, tileSize=TILE_SIZE, progress=None,
+                  colorTable=None):
+        """Splits an image into tiles, tiles which only contain the background stay blank.
+        The image is converted into the format once here, an indexed image keeps its own palette.
+        progress is an optional callable(done, total) called after each tile"""
+        if colorTable is None and imageFormat == QImage.Format_Indexed8 and image.format() == QImage.Format_Indexed8:
+            colorTable = image.colorTable()
+        canvas = cls(image.width(), image.height(), imageFormat, background, tileSize, colorTable)
+        if canvas.colorTable is not None:
+            image = canvas.packed(image)
+        else:
+            image = image.convertToFormat(imageFormat)  # documentation: https://doc.qt.io/qt-5/qimage.html#convertToFormat
+
+        keys = list(canvas.tileKeys(canvas.rect()))
+        for done, key in enumerate(keys, 1):
+            tileRect = canvas.tileRect(key)
+            if canvas.rect().contains(tileRect):
+                tile = image.copy(tileRect)
+            else:
+                # tiles on the right and bottom edges are padded with the background
+                tile = canvas.blankTile.convertToFormat(canvas.paintFormat)
+                tilePainter = QPainter(tile)
+                tilePainter.drawImage(0, 0, image, tileRect.x(), tileRect.y(), tileRect.width(), tileRect.height())
+                tilePainter.end()
+                if canvas.colorTable is not None:
+                    tile = canvas.packed(tile)
+            if tile != canvas.blankTile:
+                canvas.tiles[key] = tile
+            if progress is not None:
+                progress(done, len(keys))
+        return canvas
+
+    def snapshot(self):
+        """Returns a copy of the canvas which is not affected by later painting.
+        The tiles are shared copy-on-write, so taking a snapshot does not copy any pixels"""
+        canvas = TiledCanvas(self.width, self.height, self.format, self.background, self.tileSize, self.colorTable)
+        canvas.tiles = {key: QImage(tile) for key, tile in self.tiles.items()}  # see: https://doc.qt.io/qt-5/implicit-sharing.html
+        canvas.unpacked = set(self.unpacked)
+        return canvas
+
+    def memoryUsage(self):
+        """Returns the bytes taken by the stored tiles, tiles still compressed in a project file are not counted"""
+        tiles = self.tiles.loadedValues() if hasattr(self.tiles, "loadedValues") else self.tiles.values()
+        return sum(tile.sizeInBytes() for tile in tiles)
+
+    def size(self):
+        """Returns the size of the canvas"""
+        return QSize(self.width, self.height)
+
+    def rect(self):
+        """Returns the rectangle covered by the canvas"""
+        return QRect(0, 0, self.width, self.height)
+
+    def tileRect(self, key):
+        """Returns the canvas area covered by the tile with the given (column, row) key"""
+        column, row = key
+        return QRect(column * self.tileSize, row * self.tileSize, self.tileSize, self.tileSize)
+
+    def tileKeys(self, rect):
+        """Yields the keys of all tiles which intersect the rectangle"""
+        rect = rect.intersected(self.rect())
+        if rect.isEmpty():
+            return
+        for row in range(rect.top() // self.tileSize, rect.bottom() // self.tileSize + 1):
+            for column in range(rect.left() // self.tileSize, rect.right() // self.tileSize + 1):
+                yield column, row
+
+    def tile(self, key):
+        """Returns the tile for reading, blank tiles return the shared blank tile"""
+        return self.tiles.get(key, self.blankTile)
+
+    def isBlank(self, key):
+        """Returns True if the tile has never been painted on"""
+        return key not in self.tiles
+
+    def tileForWrite(self, key):
+        """Returns the tile for painting, a blank tile gets its own copy first.
+        The tile is in the paint format, a packed Indexed8 tile stays unpacked until pack() is called"""
+        self.notifyWrite(key)
+        tile = self.tiles.get(key)
+        if tile is None:
+            tile = self.blankTile.copy()  # documentation: https://doc.qt.io/qt-5/qimage.html#copy
+            self.tiles[key] = tile
+        if tile.format() != self.paintFormat:
+            tile = self.tiles[key] = tile.convertToFormat(self.paintFormat)
+            self.unpacked.add(key)
+        return tile
+
+    def packed(self, image):
+        """Returns an image converted into the Indexed8 palette of the canvas, each pixel gets the nearest colour"""
+        # documentation: https://doc.qt.io/qt-5/qimage.html#convertToFormat-1
+        return image.convertToFormat(QImage.Format_Indexed8, self.colorTable, Qt.ThresholdDither)
+
+    def pack(self):
+        """Converts the tiles unpacked for painting back into the format of the canvas, e.g. at the end of a stroke.
+        Returns the canvas rectangle of the packed tiles"""
+        keys = [key for key in self.unpacked if key in self.tiles]
+        self.unpacked.clear()
+        changed = QRect()
+        for key in keys:
+            self.tiles[key] = self.packed(self.tiles[key])
+            changed = changed.united(self.tileRect(key))
+        self.touch(keys)  # strokes snap to the palette colours
+        return changed.intersected(self.rect())
+
+    def setTile(self, key, tile):
+        """Replaces a tile, None makes the tile blank"""
+        self.notifyWrite(key)
+        if tile is None:
+            self.tiles.pop(key, None)
+        else:
+            self.tiles[key] = tile
+        self.touch([key])
+
+    def touch(self, keys, rect=None):
+        """Records that the given tiles have been changed and tells the change listeners.
+        rect optionally limits the change to a part of the tiles"""
+        if not keys:
+            return
+        self.revision += 1
+        for key in keys:
+            self.tileRevisions[key] = self.revision
+        for listener in self.changeListeners:
+            listener(self, keys, rect)
+
+    def changedSince(self, revision):
+        """Returns the keys of the tiles changed after the given revision"""
+        return [key for key, tileRevision in self.tileRevisions.items() if tileRevision > revision]
+
+    def notifyWrite(self, key):
+        """Tells the write listeners that a tile is about to change"""
+        for listener in self.writeListeners:
+            listener(self, key)
+
+    def clear(self):
+        """Makes every tile blank again, only the painted tiles are released"""
+        keys = list(self.tiles)
+        for key in keys:
+            self.notifyWrite(key)
+        self.tiles.clear()
+        self.unpacked.clear()
+        self.touch(keys)
+
+    def extend(self, width, height):
+        """Grows the canvas to at least the given size, the new area is blank"""
+        if width <= self.width and height <= self.height:
+            return
+        oldRect = self.rect()
+        self.width, self.height = max(width, self.width), max(height, self.height)
+
+        # strokes near the old edges may have painted outside of the canvas, that part of the edge tiles becomes background
+        for key in list(self.tiles):
+            tileRect = self.tileRect(key)
+            if oldRect.contains(tileRect):
+                continue
+            outside = QRegion(tileRect).subtracted(QRegion(oldRect)).translated(-tileRect.topLeft())
+            tile = self.tiles[key]
+            if not self.strayPixels(tile, outside):
+                continue  # nothing was painted past the old edge, the tile stays as it is
+            packed = tile.format() == QImage.Format_Indexed8
+            # a new image, the stored tile may be shared with the undo history until setTile replaces it
+            tile = tile.convertToFormat(self.paintFormat) if packed else QImage(tile)
+            tilePainter = QPainter(tile)
+            tilePainter.setClipRegion(outside)
+            tilePainter.fillRect(tile.rect(), self.background)
+            tilePainter.end()
+            # through setTile, so the history, the composite and the mipmaps learn about the change
+            self.setTile(key, self.packed(tile) if packed else tile)
+
+    def strayPixels(self, tile, region):
+        """Returns True if any pixel of the tile inside the region (in tile coordinates) differs from the background"""
+        for rect in region.rects():
+            pixels, blank = tile.copy(rect), self.blankTile.copy(rect)
+            if pixels.format() != blank.format():  # an unpacked Indexed8 tile
+                pixels, blank = pixels.convertToFormat(self.paintFormat), blank.convertToFormat(self.paintFormat)
+            if pixels != blank:
+                return True
+        return False
+
+    def paint(self, qpainter, rect):
+        """Draws the given canvas area with a QPainter, blank tiles are filled with the background colour"""
+        for key in self.tileKeys(rect):
+            tileRect = self.tileRect(key)
+            area = tileRect.intersected(rect)
+            tile = self.tiles.get(key)
+            if tile is None:
+                qpainter.fillRect(area, self.background)
+            else:
+                qpainter.drawImage(area, tile, area.translated(-tileRect.topLeft()))
+
+    def toImage(self, rect=None):
+        """Flattens the tiles, or only the area of the canvas rectangle, into a single QImage.
+        Indexed8 canvases return an image in the paint format"""
+        rect = self.rect() if rect is None else rect.intersected(self.rect())
+        image = QImage(rect.size(), self.paintFormat)
+        image.fill(self.background)
+        imagePainter = QPainter(image)
+        imagePainter.setCompositionMode(QPainter.CompositionMode_Source)
+        imagePainter.translate(-rect.topLeft())
+        keys = self.tiles if rect == self.rect() else [key for key in self.tileKeys(rect) if key in self.tiles]
+        for key in keys:
+            imagePainter.drawImage(self.tileRect(key).topLeft(), self.tiles[key])
+        imagePainter.end()
+        return image
@@ -0,0 +1,20 @@
+"""
+The modules live in the code directory and import each other by name, as when PaintingApplication.py is run from there.
+Qt runs on the offscreen platform, so the tests need no display server.
+"""
+import os
+import sys
+
+import pytest
+
+CODE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "code")
+sys.path.insert(0, CODE)
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+from PyQt5.QtWidgets import QApplication  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def app():
+    """The QApplication a Painter widget needs"""
+    return QApplication.instance() or QApplication([])
@@ -0,0 +1,40 @@
+from PyQt5.QtGui import QColor, QImage
+from PyQt5.QtCore import Qt
+
+from TiledCanvas import TiledCanvas
+from AutosaveJournal import AutosaveJournal, STATE_WRITING
+
+
+def newJournal(tmp_path):
+    canvas = TiledCanvas(600, 400, QImage.Format_RGB32, Qt.white)
+    canvas.tileForWrite((1, 1)).fill(QColor("red"))
+    canvas.touch([(1, 1)])
+    journal = AutosaveJournal(str(tmp_path / "autosave.journal"))
+    assert journal.acquire()
+    journal.reset(canvas)
+    return journal, canvas
+
+
+def test_checkpoint_and_recover(app, tmp_path):
+    journal, canvas = newJournal(tmp_path)
+    canvas.tileForWrite((0, 0)).fill(QColor("blue"))
+    canvas.touch([(0, 0)])
+    assert journal.checkpoint(canvas) == 1
+    assert journal.checkpoint(canvas) == 0  # nothing changed since
+
+    assert not journal.interrupted()
+    recovered = journal.recover()
+    assert recovered.toImage() == canvas.toImage()
+    journal.discard()
+    assert not journal.exists()
+
+
+def test_interrupted_checkpoint_is_not_recovered_silently(app, tmp_path):
+    journal, canvas = newJournal(tmp_path)
+    journal.setState(STATE_WRITING)  # as if the application crashed in the middle of a checkpoint
+    journal.map.flush()
+
+    assert journal.interrupted()
+    assert journal.recover() is None
+    assert journal.recover(allowInterrupted=True).toImage() == canvas.toImage()
+    journal.discard()
@@ -0,0 +1,53 @@
+import json
+import os
+
+import pytest
+from PyQt5.QtGui import QColor, QImage
+
+import Batch
+
+
+def writeScript(tmp_path, script):
+    path = tmp_path / "script.json"
+    path.write_text(json.dumps(script))
+    return str(path)
+
+
+def test_script_is_a_list_of_known_operations(tmp_path):
+    operations = [{"op": "scale", "factor": 0.5}]
+    assert Batch.loadScript(writeScript(tmp_path, operations)) == operations
+    assert Batch.loadScript(writeScript(tmp_path, {"operations": operations})) == operations
+    for script in (["x"], "scale", [{"op": "explode"}], [{"op": "filter", "name": "Nope"}]):
+        with pytest.raises(Batch.BatchError):
+            Batch.loadScript(writeScript(tmp_path, script))
+
+
+def test_invalid_script_is_a_usage_error(tmp_path, capsys):
+    assert Batch.main([writeScript(tmp_path, ["x"]), "image.png", "-o", str(tmp_path / "out")]) == 2
+    assert "Invalid script" in capsys.readouterr().err
+
+
+def test_inputs_with_the_same_name_conflict(tmp_path, capsys):
+    script = writeScript(tmp_path, [])
+    assert Batch.outputPaths(["a/img.png", "b/photo.png"], "out", "jpg") == \
+        [os.path.join("out", "img.jpg"), os.path.join("out", "photo.jpg")]
+    with pytest.raises(Batch.BatchError):
+        Batch.outputPaths(["a/img.png", "b/img.png"], "out")
+    assert Batch.main([script, "a/img.png", "b/img.png", "-o", str(tmp_path / "out")]) == 2
+    assert "Conflicting outputs" in capsys.readouterr().err
+
+
+def test_process_image_applies_the_script(app, tmp_path):
+    image = QImage(40, 20, QImage.Format_RGB32)
+    image.fill(QColor("white"))
+    inputPath, output = str(tmp_path / "in.png"), str(tmp_path / "out.png")
+    image.save(inputPath)
+    Batch.initWorker(writeScript(tmp_path, [
+        {"op": "stroke", "points": [[0, 0.5], [1, 0.5]], "width": 0.1, "color": "red", "relative": True},
+        {"op": "scale", "factor": 2}]))
+
+    assert Batch.processImage(inputPath, output) == (inputPath, 40 * 20 / 1e6, None)
+    result = QImage(output)
+    assert (result.width(), result.height()) == (80, 40)
+    assert result.pixelColor(40, 20) == QColor("red")
+    assert Batch.processImage(str(tmp_path / "missing.png"), output)[2].startswith("could not open")
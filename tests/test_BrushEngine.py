@@ -0,0 +1,68 @@
+import pytest
+from PyQt5.QtGui import QColor
+from PyQt5.QtCore import QPoint
+
+from BrushEngine import DabBrush, DabCache
+from Painter import Painter, SOFT_BRUSH_TOOL
+
+
+def test_nearby_parameters_share_a_cached_dab(app):
+    cache = DabCache()
+    first = cache.dab("red", 10, 0.5, 1.0, 0, 1.0)
+    assert cache.dab("red", 10.1, 0.51, 1.0, 180, 1.0) is first  # below the quantization steps, rotation wraps
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert cache.dab("red", 12, 0.5, 1.0, 0, 1.0) is not first
+    assert cache.misses == 2
+
+
+def test_least_recently_used_dabs_are_dropped(app):
+    cache = DabCache(capacity=2)
+    small = cache.dab("red", 4, 0.5, 1.0, 0, 1.0)
+    cache.dab("red", 6, 0.5, 1.0, 0, 1.0)
+    cache.dab("red", 4, 0.5, 1.0, 0, 1.0)  # small is used again
+    cache.dab("red", 8, 0.5, 1.0, 0, 1.0)
+    assert len(cache.dabs) == 2
+    assert cache.dab("red", 4, 0.5, 1.0, 0, 1.0) is small
+
+
+def test_rendered_dab_size_and_softness(app):
+    key = DabCache().key("blue", 20, 0.0, 1.0, 0, 1.0)
+    dab = DabCache.render(key)
+    assert dab.width() == dab.height() == 22  # the diameter and a pixel of antialiasing on every side
+    centre, edge = dab.pixelColor(11, 11), dab.pixelColor(11, 2)
+    assert centre.alpha() > edge.alpha() > 0
+    assert dab.pixelColor(0, 0).alpha() == 0
+
+
+@pytest.mark.parametrize("key, valid", [
+    (DabCache().key("red", 10, 0.5, 1.0, 30, 0.5), True),
+    ((0, 0, 0, 0, 0), False),
+    ((0, 10000, 0, 0, 0, 1), False),  # wider than any brush
+    ((0, 10, 0, 0, 0, 0), False),
+    ((0, 10, 0.5, 0, 0, 1), False),
+])
+def test_valid_key(key, valid):
+    assert DabCache.validKey(key) == valid
+
+
+def test_pressure_scales_the_dabs():
+    brush = DabBrush(minimumSize=0.5, pressureOpacity=True)
+    assert brush.dabParameters(20, 1.0) == (20, 1.0, 0.0, 1.0)
+    diameter, opacity, _, _ = brush.dabParameters(20, 0.5)
+    assert (diameter, opacity) == (15, 0.5)
+    _, _, rotation, roundness = brush.dabParameters(20, 1.0, xTilt=0, yTilt=30)
+    assert rotation == 90 and roundness < 1
+
+
+def test_soft_brush_stroke_stamps_spaced_dabs(app):
+    painter = Painter()
+    painter.strokeFilter = None
+    painter.tool, painter.brushColor, painter.brushWidth = SOFT_BRUSH_TOOL, QColor("black"), 10
+    stamped = []
+    painter.dabListeners.append(lambda canvas, key, topLeft: stamped.append(topLeft))
+    painter.beginStroke(QPoint(20, 20))
+    painter.stroke.addPoint(QPoint(120, 20))
+    painter.endStroke()
+    spacing = painter.dabBrush.spacing * 10
+    assert len(stamped) == 1 + int(100 / spacing)
+    assert painter.image.pixelColor(70, 20).alpha() == 255 and painter.image.pixelColor(70, 20) != QColor("white")
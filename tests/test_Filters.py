@@ -0,0 +1,61 @@
+import pytest
+from PyQt5.QtGui import QColor, QImage
+from PyQt5.QtCore import QRect, Qt
+
+pytest.importorskip("numpy")  # the filters are disabled without numpy
+
+import Filters  # noqa: E402
+from TiledCanvas import TiledCanvas  # noqa: E402
+from test_TiledCanvas import paintRect  # noqa: E402
+
+
+def noiseImage(width=300, height=600):
+    """An image of pseudo random colours, tall enough to be split into several bands"""
+    image = QImage(width, height, QImage.Format_RGB32)
+    for y in range(0, height, 7):
+        for x in range(0, width, 5):
+            image.setPixelColor(x, y, QColor((x * 37) % 256, (y * 11) % 256, (x + y) % 256))
+    return image
+
+
+def test_parallel_bands_match_a_single_pass(app):
+    image = noiseImage()
+    blur = Filters.FILTERS["Blur"]
+    parallel = Filters.filterImage(image, blur, [4])
+    assert parallel == Filters.filterImage(image, blur, [4], parallel=False)
+    assert parallel != image and parallel.format() == image.format()
+
+
+def test_invert_and_threshold(app):
+    image = QImage(10, 10, QImage.Format_RGB32)
+    image.fill(QColor(10, 100, 200))
+    assert Filters.filterImage(image, Filters.FILTERS["Invert"], []).pixelColor(0, 0) == QColor(245, 155, 55)
+    thresholded = Filters.filterImage(image, Filters.FILTERS["Threshold"], [128])
+    assert thresholded.pixelColor(0, 0) in (QColor("black"), QColor("white"))
+
+
+def test_preview_scales_distances(app):
+    proxy, scale = Filters.previewProxy(noiseImage(1280, 640))
+    assert (proxy.width(), proxy.height()) == (Filters.PREVIEW_SIZE, Filters.PREVIEW_SIZE // 2)
+    assert scale == 0.25
+    assert Filters.FILTERS["Blur"].scaled([8], scale) == [2.0]
+    assert Filters.FILTERS["Sharpen"].scaled([100], scale) == [100]
+
+
+def test_apply_only_writes_changed_tiles(app):
+    canvas = TiledCanvas(600, 400, QImage.Format_RGB32, Qt.white)
+    paintRect(canvas, QRect(300, 10, 20, 20), "red")
+    image = canvas.toImage()
+    image.setPixelColor(310, 15, QColor("blue"))
+    assert Filters.applyImage(canvas, image) == canvas.tileRect((1, 0))
+    assert list(canvas.tiles) == [(1, 0)]
+    assert canvas.toImage().pixelColor(310, 15) == QColor("blue")
+
+
+def test_task_reports_failures(app):
+    task = Filters.FilterTask(noiseImage(20, 20), Filters.Filter("Broken", lambda pixels: 1 / 0), [])
+    failures, results = [], []
+    task.signals.failed.connect(failures.append, Qt.DirectConnection)
+    task.signals.finished.connect(lambda image, seconds: results.append(image), Qt.DirectConnection)
+    task.run()
+    assert failures == ["division by zero"] and results == []
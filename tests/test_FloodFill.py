@@ -0,0 +1,105 @@
+import pytest
+from PyQt5.QtGui import QColor, QImage, QPainter
+from PyQt5.QtCore import QPoint, QRect, Qt
+
+pytest.importorskip("numpy")  # the fill is disabled without numpy
+
+import FloodFill  # noqa: E402
+from TiledCanvas import TiledCanvas  # noqa: E402
+
+
+def gradientImage():
+    """Four vertical bands of slightly different reds, a black wall and a white area behind it"""
+    image = QImage(100, 40, QImage.Format_RGB32)
+    image.fill(Qt.white)
+    for band, red in enumerate((250, 240, 230, 200)):
+        painter = QPainter(image)
+        painter.fillRect(QRect(band * 10, 0, 10, 40), QColor(red, 0, 0))
+        painter.end()
+    painter = QPainter(image)
+    painter.fillRect(QRect(40, 0, 5, 40), Qt.black)
+    painter.end()
+    return image
+
+
+def test_exact_fill_stops_at_other_colours(app):
+    image = gradientImage()
+    runs = FloodFill.fillImage(image, QPoint(2, 2), QColor("blue"))
+    assert sorted(runs) == [(row, 0, 10) for row in range(40)]
+    assert image.pixelColor(5, 5) == QColor("blue")
+    assert image.pixelColor(15, 5) == QColor(240, 0, 0)
+
+
+def test_tolerance_fills_similar_colours(app):
+    image = gradientImage()
+    FloodFill.fillImage(image, QPoint(2, 2), QColor("blue"), tolerance=25)
+    assert image.pixelColor(25, 5) == QColor("blue")  # 230 is within 25 of 250
+    assert image.pixelColor(35, 5) == QColor(200, 0, 0)  # 200 is not
+    assert image.pixelColor(60, 5) == QColor("white")  # never reached through the wall
+
+
+def test_tolerance_fills_around_a_seed_of_the_fill_colour(app):
+    image = gradientImage()
+    assert FloodFill.fillImage(image, QPoint(2, 2), QColor(250, 0, 0)) == []  # nothing to change
+    FloodFill.fillImage(image, QPoint(2, 2), QColor(250, 0, 0), tolerance=15)
+    assert image.pixelColor(15, 5) == QColor(250, 0, 0)
+
+
+def test_fill_outside_of_the_image(app):
+    assert FloodFill.fillImage(gradientImage(), QPoint(-1, 5), QColor("blue"), 10) == []
+
+
+def test_fill_canvas_writes_only_touched_tiles(app):
+    canvas = TiledCanvas(600, 400, QImage.Format_RGB32, Qt.white)
+    tile = canvas.tileForWrite((0, 0))
+    painter = QPainter(tile)
+    painter.fillRect(QRect(0, 0, 50, 50), QColor(10, 10, 10))
+    painter.end()
+    canvas.touch([(0, 0)])
+
+    changed = FloodFill.floodFill(canvas, QPoint(10, 10), QColor("red"), tolerance=20)
+    assert changed == QRect(0, 0, 50, 50)
+    assert list(canvas.tiles) == [(0, 0)]
+    assert canvas.toImage().pixelColor(49, 49) == QColor("red")
+
+
+def test_grayscale_fill(app):
+    image = QImage(20, 20, QImage.Format_Grayscale8)
+    image.fill(QColor(100, 100, 100))
+    image.setPixelColor(5, 5, QColor(110, 110, 110))
+    FloodFill.fillImage(image, QPoint(0, 0), QColor("white"), tolerance=12)
+    assert image.pixelColor(5, 5) == QColor("white")
+
+
+def test_fill_canvas_only_reads_the_tiles_around_the_region(app):
+    canvas = TiledCanvas(2048, 2048, QImage.Format_RGB32, Qt.white)
+    tile = canvas.tileForWrite((1, 1))
+    painter = QPainter(tile)
+    painter.setPen(Qt.black)
+    painter.drawRect(QRect(20, 20, 100, 100))  # a closed box inside one tile
+    painter.end()
+    canvas.touch([(1, 1)])
+    read = []
+    toImage = canvas.toImage
+    canvas.toImage = lambda rect=None: read.append(rect) or toImage(rect)
+
+    changed = FloodFill.floodFill(canvas, QPoint(300, 300), QColor("red"))
+    assert changed == QRect(277, 277, 99, 99)
+    assert read == [canvas.tileRect((1, 1))]
+    assert list(canvas.tiles) == [(1, 1)]
+
+
+def test_fill_canvas_grows_over_the_tiles_the_region_reaches(app):
+    canvas = TiledCanvas(1000, 700, QImage.Format_RGB32, Qt.white)
+    for key, rect in (((1, 0), QRect(0, 0, 5, 256)), ((1, 1), QRect(0, 0, 5, 100))):
+        tile = canvas.tileForWrite(key)
+        painter = QPainter(tile)
+        painter.fillRect(rect, Qt.black)  # a wall down from the top which the fill has to go around
+        painter.end()
+        canvas.touch([key])
+    expected = canvas.toImage()
+    FloodFill.fillImage(expected, QPoint(10, 10), QColor("blue"), 5)
+
+    changed = FloodFill.floodFill(canvas, QPoint(10, 10), QColor("blue"), 5)
+    assert canvas.toImage() == expected
+    assert changed == QRect(0, 0, 1000, 700)
@@ -0,0 +1,51 @@
+from PyQt5.QtGui import QColor, QImage
+from PyQt5.QtCore import QRect, Qt
+
+from TiledCanvas import TiledCanvas
+from History import History
+from test_TiledCanvas import paintRect
+
+
+def newCanvas(imageFormat=QImage.Format_RGB32, **options):
+    """Returns a canvas whose tile writes are recorded by a new history"""
+    history = History(**options)
+    canvas = TiledCanvas(600, 400, imageFormat, Qt.white)
+    canvas.writeListeners.append(history.tileWillChange)
+    return canvas, history
+
+
+def test_write_undo_redo_round_trip(app):
+    for compress in (True, False):
+        canvas, history = newCanvas(compress=compress)
+        paintRect(canvas, QRect(10, 10, 100, 100), "red", history)
+        first = canvas.toImage()
+        paintRect(canvas, QRect(200, 150, 300, 200), "blue", history)  # crosses four tiles
+        second = canvas.toImage()
+
+        assert {canvas for canvas, _ in history.undo()} == {canvas}
+        assert canvas.toImage() == first
+        history.undo()
+        assert canvas.tiles == {}  # the first step started on blank tiles
+        assert canvas.toImage().pixelColor(50, 50) == QColor("white")
+
+        history.redo()
+        assert canvas.toImage() == first
+        history.redo()
+        assert canvas.toImage() == second
+
+
+def test_new_step_clears_redo(app):
+    canvas, history = newCanvas()
+    paintRect(canvas, QRect(0, 0, 50, 50), "red", history)
+    history.undo()
+    paintRect(canvas, QRect(0, 0, 50, 50), "green", history)
+    assert history.redo() == []
+    assert canvas.toImage().pixelColor(10, 10) == QColor("green")
+
+
+def test_memory_budget_drops_oldest_steps(app):
+    canvas, history = newCanvas(memoryBudget=3 * 256 * 256 * 4, compress=False)
+    for color in ("red", "green", "blue", "yellow"):
+        paintRect(canvas, QRect(0, 0, 10, 10), color, history)
+    assert len(history.undoStack) < 4
+    assert history.memoryUsed <= history.memoryBudget
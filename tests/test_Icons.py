@@ -0,0 +1,13 @@
+import Icons
+
+
+def test_icons_are_created_once(app):
+    assert Icons.icon("paint-brush") is Icons.icon("paint-brush")
+    assert not Icons.icon("paint-brush").isNull()
+
+
+def test_missing_icons_are_empty_and_cached(app, monkeypatch):
+    missing = Icons.icon("no-such-icon")
+    assert missing.isNull()
+    monkeypatch.setattr(Icons, "iconFiles", lambda: {})  # the directory is not listed again
+    assert Icons.icon("no-such-icon") is missing
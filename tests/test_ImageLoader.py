@@ -0,0 +1,56 @@
+from PyQt5.QtGui import QColor, QImage
+from PyQt5.QtCore import QSize, Qt
+
+import pytest
+
+from ImageLoader import ImageLoadTask
+
+
+def runTask(task):
+    """Runs a task in the calling thread and returns the signals it emitted as (name, value) pairs"""
+    emitted = []
+    for name in ("progress", "preview", "finished", "failed"):
+        getattr(task.signals, name).connect(lambda value, name=name: emitted.append((name, value)), Qt.DirectConnection)
+    task.run()
+    return emitted
+
+
+@pytest.fixture
+def pngFile(tmp_path):
+    image = QImage(400, 300, QImage.Format_RGB32)
+    image.fill(QColor("blue"))
+    path = str(tmp_path / "blue.png")
+    image.save(path)
+    return path
+
+
+def test_loads_the_full_image_after_a_preview(app, pngFile):
+    emitted = runTask(ImageLoadTask(pngFile, None, None, QSize(100, 100)))
+    names = [name for name, _ in emitted]
+    assert names.index("preview") < names.index("finished")
+    assert dict(emitted)["preview"].size() == QSize(100, 75)
+    canvas = dict(emitted)["finished"]
+    assert (canvas.width, canvas.height) == (400, 300)
+    assert canvas.toImage().pixelColor(200, 150) == QColor("blue")
+    assert emitted[-2] == ("progress", 100)
+
+
+def test_unreadable_file_fails(app, tmp_path):
+    path = tmp_path / "broken.png"
+    path.write_bytes(b"not an image")
+    emitted = runTask(ImageLoadTask(str(path), None, None))
+    assert emitted[-1][0] == "failed" and "broken.png" in emitted[-1][1]
+
+
+def test_errors_while_tiling_are_reported(app, pngFile):
+    task = ImageLoadTask(pngFile, None, None)
+    task.tilesDone = lambda done, total: 1 / 0
+    emitted = runTask(task)
+    assert emitted[-1] == ("failed", "division by zero")
+
+
+def test_cancel_emits_nothing_more(app, pngFile):
+    task = ImageLoadTask(pngFile, None, None)
+    task.cancel()
+    emitted = runTask(task)
+    assert emitted == [("progress", 0)]
@@ -0,0 +1,43 @@
+from PyQt5.QtGui import QColor, QImage
+from PyQt5.QtCore import QRect, Qt
+
+from TiledCanvas import TiledCanvas
+from ImageSaver import ImageSaveTask
+from test_TiledCanvas import paintRect
+
+
+def runTask(task):
+    """Runs a task in the calling thread and returns the signals it emitted as (name, arguments) pairs"""
+    emitted = []
+    task.signals.finished.connect(lambda *arguments: emitted.append(("finished", arguments)), Qt.DirectConnection)
+    task.signals.failed.connect(lambda *arguments: emitted.append(("failed", arguments)), Qt.DirectConnection)
+    task.run()
+    return emitted
+
+
+def test_saves_the_canvas_as_it_was_when_queued(app, tmp_path):
+    canvas = TiledCanvas(300, 200, QImage.Format_RGB32, Qt.white)
+    paintRect(canvas, QRect(0, 0, 100, 100), "red")
+    path = str(tmp_path / "snapshot.png")
+    task = ImageSaveTask(canvas, path)
+    paintRect(canvas, QRect(0, 0, 100, 100), "blue")  # painting goes on while the file is written
+
+    assert runTask(task)[0][0] == "finished"
+    saved = QImage(path)
+    assert saved.size() == canvas.toImage().size()
+    assert saved.pixelColor(50, 50) == QColor("red")
+    assert canvas.toImage().pixelColor(50, 50) == QColor("blue")
+
+
+def test_compact_documents_are_written_compact(app, tmp_path):
+    canvas = TiledCanvas(64, 64, QImage.Format_Grayscale8, Qt.white)
+    path = str(tmp_path / "gray.png")
+    runTask(ImageSaveTask(canvas, path, imageFormat=QImage.Format_Grayscale8))
+    assert QImage(path).isGrayscale()
+
+
+def test_write_errors_are_reported(app, tmp_path):
+    canvas = TiledCanvas(64, 64, QImage.Format_RGB32, Qt.white)
+    path = str(tmp_path / "missing" / "image.png")
+    emitted = runTask(ImageSaveTask(canvas, path))
+    assert emitted[0][0] == "failed" and emitted[0][1][0] == path
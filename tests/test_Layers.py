@@ -0,0 +1,59 @@
+from PyQt5.QtGui import QColor, QImage
+from PyQt5.QtCore import QRect, Qt
+
+from TiledCanvas import TiledCanvas
+from Layers import LayerStack
+from test_TiledCanvas import paintRect
+
+
+def newStack():
+    return LayerStack(TiledCanvas(600, 400, QImage.Format_RGB32, Qt.white))
+
+
+def test_layers_blend_over_the_background(app):
+    stack = newStack()
+    paintRect(stack.background().canvas, QRect(0, 0, 100, 100), "red")
+    layer = stack.addLayer()
+    assert stack.active() is layer
+    paintRect(layer.canvas, QRect(50, 50, 100, 100), "blue")
+
+    image = stack.flatten().toImage()
+    assert image.pixelColor(10, 10) == QColor("red")
+    assert image.pixelColor(75, 75) == QColor("blue")
+    assert image.pixelColor(300, 300) == QColor("white")
+
+    stack.setOpacity(1, 0.0)
+    assert stack.flatten().toImage().pixelColor(75, 75) == QColor("red")
+    stack.setOpacity(1, 1.0)
+    stack.setVisible(1, False)
+    assert stack.flatten().toImage().pixelColor(75, 75) == QColor("red")
+
+
+def test_only_the_changed_area_is_blended_again(app):
+    stack = newStack()
+    layer = stack.addLayer()
+    stack.flatten()
+    assert stack.composite.tiles == {}  # empty layers keep the composite blank
+
+    paintRect(layer.canvas, QRect(300, 10, 20, 20), "green")
+    assert stack.dirty == {(1, 0): QRect(300, 10, 20, 20)}
+    assert stack.updateComposite() == QRect(300, 10, 20, 20)
+    assert list(stack.composite.tiles) == [(1, 0)]
+    assert stack.updateComposite() == QRect()
+
+
+def test_blend_modes_and_layer_order(app):
+    stack = newStack()
+    paintRect(stack.background().canvas, QRect(0, 0, 50, 50), QColor(200, 200, 200))
+    layer = stack.addLayer()
+    paintRect(layer.canvas, QRect(0, 0, 50, 50), QColor(100, 100, 100))
+    stack.setBlendMode(1, "Multiply")
+    assert stack.flatten().toImage().pixelColor(10, 10) == QColor(78, 78, 78)
+
+    top = stack.addLayer()
+    paintRect(top.canvas, QRect(0, 0, 50, 50), "red")
+    stack.moveLayer(2, -1)
+    assert stack.layers[1] is top
+    assert stack.flatten().toImage().pixelColor(10, 10) == QColor(100, 0, 0)  # the grey layer now multiplies the red one
+    stack.removeLayer(0)  # the background stays
+    assert len(stack.layers) == 3
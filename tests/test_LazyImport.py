@@ -0,0 +1,17 @@
+import sys
+
+from LazyImport import lazyImport
+
+
+def test_module_is_imported_by_the_first_attribute():
+    sys.modules.pop("colorsys", None)
+    colorsys = lazyImport("colorsys")
+    assert colorsys.available()
+    assert "colorsys" not in sys.modules  # checking the availability does not import
+    assert colorsys.rgb_to_hsv(1, 0, 0) == (0, 1, 1)
+    assert "colorsys" in sys.modules
+    assert "rgb_to_hsv" in vars(colorsys)  # later lookups do not go through __getattr__
+
+
+def test_missing_module_is_not_available():
+    assert not lazyImport("no_such_module_here").available()
@@ -0,0 +1,31 @@
+from PyQt5.QtGui import QColor, QImage
+from PyQt5.QtCore import QRect, Qt
+
+from TiledCanvas import TiledCanvas
+from MipmapCache import MipmapCache
+from test_TiledCanvas import paintRect
+
+
+def test_levels_are_built_from_the_canvas_tiles(app):
+    canvas = TiledCanvas(1024, 1024, QImage.Format_RGB32, Qt.white)
+    mipmaps = MipmapCache(canvas)
+    assert mipmaps.maxLevel() == 2
+    assert mipmaps.levelFor(1.0) == 0 and mipmaps.levelFor(0.5) == 1 and mipmaps.levelFor(1 / 64) == 2
+    assert mipmaps.tile(1, 0, 0) is None  # every canvas tile below it is blank
+
+    paintRect(canvas, QRect(0, 0, 512, 512), "red")
+    level = mipmaps.tile(1, 0, 0)
+    assert level.pixelColor(10, 10) == QColor("red")
+    assert level.size() == canvas.blankTile.size()
+
+
+def test_changes_only_drop_the_levels_above_them(app):
+    canvas = TiledCanvas(1024, 1024, QImage.Format_RGB32, Qt.white)
+    mipmaps = MipmapCache(canvas)
+    mipmaps.build()
+    assert (1, 1, 1) in mipmaps.levels and (2, 0, 0) in mipmaps.levels
+
+    paintRect(canvas, QRect(10, 10, 20, 20), "blue")
+    assert (1, 0, 0) not in mipmaps.levels and (2, 0, 0) not in mipmaps.levels
+    assert (1, 1, 1) in mipmaps.levels
+    assert mipmaps.tile(2, 0, 0).pixelColor(4, 4) != QColor("white")
@@ -0,0 +1,83 @@
+import pytest
+from PyQt5.QtGui import QColor, QImage, QPainter, QRegion
+from PyQt5.QtCore import QPoint, QRect, Qt
+
+from Painter import Painter, MAX_ZOOM
+
+
+@pytest.fixture
+def painter(app):
+    painter = Painter()
+    painter.resize(600, 400)
+    painter.strokeFilter = None  # every point is drawn as it is
+    return painter
+
+
+def masked(image, region):
+    """Returns a copy of an image with the region painted over"""
+    image = image.copy()
+    imagePainter = QPainter(image)
+    imagePainter.setClipRegion(region)
+    imagePainter.fillRect(image.rect(), Qt.magenta)
+    imagePainter.end()
+    return image
+
+
+@pytest.mark.parametrize("cap, join, width", [(Qt.FlatCap, Qt.MiterJoin, 25), (Qt.SquareCap, Qt.BevelJoin, 9),
+                                              (Qt.RoundCap, Qt.RoundJoin, 1)])
+def test_dirty_rects_cover_the_stroke(painter, cap, join, width):
+    painter.brushCap, painter.brushJoin, painter.brushWidth = cap, join, width
+    before = painter.image
+    points = [QPoint(30, 30), QPoint(200, 40), QPoint(60, 120), QPoint(300, 300), QPoint(310, 20)]
+
+    painter.beginStroke(points[0])
+    dirty = QRegion(painter.segmentRect(points[0], points[0]))
+    for point in points[1:]:
+        dirty += QRegion(painter.stroke.addPoint(point))
+    flushed = painter.stroke.end()
+    painter.stroke = None
+    painter.endStep()
+
+    assert dirty.contains(flushed)
+    after = painter.image
+    assert after != before
+    assert masked(after, dirty) == masked(before, dirty)  # nothing changed outside of the dirty rectangles
+
+
+def test_updates_are_mapped_through_the_view(painter):
+    painter.zoom, painter.pan = 2.0, QPoint(10, 20)
+    assert painter.mapFromCanvas(QRect(5, 5, 10, 10)).contains(QRect(20, 30, 20, 20))
+    assert painter.mapFromCanvas(QRect()) == QRect()
+
+
+def test_zoom_keeps_the_anchor_in_place(painter):
+    anchor = QPoint(150, 100)
+    before = painter.mapToCanvas(anchor)
+    painter.zoomBy(2.0, anchor)
+    assert painter.zoom == 2.0
+    assert painter.mapToCanvas(anchor) == before
+    painter.zoomBy(1000)
+    assert painter.zoom == MAX_ZOOM
+
+
+def test_fitting_the_view_never_resamples_the_canvas(painter):
+    painter.brushWidth = 5
+    painter.beginStroke(QPoint(20, 20))
+    painter.stroke.addPoint(QPoint(100, 20))
+    painter.endStroke()
+    painter.resize(300, 200)
+    painter.fitCanvas()  # a hidden widget gets no resize event
+    assert (painter.layers.width, painter.layers.height) == (600, 400)
+    assert painter.zoom == 0.5
+    assert painter.image.pixelColor(60, 20) == painter.brushColor
+
+
+def test_pixel_format_conversion_keeps_the_painting(painter):
+    painter.brushColor, painter.brushWidth = QColor("black"), 9
+    painter.beginStroke(QPoint(20, 20))
+    painter.stroke.addPoint(QPoint(200, 20))
+    painter.endStroke()
+    painter.setPixelFormat(QImage.Format_Grayscale8)
+    assert painter.pixelFormat() == QImage.Format_Grayscale8
+    assert painter.image.pixelColor(100, 20) == QColor("black")
+    assert not painter.history.canUndo()  # converting drops the history
@@ -0,0 +1,40 @@
+import pytest
+
+from PaintingApplication import PaintingApplication
+
+
+@pytest.fixture
+def window(app):
+    window = PaintingApplication()
+    yield window
+    window.deleteLater()
+
+
+def menu(window, title):
+    return next(action.menu() for action in window.menuBar().actions() if action.text().strip() == title)
+
+
+def test_menus_are_filled_when_first_opened(window):
+    for title, first in (("Filter", "Blur..."), ("Session", "Host Session")):
+        deferred = menu(window, title)
+        assert deferred.actions() == []
+        deferred.aboutToShow.emit()
+        actions = deferred.actions()
+        assert actions[0].text() == first
+        deferred.aboutToShow.emit()
+        assert deferred.actions() == actions  # added only once
+
+
+def test_pixel_format_menu_checks_the_current_format(window):
+    assert window.pixelFormatMenu.actions() == []
+    window.pixelFormatMenu.aboutToShow.emit()
+    checked = [action for action in window.pixelFormatMenu.actions() if action.isChecked()]
+    assert [action.data() for action in checked] == [window.painter.pixelFormat()]
+
+
+def test_panels_are_built_when_expanded(window):
+    assert window.smoothCurves is None
+    window.strokeGroup.setChecked(True)
+    assert window.smoothCurves is not None and not window.smoothCurves.isChecked()
+    window.smoothCurves.setChecked(True)
+    assert window.painter.strokeFilter.smooth
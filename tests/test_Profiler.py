@@ -0,0 +1,54 @@
+import json
+
+from Profiler import Profiler
+
+
+def test_disabled_profiler_only_runs_the_function():
+    profiler = Profiler()
+    calls = []
+    work = profiler.timed("work")(lambda value: calls.append(value) or value * 2)
+    assert work(3) == 6 and calls == [3]
+    assert profiler.samples == {} and len(profiler.trace) == 0
+
+
+def test_hooks_see_every_run_and_can_remove_themselves():
+    profiler = Profiler()
+    seen = []
+
+    def hook(name, seconds):
+        seen.append(name)
+        if len(seen) == 2:
+            profiler.removeHook(name, hook)
+
+    profiler.addHook("work", hook)
+    work = profiler.timed("work")(lambda: None)
+    for _ in range(3):
+        work()
+    assert seen == ["work", "work"]
+    assert not profiler.active("work")
+
+
+def test_samples_statistics_and_trace(tmp_path):
+    profiler = Profiler()
+    profiler.enabled = True
+    for seconds in (0.001, 0.002, 0.003, 0.004):
+        profiler.record("frame", 0.0, seconds)
+    statistics = profiler.statistics("frame")
+    assert statistics["count"] == 4 and statistics["max"] == 4.0 and statistics["p50"] == 3.0
+    assert profiler.statistics("other") is None
+
+    path = str(tmp_path / "trace.json")
+    assert profiler.saveTrace(path) == 4
+    with open(path) as f:
+        trace = json.load(f)
+    assert [event["name"] for event in trace["traceEvents"]] == ["frame"] * 4
+    assert trace["statistics"]["frame"]["count"] == 4
+
+
+def test_attached_profile_records_the_calls():
+    profiler = Profiler()
+    profile = profiler.attachProfile("work")
+    work = profiler.timed("work")(lambda: sum(range(100)))
+    work()
+    assert profiler.detachProfile("work") is profile
+    assert profile.getstats()
@@ -0,0 +1,147 @@
+import os
+
+import pytest
+from PyQt5.QtGui import QColor, QImage
+from PyQt5.QtCore import QPoint
+from PyQt5.QtWidgets import QMessageBox
+
+from Painter import Painter
+from PaintingApplication import PaintingApplication
+from ProjectFile import MAGIC, LazyTiles, ProjectError, ProjectFile, isProject, saveProject
+
+
+def drawStroke(painter, points, color="red", width=9):
+    painter.brushColor = QColor(color)
+    painter.brushWidth = width
+    painter.beginStroke(QPoint(*points[0]))
+    for point in points[1:]:
+        painter.stroke.addPoint(QPoint(*point))
+    painter.endStroke()
+
+
+@pytest.fixture
+def painter(app):
+    painter = Painter()
+    painter.resize(600, 400)
+    drawStroke(painter, [(10, 10), (100, 80), (300, 300)])
+    painter.layers.addLayer()
+    drawStroke(painter, [(300, 10), (50, 300)], "green", 13)
+    return painter
+
+
+def reopen(app, path):
+    painter = Painter()
+    painter.openProject(ProjectFile(path))
+    return painter
+
+
+def test_save_and_reopen(app, painter, tmp_path):
+    path = str(tmp_path / "painting.pqp")
+    saveProject(painter, path)
+    assert isProject(path)
+
+    opened = reopen(app, path)
+    background = opened.layers.background().canvas
+    assert isinstance(background.tiles, LazyTiles)
+    assert background.tiles.pending  # nothing is decompressed before it is read
+    assert len(opened.layers.layers) == 2
+    assert opened.brushWidth == 13
+    assert opened.image == painter.image
+
+
+def test_reopened_history_undoes_and_redoes(app, painter, tmp_path):
+    path = str(tmp_path / "painting.pqp")
+    painted = painter.image
+    painter.undo()
+    undone = painter.image
+    painter.redo()
+    saveProject(painter, path)
+
+    opened = reopen(app, path)
+    assert len(opened.history.undoStack) == 2
+    opened.undo()
+    assert opened.image == undone
+    opened.redo()
+    assert opened.image == painted
+
+
+def test_incremental_save_appends_only_the_changes(app, painter, tmp_path):
+    path = str(tmp_path / "painting.pqp")
+    project = saveProject(painter, path)
+    size = os.path.getsize(path)
+
+    painter.layers.activeIndex = 1
+    drawStroke(painter, [(400, 300), (420, 320)], "blue", 3)
+    project = saveProject(painter, path, project)
+    appended = os.path.getsize(path) - size
+    assert 0 < appended < size  # one tile, its history state and a new index
+    assert len(project.index["history"]["undo"]) == 3
+
+    opened = reopen(app, path)
+    assert opened.image == painter.image
+    opened.undo()
+    painter.undo()
+    assert opened.image == painter.image
+
+
+def test_indexed_project(app, painter, tmp_path):
+    path = str(tmp_path / "indexed.pqp")
+    painter.setPixelFormat(QImage.Format_Indexed8)
+    drawStroke(painter, [(5, 5), (80, 90)])
+    saveProject(painter, path)
+
+    opened = reopen(app, path)
+    assert opened.pixelFormat() == QImage.Format_Indexed8
+    assert opened.image == painter.image
+
+
+def test_not_a_project(app, tmp_path):
+    path = tmp_path / "image.pqp"
+    path.write_bytes(b"\x89PNG" + bytes(100))
+    assert not isProject(str(path))
+    with pytest.raises(ProjectError):
+        ProjectFile(str(path))
+
+    path.write_bytes(MAGIC)  # the header is cut short
+    with pytest.raises(ProjectError):
+        ProjectFile(str(path))
+
+
+def test_damaged_index_leaves_the_painting_as_it_was(app, painter, tmp_path):
+    path = str(tmp_path / "painting.pqp")
+    saveProject(painter, path).close()
+    opened = Painter()
+    layers, history, brushWidth = opened.layers, opened.history, opened.brushWidth
+
+    for damage, error in ((lambda index: index["history"]["undo"].append([[5, 0, 0, None, None]]), IndexError),
+                          (lambda index: index["brush"].update(dabBrush={"bristles": 3}), TypeError)):
+        project = ProjectFile(path)
+        damage(project.index)
+        with pytest.raises(error):
+            opened.openProject(project)
+        project.close()
+        assert opened.layers is layers and opened.history is history and opened.brushWidth == brushWidth
+
+
+def test_replaced_projects_are_closed(app, painter, tmp_path, monkeypatch):
+    warnings = []
+    monkeypatch.setattr(QMessageBox, "warning", lambda *arguments: warnings.append(arguments))
+    monkeypatch.setattr(QMessageBox, "question", lambda *arguments: QMessageBox.Yes)
+    path = str(tmp_path / "painting.pqp")
+    saveProject(painter, path).close()
+    window = PaintingApplication()
+
+    window.openProject(path)
+    first = window.project
+    window.openProject(path)
+    assert first.map is None and window.project.map is not None
+
+    broken = tmp_path / "broken.pqp"
+    broken.write_bytes(MAGIC)
+    second = window.project
+    window.openProject(str(broken))
+    assert len(warnings) == 1 and window.project is second and second.map is not None
+
+    window.setPixelFormat(QImage.Format_Grayscale8)  # replaces the painting of the project
+    assert window.project is None and second.map is None
+    window.deleteLater()
@@ -0,0 +1,73 @@
+from PyQt5.QtGui import QColor, QImage, QPen
+from PyQt5.QtCore import QPoint
+
+import pytest
+
+from Painter import Painter
+from SessionClient import SessionClient
+from SessionProtocol import BATCH, SNAPSHOT, OP_POLYLINE, applyOp, compressTile, encodeTile, snapshotBody, \
+    stampClient
+from TiledCanvas import TiledCanvas
+
+
+def snapshot(canvas, sequenced):
+    """Returns the SNAPSHOT body of a canvas which includes the first sequenced ops of the client"""
+    return snapshotBody(sequenced, b"".join(encodeTile(0, key, compressTile(tile)) for key, tile in canvas.tiles.items()))
+
+
+@pytest.fixture
+def client(app):
+    painter = Painter()
+    painter.strokeFilter = None
+    painter.brushColor, painter.brushWidth = QColor("blue"), 5
+    client = SessionClient(painter)
+    client.active, client.number = True, 1
+    client.info = {"width": 600, "height": 400, "format": int(QImage.Format_RGB32),
+                   "background": QColor("white").rgba(), "tileSize": 256}
+    client.handleFrame(SNAPSHOT, snapshot(TiledCanvas(600, 400), 0))
+    yield client
+    client.frameTimer.stop()
+
+
+def drawStroke(painter, points):
+    painter.beginStroke(QPoint(*points[0]))
+    for point in points[1:]:
+        painter.stroke.addPoint(QPoint(*point))
+    painter.endStroke()
+
+
+def serverCanvas():
+    """The canvas of the server with a red line another client drew"""
+    canvas = TiledCanvas(600, 400)
+    applyOp(canvas, OP_POLYLINE, (QPen(QColor("red"), 9), [QPoint(0, 200), QPoint(590, 200)]))
+    return canvas
+
+
+def test_resync_draws_the_unsequenced_own_ops_over_the_snapshot(client):
+    painter = client.painter
+    drawStroke(painter, [(300, 10), (300, 390)])
+    assert len(client.unacknowledged) == 2  # the first point and the polyline
+
+    client.handleFrame(SNAPSHOT, snapshot(serverCanvas(), 0))  # the server has not drawn the stroke yet
+    image = painter.image
+    assert image.pixelColor(100, 200) == QColor("red")
+    assert image.pixelColor(300, 100) == image.pixelColor(300, 200) == QColor("blue")
+    assert len(client.unacknowledged) == 2
+
+    # the stroke comes back in a later batch, on top of the red line
+    client.handleFrame(BATCH, b"".join(stampClient(record, 1) for record in client.outgoing))
+    assert len(client.unacknowledged) == 0 and client.confirmed == {}
+    assert painter.image.pixelColor(300, 200) == QColor("blue")
+
+
+def test_resync_drops_the_own_ops_the_snapshot_includes(client):
+    painter = client.painter
+    drawStroke(painter, [(300, 10), (300, 390)])
+    canvas = serverCanvas()
+    for kind, payload, _ in client.unacknowledged:  # the server drew the stroke before the batches were skipped
+        applyOp(canvas, kind, payload)
+
+    client.handleFrame(SNAPSHOT, snapshot(canvas, 2))
+    assert len(client.unacknowledged) == 0 and client.pendingOps == {}
+    assert painter.image == canvas.toImage()
+    assert client.acknowledged == 2
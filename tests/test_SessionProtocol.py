@@ -0,0 +1,143 @@
+import struct
+import zlib
+
+import pytest
+from PyQt5.QtGui import QColor, QImage, QPen
+from PyQt5.QtCore import QPoint, QPointF, QRect, Qt
+
+from BrushEngine import MAX_BRUSH_WIDTH, dabCache
+from TiledCanvas import TiledCanvas
+from SessionProtocol import BATCH, DAB_FORMAT, HELLO, OP_DAB, OP_POLYLINE, OP_TILE, POLYLINE_FORMAT, SNAPSHOT, \
+    ProtocolError, applyOp, compressTile, decodeOps, decodeTile, encodeDab, encodePolyline, encodeTile, frame, \
+    frameBody, jsonFrame, opKeys, snapshotBody, splitFrames, splitSnapshot, stampClient
+import SessionProtocol
+
+
+def newCanvas():
+    return TiledCanvas(600, 400, QImage.Format_RGB32, Qt.white)
+
+
+def dabKey():
+    return dabCache.key(QColor(200, 0, 0), 12, 0.5, 1.0, 0, 1.0)
+
+
+def polylineRecord(style=Qt.SolidLine, width=5.0, count=None, points=((10, 10), (300, 20))):
+    coordinates = [value for point in points for value in point]
+    return struct.pack(POLYLINE_FORMAT, OP_POLYLINE, 0, QColor("red").rgba(), width, int(style), int(Qt.RoundCap),
+                       int(Qt.RoundJoin), len(points) if count is None else count) + \
+        struct.pack("<{}i".format(len(coordinates)), *coordinates)
+
+
+def test_ops_round_trip(app):
+    canvas = newCanvas()
+    tile = canvas.blankTile.copy()
+    tile.fill(QColor("green"))
+    pen = QPen(QColor(10, 20, 30, 200), 7, Qt.DashLine, Qt.RoundCap, Qt.BevelJoin)
+    records = [encodePolyline(1, pen, [QPoint(1, 2), QPoint(-5, 300)]),
+               encodeDab(2, dabKey(), QPointF(10.5, 20.25)),
+               encodeTile(3, (1, 1), compressTile(tile)),
+               encodeTile(3, (2, 0), compressTile(None))]
+    ops = list(decodeOps(b"".join(records)))
+
+    assert [(kind, client) for kind, client, _, _ in ops] == [(OP_POLYLINE, 1), (OP_DAB, 2), (OP_TILE, 3), (OP_TILE, 3)]
+    assert [record for _, _, _, record in ops] == records
+    decodedPen, points = ops[0][2]
+    assert decodedPen == pen
+    assert points == [QPoint(1, 2), QPoint(-5, 300)]
+    assert ops[1][2] == (dabKey(), QPointF(10.5, 20.25))
+    assert decodeTile(canvas, ops[2][2][1]) == tile
+    assert decodeTile(canvas, ops[3][2][1]) is None
+
+
+def test_stamp_client(app):
+    record = encodeDab(0, dabKey(), QPointF(0, 0))
+    [(_, client, _, stamped)] = decodeOps(stampClient(record, 7))
+    assert client == 7
+    assert stamped[3:] == record[3:]
+
+
+def test_frames_split_at_any_byte(app):
+    data = jsonFrame(HELLO, {"version": 1}) + frame(BATCH, polylineRecord()) + frame(SNAPSHOT, snapshotBody(3, b""))
+    buffer = bytearray()
+    frames = []
+    for byte in data:
+        buffer.append(byte)
+        frames += splitFrames(buffer)
+    assert [kind for kind, _ in frames] == [HELLO, BATCH, SNAPSHOT]
+    assert frames[1][1] == polylineRecord()  # BATCH bodies are decompressed
+    assert splitSnapshot(frames[2][1]) == (3, b"")
+    assert buffer == bytearray()
+
+
+def test_broken_frames(app):
+    with pytest.raises(ProtocolError):
+        splitFrames(bytearray(struct.pack("<IB", 1 << 30, BATCH)))  # too large
+    with pytest.raises(ProtocolError):
+        splitFrames(bytearray(struct.pack("<IB", 3, BATCH) + b"abc"))  # not zlib
+    with pytest.raises(ProtocolError):
+        frameBody(BATCH, zlib.compress(polylineRecord()) + b"trailing")
+    with pytest.raises(ProtocolError):
+        frameBody(BATCH, zlib.compress(polylineRecord())[:-3])
+    with pytest.raises(ProtocolError):
+        splitSnapshot(b"\x01")
+
+
+def test_bodies_inflating_beyond_the_limit(monkeypatch):
+    monkeypatch.setattr(SessionProtocol, "MAX_FRAME", 4096)
+    bomb = zlib.compress(bytes(100000))  # a hundred bytes inflating into a hundred kilobytes
+    assert len(bomb) < 4096
+    with pytest.raises(ProtocolError):
+        frameBody(BATCH, bomb)
+    assert frameBody(BATCH, zlib.compress(bytes(4096))) == bytes(4096)
+
+
+@pytest.mark.parametrize("data", [
+    polylineRecord()[:-1],  # last coordinate cut short
+    polylineRecord(count=1000),  # more points than bytes
+    polylineRecord(count=0),
+    polylineRecord(style=99),
+    polylineRecord(width=float("nan")),
+    encodeDab(0, dabKey(), QPointF(0, 0))[:-4],
+    struct.pack(DAB_FORMAT, OP_DAB, 0, 0, 10 ** 6, 10, 64, 0, 20, 0, 0),  # a dab of a 500000 px brush
+    struct.pack(DAB_FORMAT, OP_DAB, 0, 0, 24, 10, 64, 0, 20, float("inf"), 0),
+    encodeTile(0, (0, 0), b"0123456789")[:-2],
+    b"\x09\x00\x00",  # unknown op
+    b"\x01",
+], ids=["truncated coordinates", "point count", "no points", "pen style", "pen width", "truncated dab", "huge dab",
+        "dab position", "truncated tile", "unknown op", "truncated header"])
+def test_malformed_ops(app, data):
+    with pytest.raises(ProtocolError):
+        list(decodeOps(data))
+
+
+def test_pen_width_is_clamped(app):
+    [(_, _, (pen, _), _)] = decodeOps(polylineRecord(width=1e9))
+    assert pen.widthF() == MAX_BRUSH_WIDTH
+
+
+def test_tiles_are_checked_against_the_canvas(app):
+    canvas = newCanvas()
+    with pytest.raises(ProtocolError):
+        decodeTile(canvas, compressTile(QImage(16, 16, QImage.Format_RGB32)))
+    with pytest.raises(ProtocolError):
+        decodeTile(canvas, b"not zlib")
+    with pytest.raises(ProtocolError):
+        decodeTile(canvas, zlib.compress(bytes(canvas.blankTile.sizeInBytes() * 100)))  # more pixels than a tile
+    [(kind, _, payload, _)] = decodeOps(encodeTile(0, (5, 0), b""))
+    with pytest.raises(ProtocolError):
+        opKeys(canvas, kind, payload)
+
+
+def test_apply_op(app):
+    canvas = newCanvas()
+    [(kind, _, payload, _)] = decodeOps(polylineRecord())
+    changed = applyOp(canvas, kind, payload)
+    assert set(canvas.tiles) == {(0, 0), (1, 0)}
+    assert changed.contains(QRect(10, 10, 290, 10))
+    assert canvas.toImage().pixelColor(155, 15) == QColor("red")  # on the line from (10, 10) to (300, 20)
+
+    tile = canvas.blankTile.copy()
+    tile.fill(QColor("blue"))
+    for kind, _, payload, _ in decodeOps(encodeTile(0, (0, 0), compressTile(tile)) + encodeTile(0, (1, 0), b"")):
+        applyOp(canvas, kind, payload)
+    assert canvas.tiles == {(0, 0): tile}  # an empty tile op makes the tile blank
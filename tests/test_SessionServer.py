@@ -0,0 +1,96 @@
+import asyncio
+import json
+import struct
+import zlib
+
+import pytest
+from PyQt5.QtGui import QColor, QImage, QPen
+from PyQt5.QtCore import QPoint, Qt
+
+from TiledCanvas import TiledCanvas
+from SessionProtocol import BATCH, DAB_FORMAT, HEADER_FORMAT, HEADER_SIZE, HELLO, OP_DAB, OP_POLYLINE, OPS, SNAPSHOT, \
+    VERSION, WELCOME, decodeOps, encodePolyline, encodeTile, frame, frameBody, jsonFrame, splitFrames, \
+    splitSnapshot
+from SessionServer import SessionServer
+
+
+async def readFrame(reader):
+    length, kind = struct.unpack(HEADER_FORMAT, await reader.readexactly(HEADER_SIZE))
+    return kind, frameBody(kind, await reader.readexactly(length))
+
+
+async def join(port, name):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(jsonFrame(HELLO, {"version": VERSION, "name": name}))
+    kind, body = await readFrame(reader)
+    assert kind == WELCOME
+    welcome = json.loads(body)
+    kind, body = await readFrame(reader)
+    assert kind == SNAPSHOT
+    sequenced, snapshot = splitSnapshot(body)
+    assert sequenced == 0  # a new client has not sent anything yet
+    return reader, writer, welcome["client"], snapshot
+
+
+def runSession(session):
+    """Runs a coroutine taking (server, port) against a server with a 600x400 canvas"""
+    async def main():
+        server = SessionServer(TiledCanvas(600, 400, QImage.Format_RGB32, Qt.white), log=lambda message: None)
+        ready = asyncio.Event()
+        serving = asyncio.ensure_future(server.serve("127.0.0.1", 0, ready.set))
+        await ready.wait()
+        try:
+            await asyncio.wait_for(session(server, server.port), 10)
+        finally:
+            serving.cancel()
+    asyncio.run(main())
+
+
+def test_batches_reach_every_client(app):
+    async def session(server, port):
+        readerA, writerA, clientA, snapshot = await join(port, "a")
+        assert snapshot == b""  # nothing painted yet
+        readerB, writerB, _, _ = await join(port, "b")
+        record = encodePolyline(0, QPen(QColor("red"), 5), [QPoint(10, 10), QPoint(300, 20)])
+        writerA.write(frame(OPS, record))
+        for reader in (readerA, readerB):  # the sender gets its own op back as its acknowledgement
+            kind, body = await readFrame(reader)
+            assert kind == BATCH
+            assert [(kind, client) for kind, client, _, _ in decodeOps(body)] == [(OP_POLYLINE, clientA)]
+        assert server.canvas.toImage().pixelColor(155, 15) == QColor("red")
+
+        readerC, writerC, _, snapshot = await join(port, "late")  # its snapshot already holds the line
+        assert sorted(payload[0] for _, _, payload, _ in decodeOps(snapshot)) == [(0, 0), (1, 0)]
+        for writer in (writerA, writerB, writerC):
+            writer.close()
+    runSession(session)
+
+
+@pytest.mark.parametrize("record", [
+    struct.pack(DAB_FORMAT, OP_DAB, 0, 0, 10 ** 6, 10, 64, 0, 20, 0, 0),  # a dab of a 500000 px brush
+    encodeTile(0, (0, 0), b"not zlib"),
+    encodeTile(0, (0, 0), zlib.compress(bytes(100))),  # not the pixels of a tile
+], ids=["huge dab", "broken tile", "tile size"])
+def test_invalid_ops_disconnect_the_client(app, record):
+    async def session(server, port):
+        reader, writer, _, _ = await join(port, "a")
+        writer.write(frame(OPS, encodePolyline(0, QPen(QColor("red"), 5), [QPoint(10, 10)]) + record))
+        assert await reader.read() == b""  # closed without a batch, the valid op before is dropped too
+        assert server.pending == [] and server.canvas.tiles == {}
+        writer.close()
+    runSession(session)
+
+
+def test_snapshots_count_the_own_ops_they_include(app):
+    async def session(server, port):
+        reader, writer, client, _ = await join(port, "a")
+        records = [encodePolyline(0, QPen(QColor("red"), 5), [QPoint(10, 10 * i), QPoint(300, 20)]) for i in range(3)]
+        writer.write(frame(OPS, b"".join(records)))
+        kind, body = await readFrame(reader)
+        assert len(list(decodeOps(body))) == 3
+        participant = server.participants[client]
+        assert participant.sequenced == 3
+        [(kind, body)] = splitFrames(bytearray(server.snapshotFrame(participant)))
+        assert kind == SNAPSHOT and splitSnapshot(body)[0] == 3
+        writer.close()
+    runSession(session)
@@ -0,0 +1,32 @@
+from PyQt5.QtCore import QPoint
+
+from StrokeFilter import StrokeFilter, simplify
+
+
+def test_close_points_are_dropped_but_the_stroke_ends_on_the_last_one():
+    strokeFilter = StrokeFilter(minDistance=5)
+    points = [QPoint(1, 0), QPoint(6, 0), QPoint(7, 1), QPoint(8, 12), QPoint(9, 12)]
+    assert strokeFilter.decimate(QPoint(0, 0), points) == [QPoint(6, 0), QPoint(8, 12)]
+    assert strokeFilter.decimate(QPoint(0, 0), points, final=True)[-1] == QPoint(9, 12)
+
+
+def test_collinear_points_are_simplified():
+    points = [QPoint(x, 0) for x in range(0, 100, 10)] + [QPoint(90, 50)]
+    assert simplify(points, 0.75) == [QPoint(0, 0), QPoint(90, 0), QPoint(90, 50)]
+    assert simplify(points, 0) == points
+
+
+def test_straight_segments_by_default():
+    strokeFilter = StrokeFilter()
+    assert not strokeFilter.smooth
+    points = [QPoint(10, 0), QPoint(20, 10), QPoint(30, 0)]
+    assert strokeFilter.process(None, QPoint(0, 0), points) == points
+
+
+def test_smoothing_fits_a_curve_through_the_kept_points():
+    strokeFilter = StrokeFilter(smooth=True)
+    points = [QPoint(10, 0), QPoint(20, 10), QPoint(30, 0)]
+    curve = strokeFilter.process(None, QPoint(0, 0), points)
+    assert len(curve) > len(points)
+    assert curve[-1] == QPoint(30, 0)
+    assert all(point in curve for point in points)  # the curve passes through the points
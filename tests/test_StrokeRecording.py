@@ -0,0 +1,56 @@
+from PyQt5.QtGui import QColor
+from PyQt5.QtCore import QPoint, Qt
+
+import pytest
+
+from Painter import Painter
+from StrokeRecording import StrokeRecording
+
+
+@pytest.fixture
+def painter(app):
+    painter = Painter()
+    painter.strokeFilter = None
+    painter.brushColor, painter.brushWidth = QColor("navy"), 7
+    return painter
+
+
+def drawStroke(painter, points, flushEvery=2):
+    painter.beginStroke(points[0])
+    for i, point in enumerate(points[1:]):
+        painter.stroke.addPoint(point)
+        if i % flushEvery == 0:
+            painter.stroke.flush()
+    painter.endStroke()
+
+
+def test_replay_draws_the_live_strokes(painter):
+    drawStroke(painter, [QPoint(20, 20), QPoint(200, 40), QPoint(90, 150), QPoint(300, 250)])
+    painter.brushColor, painter.brushCap = QColor("orange"), Qt.FlatCap
+    drawStroke(painter, [QPoint(350, 20), QPoint(30, 280)], flushEvery=1)
+    drawStroke(painter, [QPoint(100, 100)])  # a single dab
+
+    recording = painter.recording
+    assert len(recording.strokes) == 3 and recording.pointCount() == 7
+    assert recording.render() == painter.image
+
+
+def test_save_and_load_round_trip(painter, tmp_path):
+    drawStroke(painter, [QPoint(20, 20), QPoint(200, 40), QPoint(90, 150)])
+    path = str(tmp_path / "strokes.rec")
+    painter.recording.save(path)
+
+    loaded = StrokeRecording.load(path)
+    assert (loaded.width, loaded.height) == (painter.layers.width, painter.layers.height)
+    assert loaded.background == QColor("white").rgba()
+    record = loaded.strokes[0]
+    assert list(record.xs) == [20, 200, 90] and list(record.flushes) == list(painter.recording.strokes[0].flushes)
+    assert record.pen() == painter.recording.strokes[0].pen()
+    assert loaded.render() == painter.image
+
+
+def test_load_rejects_other_files(app, tmp_path):
+    path = tmp_path / "other.rec"
+    path.write_bytes(b"\0" * 64)
+    with pytest.raises(ValueError):
+        StrokeRecording.load(str(path))
@@ -0,0 +1,65 @@
+import pytest
+from PyQt5.QtGui import QColor
+from PyQt5.QtCore import QPoint, Qt
+
+from Painter import Painter
+
+
+@pytest.fixture
+def painter(app):
+    painter = Painter()
+    painter.resize(600, 400)
+    painter.strokeFilter = None
+    painter.brushColor, painter.brushWidth = QColor("red"), 5
+    return painter
+
+
+def test_one_painter_per_tile_for_the_whole_stroke(painter):
+    painter.beginStroke(QPoint(10, 10))
+    stroke = painter.stroke
+    first = stroke.tilePainters[(0, 0)]
+    stroke.addPoint(QPoint(100, 20))
+    stroke.flush()
+    stroke.addPoint(QPoint(400, 30))  # reaches the next tile
+    stroke.flush()
+    assert stroke.tilePainters[(0, 0)] is first
+    assert set(stroke.tilePainters) == {(0, 0), (1, 0)}
+    assert all(tilePainter.isActive() for tilePainter in stroke.tilePainters.values())
+
+    painters = list(stroke.tilePainters.values())
+    painter.endStroke()
+    assert not any(tilePainter.isActive() for tilePainter in painters)
+    assert painter.stroke is None
+
+
+def test_points_are_drawn_when_flushed(painter):
+    painter.beginStroke(QPoint(10, 10))
+    painter.stroke.addPoint(QPoint(200, 10))
+    assert painter.canvas.toImage().pixelColor(100, 10) == QColor("white")  # buffered until the next paint
+    painter.stroke.flush()
+    assert painter.canvas.toImage().pixelColor(100, 10) == QColor("red")
+    painter.endStroke()
+
+
+def test_pen_is_only_rebuilt_when_the_brush_changes(painter):
+    painter.beginStroke(QPoint(10, 10))
+    stroke = painter.stroke
+    pen = stroke.pen
+    stroke.addPoint(QPoint(50, 10))
+    stroke.flush()
+    assert stroke.pen is pen
+
+    painter.brushColor = QColor("green")
+    stroke.addPoint(QPoint(100, 10))
+    stroke.flush()
+    assert stroke.pen is not pen and stroke.pen.color() == QColor("green")
+    painter.endStroke()
+    assert painter.canvas.toImage().pixelColor(75, 10) == QColor("green")
+
+
+def test_release_draws_the_last_points(painter):
+    painter.beginStroke(QPoint(10, 50))
+    painter.stroke.addPoint(QPoint(300, 50))
+    painter.endStroke()  # without a paint event in between
+    assert painter.canvas.toImage().pixelColor(290, 50) == QColor("red")
+    assert painter.history.canUndo()
@@ -0,0 +1,110 @@
+from PyQt5.QtGui import QColor, QImage, QPainter
+from PyQt5.QtCore import QRect, Qt
+
+from TiledCanvas import TiledCanvas, defaultColorTable
+from History import History
+
+
+def paintRect(canvas, rect, color, history=None):
+    """Fills a canvas rectangle the way a stroke writes its tiles, as one undo step if a history is given"""
+    if history:
+        history.beginStep()
+    for key in canvas.tileKeys(rect):
+        tilePainter = QPainter(canvas.tileForWrite(key))
+        tilePainter.translate(-canvas.tileRect(key).topLeft())
+        tilePainter.fillRect(rect, QColor(color))
+        tilePainter.end()
+    canvas.touch(list(canvas.tileKeys(rect)), rect)
+    canvas.pack()
+    if history:
+        history.endStep()
+
+
+def listen(canvas):
+    """Records the keys the write and change listeners of a canvas are called with"""
+    written, changed = [], []
+    canvas.writeListeners.append(lambda canvas, key: written.append(key))
+    canvas.changeListeners.append(lambda canvas, keys, rect: changed.extend(keys))
+    return written, changed
+
+
+def test_blank_tiles_are_shared_until_written(app):
+    canvas = TiledCanvas(600, 400, QImage.Format_RGB32, Qt.white)
+    assert canvas.tile((1, 1)) is canvas.blankTile
+    canvas.tileForWrite((1, 1))
+    assert set(canvas.tiles) == {(1, 1)}
+
+
+def test_changed_since(app):
+    canvas = TiledCanvas(600, 400, QImage.Format_RGB32, Qt.white)
+    revision = canvas.revision
+    paintRect(canvas, QRect(300, 300, 10, 10), "red")
+    assert canvas.changedSince(revision) == [(1, 1)]
+
+
+def test_extend_clears_the_edges_through_the_listeners(app):
+    canvas = TiledCanvas(100, 100, QImage.Format_RGB32, Qt.white)
+    paintRect(canvas, QRect(0, 0, 200, 200), "red")  # a stroke painting past the edge
+    written, changed = listen(canvas)
+
+    canvas.extend(300, 300)
+    assert written == [(0, 0)] and changed == [(0, 0)]
+    image = canvas.toImage()
+    assert image.pixelColor(50, 50) == QColor("red")
+    assert image.pixelColor(150, 50) == QColor("white")
+
+
+def test_extend_leaves_clean_edge_tiles_alone(app):
+    canvas = TiledCanvas(100, 100, QImage.Format_RGB32, Qt.white)
+    paintRect(canvas, QRect(10, 10, 50, 50), "red")  # stays inside the canvas
+    tile = canvas.tiles[(0, 0)]
+    written, changed = listen(canvas)
+
+    canvas.extend(300, 300)
+    assert written == [] and changed == []
+    assert canvas.tiles[(0, 0)] is tile
+
+
+def test_indexed_tiles_unpack_for_painting_and_pack_again(app):
+    canvas = TiledCanvas(600, 400, QImage.Format_Indexed8, Qt.white)
+    assert canvas.colorTable == defaultColorTable()
+    tile = canvas.tileForWrite((0, 0))
+    assert tile.format() == canvas.paintFormat
+    tile.fill(QColor(255, 0, 0))
+    assert canvas.pack() == QRect(0, 0, 256, 256)
+    packed = canvas.tiles[(0, 0)]
+    assert packed.format() == QImage.Format_Indexed8
+    assert packed.pixelColor(5, 5) == QColor(255, 0, 0)  # pure red is in the palette
+    assert canvas.toImage().format() == canvas.paintFormat
+
+
+def test_indexed_pack_snaps_to_the_palette_and_undoes(app):
+    history = History()
+    canvas = TiledCanvas(600, 400, QImage.Format_Indexed8, Qt.white)
+    canvas.writeListeners.append(history.tileWillChange)
+    paintRect(canvas, QRect(0, 0, 40, 40), QColor(250, 5, 3), history)
+    assert canvas.tiles[(0, 0)].format() == QImage.Format_Indexed8
+    assert canvas.toImage().pixelColor(10, 10) == QColor(255, 0, 0)  # the nearest palette colour
+    history.undo()
+    assert canvas.tiles == {}
+    history.redo()
+    assert canvas.tiles[(0, 0)].format() == QImage.Format_Indexed8
+
+
+def test_indexed_image_round_trip(app):
+    image = QImage(300, 200, QImage.Format_Indexed8)
+    image.setColorTable([QColor("white").rgb(), QColor("black").rgb(), QColor(0, 128, 255).rgb()])
+    image.fill(0)
+    for x in range(260, 300):
+        image.setPixel(x, 100, 2)
+    canvas = TiledCanvas.fromImage(image, QImage.Format_Indexed8, Qt.white, colorTable=image.colorTable())
+    assert list(canvas.tiles) == [(1, 0)]  # the tile holding only the background stays blank
+    assert canvas.toImage().convertToFormat(QImage.Format_RGB32) == image.convertToFormat(QImage.Format_RGB32)
+
+
+def test_grayscale_canvas_keeps_one_byte_per_pixel(app):
+    canvas = TiledCanvas(600, 400, QImage.Format_Grayscale8, Qt.white)
+    paintRect(canvas, QRect(0, 0, 10, 10), QColor(0, 0, 0))
+    assert canvas.tiles[(0, 0)].format() == QImage.Format_Grayscale8
+    assert canvas.memoryUsage() == 256 * 256
+    assert canvas.toImage().pixelColor(5, 5) == QColor("black")